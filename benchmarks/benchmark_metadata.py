@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+"""
+Compares the two engines for the extraction of the metadata (see get_metadata.py)
+on synthetic XML-TEI files: time per file and peak memory.
+
+Usage: python3 benchmarks/benchmark_metadata.py [number of files] [size in MB]
+"""
+
+import sys
+import tempfile
+import time
+import tracemalloc
+from os.path import dirname, abspath
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+import get_metadata
+import synthetic
+
+
+# === Functions ===
+
+def measure(filenames, engine):
+    """
+    Extracts the metadata of all files with the engine.
+
+    output: results, seconds, peak memory in MB
+    """
+    tracemalloc.start()
+    start = time.perf_counter()
+    results = [get_metadata.extract_metadata(file, engine) for file in filenames]
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 2**20
+    tracemalloc.stop()
+    return results, seconds, peak
+
+
+def main(count=5, size=5):
+    with tempfile.TemporaryDirectory() as folder:
+        filenames = synthetic.create_tei_collection(folder, int(count), int(float(size) * 2**20))
+        results = {}
+        for engine in ["bs4", "stream"]:
+            results[engine], seconds, peak = measure(filenames, engine)
+            print("{:7} {:8.4f} s/file {:10.2f} MB peak".format(engine, seconds / len(filenames), peak))
+        if results["bs4"] != results["stream"]:
+            print("Engines disagree!")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
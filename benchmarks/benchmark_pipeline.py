@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+"""
+End-to-end benchmark of run_worldcat.py on synthetic data.
+
+For each scale (number of novels), a synthetic ELTeC collection and synthetic worldcat
+result pages are generated (see synthetic.py), the pages are served by stub_worldcat.py
+and all stages are run as in a normal run. The timing report of the run (see
+instrumentation.py) is saved in benchmarks/results/<commit>.json, so that the results
+of different commits can be compared:
+
+python3 benchmarks/benchmark_pipeline.py run [scales ...]       (default: 100 1000 10000)
+python3 benchmarks/benchmark_pipeline.py compare [result files ...]
+
+The data is generated with a fixed seed, so every run works on the same novels and pages.
+Options for the generator and for config.yaml can be changed in PARAMETERS and OPTIONS.
+"""
+
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from os.path import dirname, abspath, join, isfile
+
+import yaml
+
+BENCHMARKS = dirname(abspath(__file__))
+sys.path.insert(0, dirname(BENCHMARKS))
+
+import get_metadata
+import get_settings
+import get_htmlworldcat
+import html_store
+import run_worldcat
+import stub_worldcat
+import synthetic
+
+
+SCALES = [100, 1000, 10000]
+RESULTS = join(BENCHMARKS, "results")
+STAGES = ["get_metadata", "get_htmlworldcat", "create_publicationtable", "create_summary"]
+
+PARAMETERS = {                      # synthetic data
+    "tei_size": 20000,              # size of a novel in bytes
+    "pages": [1, 6],                # range of the number of result pages per novel
+    "hits_per_page": 10,
+    "missing_year_rate": 0.1,
+    "wrong_language_rate": 0.2,
+    "no_result_rate": 0.05,
+    "padding": 20000,               # bytes of markup per result page
+    "seed": 0,
+    }
+
+OPTIONS = {                         # config.yaml of the benchmark run
+    "lang": "fra",
+    "basedir": "corpus",
+    "level": "level1",
+    "write_file": "html",
+    "htmlpages": "html/*.html",
+    "requests_per_second": 0,       # the stub does not need politeness
+    "report_folder": "reports",
+    }
+
+
+# === Functions ===
+
+def get_commit():
+    """
+    Short hash of the checked out commit, with "-dirty" if there are uncommitted changes.
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCHMARKS, capture_output=True, text=True, check=True).stdout.strip()
+        status = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=BENCHMARKS, capture_output=True, text=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    if status.strip():
+        commit += "-dirty"
+    return commit
+
+
+def prepare(count, parameters):
+    """
+    Generates the synthetic collection and the result pages in the current folder:
+    corpus/ELTeC-fra/level1/*.xml and the pages to be served in source/fra.sqlite.
+
+    output: settings_dict, metadata table, store with the pages
+    """
+    settings_dict = get_settings.main(OPTIONS["lang"], OPTIONS["basedir"], OPTIONS["level"], OPTIONS["write_file"], OPTIONS["htmlpages"], OPTIONS)
+    folder = join(OPTIONS["basedir"], "ELTeC-" + OPTIONS["lang"], OPTIONS["level"])
+    synthetic.create_tei_collection(folder, count, parameters["tei_size"], prefix=OPTIONS["lang"].upper(), seed=parameters["seed"])
+    get_metadata.main(settings_dict)
+    data = get_htmlworldcat.read_csv(settings_dict["csv_file"])
+    store = html_store.SqliteStore(join("source", OPTIONS["lang"] + ".sqlite"))
+    options = {key: parameters[key] for key in ["hits_per_page", "missing_year_rate", "wrong_language_rate", "padding"]}
+    synthetic.create_worldcat_pages(store, data, parameters["seed"], parameters["no_result_rate"], pages=tuple(parameters["pages"]), **options)
+    os.remove(settings_dict["csv_file"])
+    return settings_dict, data, store
+
+
+def run_scale(count, parameters):
+    """
+    Runs all stages for count synthetic novels in a temporary folder.
+
+    output: timing report of the run (see instrumentation.py)
+    """
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as folder:
+        os.chdir(folder)
+        try:
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                settings_dict, data, store = prepare(count, parameters)
+                server = stub_worldcat.start_server(settings_dict, data, store)
+                config = dict(OPTIONS, worldcat_url="http://127.0.0.1:{}".format(server.server_port))
+                with open("config.yaml", "w", encoding="utf8") as outfile:
+                    yaml.safe_dump(config, outfile)
+                try:
+                    run_worldcat.main("config.yaml")
+                finally:
+                    server.shutdown()
+                    store.close()
+            reports = sorted(os.listdir(OPTIONS["report_folder"]))
+            with open(join(OPTIONS["report_folder"], reports[-1]), "r", encoding="utf8") as infile:
+                return json.load(infile)
+        finally:
+            os.chdir(cwd)
+
+
+def save_results(results):
+    """
+    Adds the results to benchmarks/results/<commit>.json (a later run of the same scale replaces the earlier one).
+    """
+    os.makedirs(RESULTS, exist_ok=True)
+    filename = join(RESULTS, results["commit"] + ".json")
+    saved = {"commit": results["commit"], "scales": {}}
+    if isfile(filename):
+        with open(filename, "r", encoding="utf8") as infile:
+            saved = json.load(infile)
+    saved.update({key: value for key, value in results.items() if key != "scales"})
+    saved["scales"].update(results["scales"])
+    with open(filename, "w", encoding="utf8") as outfile:
+        json.dump(saved, outfile, indent=2)
+    return filename
+
+
+def get_stage_seconds(report):
+    """
+    Wall time of each stage in a report (stages run several times are added up).
+    """
+    seconds = {}
+    for stage in report["stages"]:
+        seconds[stage["stage"]] = seconds.get(stage["stage"], 0) + stage["wall_seconds"]
+    return seconds
+
+
+def print_table(results):
+    """
+    One line per commit and scale with the wall time of each stage.
+    """
+    print("{:14} {:>7} ".format("commit", "novels") + " ".join("{:>24}".format(stage) for stage in STAGES) + " {:>9}".format("total"))
+    for result in results:
+        for scale, report in sorted(result["scales"].items(), key=lambda item: int(item[0])):
+            seconds = get_stage_seconds(report)
+            print("{:14} {:>7} ".format(result["commit"], scale)
+                  + " ".join("{:>24.2f}".format(seconds.get(stage, float("nan"))) for stage in STAGES)
+                  + " {:>9.2f}".format(report["wall_seconds"]))
+
+
+def run(*scales):
+    scales = [int(scale) for scale in scales] or SCALES
+    results = {"commit": get_commit(), "date": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+               "machine": platform.platform(), "cpus": os.cpu_count(), "parameters": PARAMETERS, "options": OPTIONS, "scales": {}}
+    for count in scales:
+        print("Running {} novels ...".format(count))
+        results["scales"][str(count)] = run_scale(count, PARAMETERS)
+        print_table([{"commit": results["commit"], "scales": {str(count): results["scales"][str(count)]}}])
+    print("Saved:", save_results(results))
+
+
+def compare(*filenames):
+    if not filenames:
+        filenames = sorted((join(RESULTS, name) for name in os.listdir(RESULTS) if name.endswith(".json")), key=os.path.getmtime)
+    results = []
+    for filename in filenames:
+        with open(filename, "r", encoding="utf8") as infile:
+            results.append(json.load(infile))
+    print_table(results)
+
+
+# === Coordinating function ===
+
+def main(command="run", *args):
+    if command == "run":
+        run(*args)
+    elif command == "compare":
+        compare(*args)
+    else:
+        print("Usage: python3 benchmarks/benchmark_pipeline.py run [scales ...] | compare [result files ...]")
+
+
+if __name__ == "__main__":          # required for the process pools (e.g. on Windows)
+    main(*sys.argv[1:])
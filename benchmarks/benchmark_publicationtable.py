@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+"""
+Compares the extraction of the hits from the worldcat result pages (see create_publicationtable.py):
+the former row-by-row DataFrame (one append per hit, then iterrows) with the columnar,
+vectorized extraction. The pages are parsed once beforehand, so only the extraction is timed.
+
+Usage: python3 benchmarks/benchmark_publicationtable.py [lang]
+"""
+
+import glob
+import logging
+import re
+import sys
+import time
+from os.path import dirname, abspath, join, basename, splitext
+
+import pandas as pd
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+import create_publicationtable
+import get_settings
+
+
+# === Functions ===
+
+def read_html(file):
+    """
+    input: html file
+    output: page parsed with Beautiful Soup
+    """
+    from bs4 import BeautifulSoup as bs
+    with open(file, "r", encoding="utf8") as infile:
+        return bs(infile.read(), "html.parser")
+
+
+def rowwise_years(html, settings_dict):
+    """
+    The former way: one DataFrame row per hit, language test and year check with iterrows.
+    """
+    df_worldcat = pd.DataFrame(columns=['number', 'itemLanguage', 'year'])
+    for item in html.find_all('tr', {'class' : 'menuElem'}):
+        number = item.find('div', {'class' : 'item_number'}).get_text()
+        itemLang = item.find('span', {'class' : 'itemLanguage'}).get_text()
+        try:
+            year = item.find('span', {'class' : 'itemPublisher'}).get_text()
+            year = re.search("[0-9]+", year).group()
+        except AttributeError:
+            year = "0"
+        row = pd.DataFrame([{'number': number, 'itemLanguage': itemLang, 'year': year}])
+        df_worldcat = pd.concat([df_worldcat, row], ignore_index=True)
+    skip = []
+    for index, row in df_worldcat.iterrows():
+        if row['itemLanguage'] != settings_dict["lang_hit"]:
+            skip.append(row['number'])
+    publist = []
+    for index, row in df_worldcat.iterrows():
+        if row['number'] not in skip:
+            year = int(row['year'])
+            if year not in range(1840, 2020):
+                year = 0
+            publist.append(year)
+    return publist
+
+
+def columnar_years(html, settings_dict, id_ext):
+    """
+    The columnar way: one pass over the hits, vectorized selection.
+    """
+    hits = create_publicationtable.extract_hits(html, id_ext)
+    return create_publicationtable.get_publicationyears(hits, settings_dict).tolist()
+
+
+def main(lang="fra"):
+    logging.disable(logging.WARNING)
+    settings_dict = get_settings.main(lang, ".", "level1", "html", "html/*.html")
+    files = sorted(glob.glob(join(dirname(dirname(abspath(__file__))), "html", lang, "*.html")))
+    pages = [(splitext(basename(file))[0], read_html(file)) for file in files]
+    print("Pages:", len(pages))
+
+    start = time.perf_counter()
+    rowwise = [rowwise_years(html, settings_dict) for id_ext, html in pages]
+    rowwise_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    columnar = [columnar_years(html, settings_dict, id_ext) for id_ext, html in pages]
+    columnar_time = time.perf_counter() - start
+
+    print("row-wise  {:8.3f} ms/page".format(1000 * rowwise_time / len(pages)))
+    print("columnar  {:8.3f} ms/page".format(1000 * columnar_time / len(pages)))
+    if rowwise != columnar:
+        print("Results differ!")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+"""
+Compares the orders of the download (harvest_order in config.yaml) against the stub server:
+the saved pages of a language are served by the stub with a fixed delay per request, like
+the response time of worldcat, and downloaded once with each order into a temporary folder.
+Shows the total time (makespan) and the time in which only a few requests were running
+at the end (the "tail"), and checks that the pages are the same as the originals.
+With "reverse", the metadata table is reversed, with "shuffle" it is mixed (seed 0).
+
+Usage: python3 benchmarks/benchmark_schedule.py [lang] [delay] [workers] [table order: as-is|reverse|shuffle]
+e.g.   python3 benchmarks/benchmark_schedule.py fra 0.05 8 shuffle
+"""
+
+import sys
+import tempfile
+import threading
+import time
+from os.path import dirname, abspath, join
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import get_htmlworldcat
+import get_settings
+import html_store
+import http_fetch
+import stub_worldcat
+from check_faults import compare_stores
+
+
+OPTIONS = {
+    "requests_per_second": 0,
+    "progress_interval": None,
+    "page_cache": None,
+    "query_memo": None,
+    "report_folder": None,
+    }
+
+
+# === Functions ===
+
+class RunningRequests:
+    """
+    Wraps http_fetch.fetch and records the number of requests running after each request.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.events = []
+        self.fetch = http_fetch.fetch
+
+    def __call__(self, session, url, limiter):
+        self.change(1)
+        try:
+            return self.fetch(session, url, limiter)
+        finally:
+            self.change(-1)
+
+    def change(self, step):
+        with self.lock:
+            self.running += step
+            self.events.append((time.perf_counter(), self.running))
+
+    def get_tail(self, workers):
+        """
+        output: seconds at the end in which fewer than half of the workers were busy
+        """
+        end = self.events[-1][0]
+        for moment, running in reversed(self.events):
+            if running >= workers / 2:
+                return end - moment
+        return 0.0
+
+
+def harvest(settings_dict, data, order, source, delay, workers):
+    """
+    output: seconds, tail in seconds, list of missing or different pages
+    """
+    with tempfile.TemporaryDirectory() as folder:
+        options = dict(OPTIONS, harvest_order=order, harvest_workers=workers, max_per_host=workers)
+        settings_dict = get_settings.main(settings_dict["lang"], ROOT, "level1", folder + "/html", "html/*.html", options)
+        server = stub_worldcat.start_server(settings_dict, data, source, faults={"delay_rate": 1.0, "delay": delay})
+        settings_dict["worldcat_url"] = "http://127.0.0.1:{}".format(server.server_port)
+        requests = RunningRequests()
+        http_fetch.fetch = requests
+        try:
+            start = time.perf_counter()
+            get_htmlworldcat.harvest(settings_dict, data)
+            seconds = time.perf_counter() - start
+        finally:
+            http_fetch.fetch = requests.fetch
+        server.shutdown()
+        differences = compare_stores(source, html_store.FileStore(settings_dict["write_file"]))
+    return seconds, requests.get_tail(workers), differences
+
+
+def main(lang="fra", delay=0.05, workers=8, table="as-is"):
+    delay = float(delay)
+    workers = int(workers)
+    source = html_store.FileStore(join(ROOT, "html", lang))
+    data = get_htmlworldcat.read_csv(join(ROOT, "{}_metadata.csv".format(lang)))
+    if table == "reverse":
+        data = data.iloc[::-1]
+    elif table == "shuffle":
+        data = data.sample(frac=1, random_state=0)
+    pages = sum(len(numbers) for numbers in source.list_pages().values())
+    results = {}
+    for order in get_htmlworldcat.ORDERS:
+        results[order] = harvest({"lang": lang}, data, order, source, delay, workers)
+    print("{} pages, {} workers, {} s per request, metadata table {}".format(pages, workers, delay, table))
+    print("Lower bound: {:.2f} s".format(pages * delay / workers))
+    for order, (seconds, tail, differences) in results.items():
+        print("{:15} {:6.2f} s   tail {:5.2f} s   {}".format(order, seconds, tail, "different pages: {}".format(len(differences)) if differences else "pages identical"))
+    if any(differences for seconds, tail, differences in results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+"""
+Checks the download (get_htmlworldcat.py, http_fetch.py) against a stub server
+that injects faults (see stub_worldcat.FAULTS): the saved pages of a language are
+served by the stub, downloaded into a temporary folder and compared with the
+originals. Exits with status 1 if a page is missing or differs.
+
+Usage: python3 benchmarks/check_faults.py [lang] [fault=value ...]
+e.g.   python3 benchmarks/check_faults.py fra error_rate=0.1 throttle_rate=0.05 drop_rate=0.05 max_rate=20
+"""
+
+import sys
+import tempfile
+import time
+from os.path import dirname, abspath, join
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import get_htmlworldcat
+import get_settings
+import html_store
+import instrumentation
+import stub_worldcat
+
+
+DEFAULT_FAULTS = {"error_rate": 0.1, "unavailable_rate": 0.01, "throttle_rate": 0.01, "drop_rate": 0.05, "retry_after": 0.2, "max_rate": 40}
+
+OPTIONS = {                         # short waiting times, so the check does not take long
+    "harvest_workers": 8,
+    "max_per_host": 8,
+    "requests_per_second": 0,
+    "rate_increase": 0.5,
+    "read_timeout": 5,
+    "max_retries": 8,
+    "backoff_base": 0.1,
+    "backoff_max": 2.0,
+    "circuit_cooldown": 1.0,
+    "circuit_max_trips": None,
+    "page_cache": None,
+    "query_memo": None,
+    "report_folder": None,
+    }
+
+
+# === Functions ===
+
+def compare_stores(source, target):
+    """
+    output: list of the pages (xmlid, page number) missing in target or different from source
+    """
+    differences = []
+    for xmlid, numbers in source.list_pages().items():
+        for number in numbers:
+            if source.read_page(xmlid, number) != target.read_page(xmlid, number):
+                differences.append((xmlid, number))
+    return differences
+
+
+def main(lang="fra", *faults):
+    faults = {key: float(value) for key, value in (fault.split("=", 1) for fault in faults)} or DEFAULT_FAULTS
+    source = html_store.FileStore(join(ROOT, "html", lang))
+    data = get_htmlworldcat.read_csv(join(ROOT, "{}_metadata.csv".format(lang)))
+    with tempfile.TemporaryDirectory() as folder:
+        settings_dict = get_settings.main(lang, ROOT, "level1", folder + "/html", "html/*.html", OPTIONS)
+        server = stub_worldcat.start_server(settings_dict, data, source, faults=faults)
+        settings_dict["worldcat_url"] = "http://127.0.0.1:{}".format(server.server_port)
+        start = time.perf_counter()
+        with instrumentation.run_report(settings_dict) as report:
+            with instrumentation.stage("get_htmlworldcat", [lang]):
+                get_htmlworldcat.harvest(settings_dict, data)
+        seconds = time.perf_counter() - start
+        server.shutdown()
+        target = html_store.FileStore(settings_dict["write_file"])
+        differences = compare_stores(source, target)
+    stage = report.stages[0]
+    print("Faults:", faults)
+    print("Answers of the stub:", dict(server.RequestHandlerClass.answers))
+    print("Downloader:", stage["counts"], "in {:.1f} s".format(seconds))
+    if "http" in stage:
+        print("Latencies:", stage["http"])
+    if differences:
+        print("Missing or different pages:", len(differences), differences[:10])
+        sys.exit(1)
+    print("All pages identical.")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
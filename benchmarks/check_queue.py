@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+"""
+Checks the download through the work queue (work_queue.py) with several local worker
+processes against the stub server (stub_worldcat.py): the saved pages of a language are
+served by the stub, downloaded by the workers into a temporary folder and compared with
+the originals. Before the workers start, one job is claimed by a worker that "crashes"
+(it never finishes the job), so its lease has to expire and the job has to be taken over.
+Exits with status 1 if a page is missing, differs, is too many or was downloaded twice,
+or if a job failed. With a delay longer than queue_lease (e.g. delay_rate=0.05 delay=4),
+the renewal of the leases during slow downloads is checked as well.
+
+Usage: python3 benchmarks/check_queue.py [lang] [workers] [fault=value ...]
+e.g.   python3 benchmarks/check_queue.py fra 4 error_rate=0.1 drop_rate=0.05
+"""
+
+import json
+import sys
+import tempfile
+import time
+from os.path import dirname, abspath, join
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import fetch_manifest
+import get_htmlworldcat
+import get_settings
+import html_store
+import stub_worldcat
+import work_queue
+from check_faults import compare_stores
+
+
+OPTIONS = {                         # short waiting times, so the check does not take long
+    "requests_per_second": 0,
+    "read_timeout": 5,
+    "max_retries": 1,               # failed downloads go back to the queue
+    "backoff_base": 0.1,
+    "backoff_max": 1.0,
+    "circuit_cooldown": 1.0,
+    "circuit_max_trips": None,
+    "queue_lease": 3,
+    "queue_attempts": 10,
+    "page_cache": None,
+    "query_memo": None,
+    "report_folder": None,
+    }
+
+
+# === Functions ===
+
+def check_manifest(store, folder):
+    """
+    output: list of the pages in the store that are not recorded in the manifest
+    """
+    with open(join(folder, fetch_manifest.MANIFEST_NAME), "r", encoding="utf8") as infile:
+        entries = json.load(infile)
+    return [(xmlid, number) for xmlid, numbers in store.list_pages().items() for number in numbers
+            if str(number) not in entries.get(xmlid, {}).get("pages", {})]
+
+
+def main(lang="fra", workers=4, *faults):
+    faults = {key: float(value) for key, value in (fault.split("=", 1) for fault in faults)}
+    source = html_store.FileStore(join(ROOT, "html", lang))
+    data = get_htmlworldcat.read_csv(join(ROOT, "{}_metadata.csv".format(lang)))
+    with tempfile.TemporaryDirectory() as folder:
+        options = dict(OPTIONS, queue_path=join(folder, "queue.sqlite"))
+        settings_dict = get_settings.main(lang, ROOT, "level1", folder + "/html", "html/*.html", options)
+        settings_dict["csv_file"] = join(ROOT, "{}_metadata.csv".format(lang))
+        server = stub_worldcat.start_server(settings_dict, data, source, faults=faults)
+        settings_dict["worldcat_url"] = "http://127.0.0.1:{}".format(server.server_port)
+        queue = work_queue.open_queue(settings_dict)
+        work_queue.enqueue_novels(settings_dict, data, queue)
+        crashed = queue.claim("crashed-worker")
+        print("Job left by the crashed worker:", crashed["xmlid"], "page", crashed["page"])
+        start = time.perf_counter()
+        work_queue.run([settings_dict], int(workers), interval=2.0)
+        seconds = time.perf_counter() - start
+        server.shutdown()
+        progress = queue.get_progress()[lang]
+        row = queue.connection.execute("SELECT state, attempts, error FROM jobs WHERE id = ?", (crashed["id"],)).fetchone()
+        downloaded = queue.connection.execute("SELECT COUNT(*) FROM jobs WHERE state = 'done' OR (state = 'skipped' AND error NOT LIKE 'after page%')").fetchone()[0]
+        queue.close()
+        target = html_store.FileStore(settings_dict["write_file"])
+        differences = compare_stores(source, target)
+        unrecorded = check_manifest(target, settings_dict["write_file"])
+        extra = [(xmlid, number) for xmlid, numbers in target.list_pages().items() for number in numbers if not source.has_page(xmlid, number)]
+    print("Faults:", faults)
+    print("Answers of the stub:", dict(server.RequestHandlerClass.answers))
+    print("Jobs:", progress, "with {} workers in {:.1f} s".format(workers, seconds))
+    print("Job of the crashed worker:", row)
+    twice = server.RequestHandlerClass.answers.get("200", 0) - downloaded
+    if twice:
+        print("Pages downloaded twice (lease expired during the download):", twice)
+    if differences or unrecorded or extra or twice or progress["failed"] or row[0] != "done":
+        print("Missing or different pages:", len(differences), differences[:10])
+        print("Pages not in the manifest:", len(unrecorded), unrecorded[:10])
+        print("Pages beyond the end of the results:", len(extra), extra[:10])
+        sys.exit(1)
+    print("All pages identical.")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
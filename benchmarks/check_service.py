@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+"""
+Checks the service mode (service.py) against the files of a normal run: the saved pages
+of a language are served by stub_worldcat.py, the service is started on a copy of the
+metadata table, the reprint counts and the pages in a temporary folder, and its answers
+are compared with <lang>_reprint_counts.csv and <lang>_summary.csv. Then each query is
+repeated to measure the answers from memory, and one novel is downloaded again through
+the service. Exits with status 1 if an answer differs.
+
+Usage: python3 benchmarks/check_service.py [lang] [repetitions]
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from os.path import dirname, abspath, join
+from urllib.request import Request, urlopen
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import pandas as pd
+
+import get_htmlworldcat
+import get_settings
+import service
+import stub_worldcat
+
+
+OPTIONS = {
+    "requests_per_second": 0,
+    "page_cache": None,
+    "query_memo": None,
+    "report_folder": None,
+    }
+
+
+# === Functions ===
+
+def query(url, method="GET"):
+    with urlopen(Request(url, method=method)) as response:
+        return json.loads(response.read().decode("utf8"))
+
+
+def check_answers(address, lang, counts, summary):
+    """
+    output: list of the xmlids whose answers differ from the files
+    """
+    differences = []
+    period = counts.loc[[str(year) for year in range(1970, 2010)]].sum()
+    for xmlid in counts.columns:
+        answer = query("{}/counts?lang={}&xmlid={}&from=1970&to=2009".format(address, lang, xmlid))
+        if answer["total"] != period[xmlid] or sum(answer["years"].values()) != period[xmlid]:
+            differences.append(xmlid)
+    answer = query("{}/summary?lang={}".format(address, lang))["novels"]
+    for xmlid, row in summary.iterrows():
+        if (answer[xmlid]["total_counts"], answer[xmlid]["canon_counts"], answer[xmlid]["canon_status"]) \
+                != (row["total_counts"], row["canon_counts"], row["canon_status"]):
+            differences.append(xmlid)
+    return differences
+
+
+def main(lang="fra", repetitions=20):
+    repetitions = int(repetitions)
+    data = get_htmlworldcat.read_csv(join(ROOT, "{}_metadata.csv".format(lang)))
+    counts = pd.read_csv(join(ROOT, "{}_reprint_counts.csv".format(lang)), index_col=0)
+    summary = pd.read_table(join(ROOT, "{}_summary.csv".format(lang)), sep="\t", index_col=0)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as folder:
+        os.chdir(folder)
+        try:
+            for name in ["{}_metadata.csv", "{}_reprint_counts.csv"]:
+                shutil.copy(join(ROOT, name.format(lang)), name.format(lang))
+            shutil.copytree(join(ROOT, "html", lang), join("html", lang))
+            settings_dict = get_settings.main(lang, ROOT, "level1", "html", "html/*.html", OPTIONS)
+            stub = stub_worldcat.start_server(settings_dict, data, join(ROOT, "html", lang))
+            settings_dict["worldcat_url"] = "http://127.0.0.1:{}".format(stub.server_port)
+            start = time.perf_counter()
+            server = service.start_server([settings_dict])
+            print("Service started in {:.2f} s".format(time.perf_counter() - start))
+            address = "http://127.0.0.1:{}".format(server.server_port)
+            differences = check_answers(address, lang, counts, summary)
+            start = time.perf_counter()
+            for i in range(repetitions):
+                check_answers(address, lang, counts, summary)
+            seconds = time.perf_counter() - start
+            print("{} repetitions of {} queries in {:.2f} s".format(repetitions, len(counts.columns) + 1, seconds))
+            xmlid = counts.columns[0]
+            print("Harvest:", query("{}/harvest?lang={}&xmlid={}".format(address, lang, xmlid), "POST"))
+            print("Answers of the stub:", dict(stub.RequestHandlerClass.answers))
+            differences += check_answers(address, lang, counts, summary)
+            stats = query(address + "/stats")
+            server.shutdown()
+            stub.shutdown()
+        finally:
+            os.chdir(cwd)
+    print("Latency:", json.dumps(stats["latency"], indent=1))
+    print("Cache:", stats["cache"])
+    if differences:
+        print("Different answers:", sorted(set(differences)))
+        sys.exit(1)
+    print("All answers identical.")
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
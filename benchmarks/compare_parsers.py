@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+"""
+Regression check and timing for the parser engines (see parse_worldcat.py).
+
+Parses all saved result pages of a language with each engine and checks that the
+reprint counts per novel and year (and the number of results and error messages)
+are identical to those obtained with Beautiful Soup. Exits with status 1 otherwise.
+
+Usage: python3 benchmarks/compare_parsers.py [lang]
+"""
+
+import glob
+import sys
+import time
+from collections import Counter
+from os.path import dirname, abspath, join
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+import create_publicationtable
+import get_settings
+import parse_worldcat
+
+
+# === Functions ===
+
+def count_reprints(texts, engine, settings_dict):
+    """
+    Parses all pages with the engine.
+
+    output: reprint counts (Counter of (id, year)), other page data (number of results, error), seconds
+    """
+    counts = Counter()
+    other = {}
+    start = time.perf_counter()
+    for file, text in texts:
+        page = parse_worldcat.parse_page(text, engine)
+        id = file.split("_html")[0]
+        for year in create_publicationtable.get_publicationyears(page, settings_dict).tolist():
+            counts[(id, year)] += 1
+        other[file] = (page["hits"], page["error"], page["no_year"])
+    return counts, other, time.perf_counter() - start
+
+
+def main(lang="fra"):
+    settings_dict = get_settings.main(lang, ".", "level1", "html", "html/*.html")
+    files = sorted(glob.glob(join(dirname(dirname(abspath(__file__))), "html", lang, "*.html")))
+    texts = []
+    for file in files:
+        with open(file, "r", encoding="utf8") as infile:
+            texts.append((file, infile.read()))
+    print("Pages:", len(texts))
+
+    reference, reference_other, seconds = count_reprints(texts, "bs4", settings_dict)
+    print("{:9} {:8.3f} ms/page".format("bs4", 1000 * seconds / len(texts)))
+    failed = False
+    for engine in parse_worldcat.ENGINES:
+        if engine == "bs4":
+            continue
+        counts, other, seconds = count_reprints(texts, engine, settings_dict)
+        identical = counts == reference and other == reference_other
+        print("{:9} {:8.3f} ms/page  {}".format(engine, 1000 * seconds / len(texts), "identical" if identical else "DIFFERENT"))
+        failed = failed or not identical
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
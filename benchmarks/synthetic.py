@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+"""
+Generator for synthetic test data: ELTeC-like XML-TEI novels and worldcat result pages
+for them (to be served by stub_worldcat.py).
+"""
+
+import os
+import random
+from os.path import join
+
+
+TEI_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<TEI xmlns="http://www.tei-c.org/ns/1.0" xml:id="{xmlid}" xml:lang="{lang}">
+<teiHeader>
+<fileDesc>
+<titleStmt>
+<title>{title} : ELTeC edition</title>
+<author>{author} ({birth}-{death})</author>
+</titleStmt>
+<publicationStmt><p>Synthetic test file</p></publicationStmt>
+<sourceDesc><bibl type="firstEdition"><title>{title}</title><author>{author}</author><date>{year}</date></bibl></sourceDesc>
+</fileDesc>
+</teiHeader>
+<text>
+<body>
+"""
+
+TEI_END = """</body>
+</text>
+</TEI>
+"""
+
+RESULT_PAGE = """<html>
+<head><title>{title} [WorldCat.org]</title>
+<script type="text/javascript">
+{padding}
+</script>
+</head>
+<body>
+<div class="resultsinfo">
+<table cellspacing="0" width="100%">
+<tr>
+<td>Results <strong>{first}-{last}</strong> of about <strong>{hits}</strong> (<strong>.14</strong> seconds)</td>
+</tr>
+</table>
+</div>
+<table  border="0" cellspacing="0" width="100%" class="table-results" id="br-table-results">
+{rows}</table>
+</body>
+</html>
+"""
+
+RESULT_ROW = """<tr  class="menuElem">
+<td class="num">{position}.</td>
+<td class="result details">
+    <div class="oclc_number" data-source-collection="/XWC/">{oclc}</div>
+    <div class="item_number">{number}</div>
+<div class="name">
+   <a id="result-{position}" href="/title/oclc/{oclc}&referer=brief_results"><strong>{title}</strong></a>
+     </div>
+<div class="author">by {author}</div>
+<div class="type language">Language: <span class="itemLanguage">{language}</span> &nbsp;</div>{publisher}
+<ul class="options">
+  <li> <a href="/title/oclc/{oclc}/editions?editionsView=true&referer=br" title="View all held editions and formats for this item"> View all editions &raquo;</a></li>
+</ul>
+</td>
+</tr>
+"""
+
+PUBLISHER = """<div class="publisher">Publisher: <span class="itemPublisher">{place} : {name}, {year}.</span></div>"""
+PUBLISHER_NO_YEAR = """<div class="publisher">Publisher: <span class="itemPublisher">{place} : {name}.</span></div>"""
+
+PLACES = ["Paris", "Lyon", "Bruxelles", "Gen&egrave;ve", "Montr&eacute;al", "London", "New York"]
+PUBLISHERS = ["Fasquelle", "Gallimard", "Hachette", "Calmann-L&eacute;vy", "Flammarion", "Plon", "Le Livre de poche"]
+OTHER_LANGUAGES = ["English", "German", "Spanish", "Italian", "Japanese", "Russian"]
+
+WORDS = ["le", "la", "les", "un", "une", "maison", "jardin", "soir", "nuit", "jour", "homme", "femme",
+         "regarda", "dit", "vint", "partit", "longtemps", "encore", "toujours", "jamais", "ville", "mer"]
+
+
+# === Functions ===
+
+def get_paragraph(rng, words=120):
+    """
+    Returns a paragraph of random words.
+    """
+    return "<p>" + " ".join(rng.choice(WORDS) for i in range(words)) + "</p>\n"
+
+
+def write_tei(filename, xmlid, title, author, size, lang="fr", seed=0):
+    """
+    Writes a synthetic novel with a teiHeader and a body of about size bytes.
+    """
+    rng = random.Random(seed)
+    with open(filename, "w", encoding="utf8") as outfile:
+        outfile.write(TEI_HEADER.format(xmlid=xmlid, lang=lang, title=title, author=author,
+                                        birth=1800, death=1880, year=rng.randint(1840, 1920)))
+        outfile.write("<div type=\"chapter\">\n")
+        written = 0
+        while written < size:
+            paragraph = get_paragraph(rng)
+            outfile.write(paragraph)
+            written += len(paragraph)
+        outfile.write("</div>\n")
+        outfile.write(TEI_END)
+
+
+def create_tei_collection(folder, count, size, prefix="SYN", seed=0):
+    """
+    Writes count synthetic novels of about size bytes each into folder.
+
+    output: list of filenames
+    """
+    os.makedirs(folder, exist_ok=True)
+    rng = random.Random(seed)
+    filenames = []
+    for number in range(1, count + 1):
+        xmlid = "{}{:05d}".format(prefix, number)
+        author = "Auteur{}, Prénom".format(rng.randint(1, max(1, count // 3)))
+        title = "Roman numéro {}".format(number)
+        filename = join(folder, "{}_{}.xml".format(xmlid, author.split(",")[0]))
+        write_tei(filename, xmlid, title, author, size, seed=seed + number)
+        filenames.append(filename)
+    return filenames
+
+
+def get_result_row(rng, position, number, title, author, language, missing_year_rate, wrong_language_rate):
+    """
+    Returns one hit (menuElem row) of a result page. With the given rates, the hit has no
+    publication year (publisher field without year or no publisher field) or another language.
+    """
+    if rng.random() < wrong_language_rate:
+        language = rng.choice(OTHER_LANGUAGES)
+    place = rng.choice(PLACES)
+    name = rng.choice(PUBLISHERS)
+    if rng.random() >= missing_year_rate:
+        publisher = PUBLISHER.format(place=place, name=name, year=rng.randint(1840, 2019))
+    elif rng.random() < 0.5:
+        publisher = PUBLISHER_NO_YEAR.format(place=place, name=name)
+    else:
+        publisher = ""
+    return RESULT_ROW.format(position=position, number=number, oclc=rng.randint(10**6, 10**9), title=title,
+                             author=author, language=language, publisher=publisher)
+
+
+def create_result_pages(title, author, rng, pages=(1, 6), hits_per_page=10, missing_year_rate=0.1,
+                        wrong_language_rate=0.2, language="French", padding=20000):
+    """
+    Creates the result pages of one novel. The number of pages is drawn from the range pages;
+    the number of results ("of about N") is chosen so that get_htmlworldcat.py asks for exactly
+    these pages (10 results per page). Each page holds up to hits_per_page hits and about
+    padding bytes of script, as real result pages consist mostly of markup around the hits.
+
+    output: list of html pages (page 1 first)
+    """
+    count = rng.randint(pages[0], pages[1])
+    hits = (count - 1) * 10 + rng.randint(1, 10)
+    filler = "var x = 0;\n" * (padding // 11)
+    result = []
+    for page in range(count):
+        first = page * 10 + 1
+        last = min(hits, first + 9)
+        rows = []
+        for number in range(1, min(hits_per_page, last - first + 1) + 1):
+            rows.append(get_result_row(rng, first + number - 1, number, title, author, language,
+                                       missing_year_rate, wrong_language_rate))
+        result.append(RESULT_PAGE.format(title=title, padding=filler, first=first, last=last, hits=hits, rows="".join(rows)))
+    return result
+
+
+def create_worldcat_pages(store, data, seed=0, no_result_rate=0.05, **options):
+    """
+    Writes synthetic result pages for the novels of a metadata table into a store (see html_store.py).
+    With no_result_rate, a novel gets no pages at all (the stub then answers "No results").
+    Further options: see create_result_pages.
+
+    input: store, metadata table (xmlid, title, au-name), seed
+    output: number of pages written
+    """
+    rng = random.Random(seed)
+    written = 0
+    for i, row in data.iterrows():
+        if rng.random() < no_result_rate:
+            continue
+        for number, html in enumerate(create_result_pages(row["title"], row["au-name"], rng, **options), 1):
+            store.write_page(row["xmlid"], number, html)
+            written += 1
+    return written
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+"""
+Binary store of the reprint counts that can be memory-mapped (counts_formats "mmap").
+
+The table is saved in three files next to the other formats:
+
+    <lang>_reprint_counts.matrix.npy   counts as int32, one row per novel, one column per year (numpy .npy)
+    <lang>_reprint_counts.years.npy    the years of the columns (year 0 first, see create_publicationtable.get_years)
+    <lang>_reprint_counts.ids.txt      the xmlids of the rows, one per line
+
+The matrix is opened with numpy.memmap, so only the parts that are read are loaded
+from disk: reading a few novels or a range of years does not need the whole table
+in memory, and opening the store costs next to nothing, whatever the size of the
+collection. The counts of one novel are stored next to each other. Only numpy is
+needed for reading (read); pandas is imported for the dataframes of select and get_totals.
+
+    store = counts_store.CountsStore("fra_reprint_counts")
+    store.select(["FRA00101", "FRA00102"], 1970, 2009)     # dataframe, years x novels
+    store.get_totals(None, 1970, 2009)                      # reprints of all novels in the period
+"""
+
+import os
+
+import numpy as np
+
+
+FILES = {"matrix": ".matrix.npy", "years": ".years.npy", "ids": ".ids.txt"}
+
+
+# === Functions ===
+
+def get_filenames(prefix):
+    return {name: prefix + ending for name, ending in FILES.items()}
+
+
+def save_store(dataframe, prefix):
+    """
+    Saves the counts table (years x novels, with or without the row "Total") as a store.
+    Each file is written to a temporary file first and then replaces the old one.
+
+    input: dataframe from create_publicationtable.create_dataframe, prefix of the files (e.g. "fra_reprint_counts")
+    """
+    counts = dataframe.drop(index="Total", errors="ignore")
+    filenames = get_filenames(prefix)
+    matrix = np.ascontiguousarray(counts.to_numpy(dtype=np.int32).T)
+    with open(filenames["matrix"] + ".tmp", "wb") as outfile:
+        np.save(outfile, matrix)
+    with open(filenames["years"] + ".tmp", "wb") as outfile:
+        np.save(outfile, np.asarray(counts.index, dtype=np.int32))
+    with open(filenames["ids"] + ".tmp", "w", encoding="utf8") as outfile:
+        outfile.writelines(str(id) + "\n" for id in counts.columns)
+    for filename in filenames.values():
+        os.replace(filename + ".tmp", filename)
+
+
+class CountsStore:
+    """
+    Read access to a store; the matrix is memory-mapped, years and ids are read when the store is opened.
+    """
+
+    def __init__(self, prefix):
+        filenames = get_filenames(prefix)
+        self.matrix = np.load(filenames["matrix"], mmap_mode="r")
+        self.years = np.load(filenames["years"])
+        with open(filenames["ids"], "r", encoding="utf8") as infile:
+            self.ids = [line.rstrip("\n") for line in infile]
+        self.positions = {id: position for position, id in enumerate(self.ids)}
+        if self.matrix.shape != (len(self.ids), len(self.years)):
+            raise ValueError("{}: the matrix does not fit to the years and ids".format(prefix))
+
+    def get_rows(self, xmlids=None):
+        """
+        Positions of the novels in the matrix (None: all novels); raises KeyError for an unknown xmlid.
+        """
+        if xmlids is None:
+            return np.arange(len(self.ids))
+        return np.array([self.positions[xmlid] for xmlid in xmlids], dtype=np.intp)
+
+    def get_columns(self, first=None, last=None):
+        """
+        Positions of the years from first to last (both included; None: no limit).
+        Year 0 (no or other publication year) is only included if first is None or 0.
+        """
+        selected = np.ones(len(self.years), dtype=bool)
+        if first is not None:
+            selected &= self.years >= first
+        if last is not None:
+            selected &= self.years <= last
+        return np.flatnonzero(selected)
+
+    def read(self, xmlids=None, first=None, last=None):
+        """
+        output: array with the counts of the novels (rows) in the years (columns); only these parts are read from disk
+        """
+        rows = slice(None) if xmlids is None else self.get_rows(xmlids)
+        columns = self.get_columns(first, last)
+        if len(columns) and np.all(np.diff(columns) == 1):
+            return np.asarray(self.matrix[rows, columns[0]:columns[-1] + 1])
+        return np.asarray(self.matrix[rows][:, columns])
+
+    def select(self, xmlids=None, first=None, last=None):
+        """
+        output: dataframe like the counts table (years as rows, one column per novel, without "Total")
+        """
+        import pandas as pd
+        ids = self.ids if xmlids is None else list(xmlids)
+        columns = self.get_columns(first, last)
+        return pd.DataFrame(self.read(xmlids, first, last).T.astype(np.int64), index=self.years[columns], columns=ids)
+
+    def get_totals(self, xmlids=None, first=None, last=None):
+        """
+        output: Series with the number of reprints of each novel from first to last
+        """
+        import pandas as pd
+        ids = self.ids if xmlids is None else list(xmlids)
+        return pd.Series(self.read(xmlids, first, last).sum(axis=1, dtype=np.int64), index=ids)
+
+
+def open_store(settings_dict):
+    """
+    Opens the store of the language in settings_dict ("<lang>_reprint_counts").
+    """
+    return CountsStore("{}_reprint_counts".format(settings_dict["lang"]))
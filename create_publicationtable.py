@@ -1,240 +1,490 @@
-#!/usr/bin/env python3
-
-"""
-Script for creating a table with the number of publications per year for each novel in the collection.
-
-Input: html files from worldcat downloaded by gethtmlsworldcat.py.
-Output: csv-file
-"""
-
-from bs4 import BeautifulSoup as bs
-import glob
-import os
-from os.path import join
-import re
-import pandas as pd
-import logging
-
-# === Parameters ===
-
-#dir=""
-#htmlpages = join(dir, "html", "*.html")
-
-
-# === Functions ===
-
-def read_html(file):
-    """
-    Parsing with Beautiful Soup, see: https://www.crummy.com/software/BeautifulSoup/bs4/doc/
-    
-    input: html file
-    output: parsed html
-    
-    """
-    with open(file, "r", encoding="utf8") as infile:
-        html = infile.read()
-        html = bs(html, "html.parser")
-        return html
-
-
-def get_id(file):
-    """
-    input: file
-    output: filename (in this case the id of the novel)
-    """
-    base = os.path.basename(file)                   
-    id_ext = str(os.path.splitext(base)[0])
-    id = id_ext.split("_html")[0]
-    print(id)
-    return id, id_ext
-
-
-def test_search_result(html, id):
-    """
-    Prints warning if there are no search results in worldcat and writes warning into log file.
-    The warning contains the id and the search strings of the title and the author.
-    
-    input: html file
-    output: log file
-    """
-    text = "No results match your search"
-    try:
-        errors = html.find('div', {'class' : 'error-results'}).get_text()
-        errors = errors.strip()
-        search_string = re.search("ti:(.*?)au:(.*?)\'", errors).group()
-        title = re.sub(" au:(.*?)\'", "", search_string)                   # extracts search string for the title
-        title = re.sub("ti:", "", title)
-        title = re.sub(": ELTeC edition", "", title)
-        author = re.search("au:(.*?)\'", search_string).group()            # extracts search string for the author
-        author = re.sub("au:", "", author)
-        author = re.sub("\'", "", author)
-        if errors.startswith(text):
-            print(id + ": No search result in worldcat! Please check the spelling of author and title (see log file)!")
-            logging.warning(id + ": No search result in worldcat! Search strings: title: '" + title + "', author: '" + author + "'")
-    except:
-        pass
-    
-
-def create_df_worldcat(html, settings_dict, id_ext):
-    """
-    Takes a html file containing the search result in worldcat and creates a dataframe with hit number (corresponding to the html), hit language and publication year
-    If there isn't mentioned a year, it will be set to 0 in order to contribute to the total number of publications. 
-    
-    input: html file, settings_dict, id
-    output: dataframe
-    """
-    df_worldcat = pd.DataFrame(columns=['number', 'itemLanguage', 'year'])
-    list = html.find_all('tr', {'class' : 'menuElem'})               # list with all hits (still marked up)
-    
-    for item in list:
-        number = item.find('div', {'class' : 'item_number'}).get_text()
-        itemLang = item.find('span', {'class' : 'itemLanguage'}).get_text()
-        try:
-            year = item.find('span', {'class' : 'itemPublisher'}).get_text()
-            year = re.search("[0-9]+", year).group()   
-        except:
-            year = "0"
-            print("No publication year found for item " + number + " in file " + str(id_ext))
-            logging.warning(str(id_ext) + ": No publication year found for item " + number + "!")
-        df_worldcat = df_worldcat.append({'number': number, 'itemLanguage': itemLang, 'year': year}, ignore_index=True)
-        #print(df_worldcat)
-        
-    return(df_worldcat)
-       
-
-def test_lang(df_worldcat, settings_dict):
-    """
-    Tests the language of each hit in html. If the language isn't the expected one, the number is stored in a list called skip.
-    
-    input: html, settings_dict
-    output: list with numbers corresponding to hits with "wrong" language.
-    
-    """
-    item_lang = settings_dict["lang_hit"]
-    skip = []
-    for index, row in df_worldcat.iterrows():
-        if row['itemLanguage'] == item_lang:
-            pass
-        else:
-            skip.append(row['number'])         # hit number is appended to skip list if language isn't the expected one
-    #print(skip)
-    return skip
-
-
-def fill_publicationlist(df_worldcat, publist, skip):
-    """
-    
-    Adds the publication years of hits with the "right" language to a list.
-    If the extracted number hasn't got a value between 1840 an 2019, the year will be set to 0 in order to contribute to the total number of publications.
-    
-    input: dataframe df_worldcat, publist (empty or already filled with publication years from first pages of the search result), skip (list with numbers corresponding to items with "wrong" language)
-    output: list with publication years of one novel
-    
-    """
- 
-    for index, row in df_worldcat.iterrows():
-        if row['number'] not in skip:
-            year = row['year']
-            year = int(year)
-            if year not in range(1840, 2020):                        # if the publication year isn't a number between 1840 and 2020
-                year = 0
-            publist.append(year)
-    return publist
-            
-
-def create_dictionary():
-    """
-    Returns a dictionary with keys from 1840 to 2019, each value is an empty dictionary.
-    """
-    keys = [0]
-    for x in range(1840,2020):                        # creates a list with keys from 1840 to 2019 and 0 (for cases where there is no mentioned publication year)
-        keys.append(x)
-    
-    pubdict = {key: {} for key in keys}               # creates a dictionary with the keys from the list and sets empty dictionaries as values
-    return pubdict
-
-
-def fill_dictionary(pubdict, publist, id):
-    """
-    Writes the information from the publication list into the dictionary.
-    
-    input: dictionary with years from 1840 to 1940 as keys and empty dictionaries as values; list with publication years; id of the novel
-    output: dictionary in which every year (1840 to 2019) is related to another dictionary containing the novel id (keys) and the number of publications in the specific year (values)
-    """
-    
-    for x in range(1840,2020):                 # adding a new dictionary entry to each key (year): id of the novel (key) and "0" (number of publications; value)
-        d = pubdict[x]
-        d[id] = 0
-        
-    d = pubdict[0]                             # adding the dictionary for the year "0" (cases where there is no mentioned year)
-    d[id] = 0
-    
-    for year in publist:                           # for each year in the list the corresponding number of publications is increased by 1
-       pubdict[year][id] = pubdict[year][id] + 1     
-    
-    return pubdict
-    
-
-def create_dataframe(pubdict):
-    """
-    Changes the dictionary into a dataframe using pandas, see: https://pandas.pydata.org/.
-    
-    input: dictionary
-    output: dataframe
-    """
-    dataframe = pd.DataFrame.from_dict(pubdict, orient='index')
-    return dataframe
-
-
-def add_sum(dataframe):
-    """
-    Adds the total number of publications of each novel.
-    """
-    dataframe.loc['Total']= dataframe.sum()
-
-
-def save_csv(dataframe, lang):
-    """
-    Saves the dataframe as csv file.
-    """
-    dataframe.to_csv('{}_reprint_counts.csv'.format(lang))
-     
-                
-# === Coordinating function ===
-
-def main(settings_dict):
-    """
-    Coordinates the creation of the publication table.
-    """
-    print("--createpublicationtable")
-    htmlpages = settings_dict["html_folder"]
-    lang = settings_dict["lang"]
-    logging.basicConfig(filename='{}_publicationtable.log'.format(lang),level=logging.WARNING, format='%(asctime)s %(message)s')
-    publdict = create_dictionary()
-    publist = []
-    id_prev = ""
-    
-    filenames = []
-    for file in glob.glob(htmlpages):
-        filenames.append(os.path.basename(file))
-    filenames.sort()
-    for file in filenames:       
-        html = read_html(join(settings_dict["write_file"], file))
-        id, id_ext = get_id(file)
-        df_worldcat = create_df_worldcat(html, settings_dict, id_ext)
-        test_search_result(html, id)
-        skip = test_lang(df_worldcat, settings_dict)
-        if id == id_prev:                                            # html file contains second, third, ... page of the search result
-            publist = fill_publicationlist(df_worldcat, publist, skip)        # existing publist is appended
-        else:                                                        # html contains the first page of the search result
-            publist = []                                             # a new publist is created
-            publist = fill_publicationlist(df_worldcat, publist, skip)
-        fill_dictionary(publdict, publist, id)
-        id_prev = id
-    
-    dataframe = create_dataframe(publdict)
-    add_sum(dataframe)
-    save_csv(dataframe, lang)
-        
-        
-#main(dir, htmlpages)
+#!/usr/bin/env python3
+
+"""
+Script for creating a table with the number of publications per year for each novel in the collection.
+
+Input: html files from worldcat downloaded by gethtmlsworldcat.py.
+Output: csv-file
+"""
+
+import importlib.util
+import json
+import os
+import re
+import numpy as np
+import pandas as pd
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+import parse_worldcat
+import page_cache
+import html_store
+import counts_store
+import instrumentation
+
+# === Parameters ===
+
+#dir=""
+#htmlpages = join(dir, "html", "*.html")
+
+COUNTS_FILES = {"csv": ".csv", "long": "_long.csv", "parquet": ".parquet", "feather": ".feather", "mmap": ".matrix.npy"}     # counts_formats and the endings of their files
+STATE_SETTINGS = ["write_file", "html_storage", "lang_hit", "year_min", "year_max"]      # settings the counts depend on (incremental mode)
+
+
+# === Functions ===
+
+def test_search_result(page, id):
+    """
+    Prints warning if there are no search results in worldcat and writes warning into log file.
+    The warning contains the id and the search strings of the title and the author.
+    
+    input: parsed page
+    output: log file
+    """
+    text = "No results match your search"
+    errors = page["error"]
+    if errors is None:
+        return
+    search_string = re.search("ti:(.*?)au:(.*?)\'", errors)
+    if search_string is None:
+        return
+    search_string = search_string.group()
+    title = re.sub(" au:(.*?)\'", "", search_string)                   # extracts search string for the title
+    title = re.sub("ti:", "", title)
+    title = re.sub(": ELTeC edition", "", title)
+    author = re.search("au:(.*?)\'", search_string).group()            # extracts search string for the author
+    author = re.sub("au:", "", author)
+    author = re.sub("\'", "", author)
+    if errors.startswith(text):
+        print(id + ": No search result in worldcat! Please check the spelling of author and title (see log file)!")
+        logging.warning(id + ": No search result in worldcat! Search strings: title: '" + title + "', author: '" + author + "'")
+
+
+def test_year(page, id_ext):
+    """
+    Prints a warning for each hit without publication year and writes it into the log file.
+    """
+    for number in page["no_year"]:
+        print("No publication year found for item " + number + " in file " + str(id_ext))
+        logging.warning(str(id_ext) + ": No publication year found for item " + number + "!")
+    
+
+def extract_hits(html, id_ext):
+    """
+    Extracts hit number, hit language and publication year of all hits of a search result page in one pass.
+    If there isn't mentioned a year, it will be set to 0 in order to contribute to the total number of publications.
+    
+    input: html parsed with Beautiful Soup, id_ext (name of the file, for the warnings)
+    output: dictionary with the columns "number", "itemLanguage" (lists of strings) and "year" (list of integers)
+    """
+    page = parse_worldcat.extract_bs4(html)
+    test_year(page, id_ext)
+    return page
+
+
+def get_publicationyears(hits, settings_dict):
+    """
+    Selects the publication years of the hits with the expected language (vectorized).
+    Years outside year_min..year_max (config.yaml) are set to 0 in order to contribute to the total number of publications.
+    
+    input: columns from extract_hits, settings_dict
+    output: numpy array with the publication years of the hits with the "right" language
+    """
+    languages = np.array(hits['itemLanguage'], dtype=object)
+    years = np.array(hits['year'], dtype=np.int64)
+    years = years[languages == settings_dict["lang_hit"]]
+    years[(years < settings_dict["year_min"]) | (years > settings_dict["year_max"])] = 0
+    return years
+
+
+def count_novel(id, numbers, settings_dict):
+    """
+    Map step: parses all result pages of one novel.
+    Runs in a worker process, so warnings are not written here but returned with the pages.
+    With page_cache (config.yaml), pages whose content has not changed are taken from the cache.
+    
+    input: id of the novel, the numbers of its result pages, settings_dict
+    output: id, publication years of the hits with the "right" language (publist), list of (id_ext, parsed page),
+    dictionary with the cache keys of the pages (value: the parsed page if it was not in the cache, else None)
+    """
+    engine = settings_dict["html_engine"]
+    store = html_store.get_reader(settings_dict)
+    texts = [store.read_page(id, number) for number in numbers]
+    keys = []
+    cached = {}
+    if settings_dict["page_cache"]:
+        keys = [page_cache.get_key(text, engine) for text in texts]
+        cached = page_cache.get_reader(settings_dict["page_cache"]).get_many(keys)
+    
+    publist = []
+    pages = []
+    cache_entries = {}
+    for i, (number, text) in enumerate(zip(numbers, texts)):
+        if keys and keys[i] in cached:
+            page = cached[keys[i]]
+            cache_entries[keys[i]] = None
+        else:
+            page = parse_worldcat.parse_page(text, engine)
+            if keys:
+                cache_entries[keys[i]] = page
+        publist.extend(get_publicationyears(page, settings_dict).tolist())
+        pages.append(("{}_html{}".format(id, number), page))
+    return id, publist, pages, cache_entries
+
+
+def count_all(novels, settings_dict, executor=None):
+    """
+    Runs the map step for all novels, in a process pool if table_workers is not 1.
+    
+    input: dictionary with the ids as keys and the page numbers as values (see html_store.py), settings_dict, optionally a shared process pool
+    output: iterator over the results of count_novel, in the order of the ids
+    """
+    own_executor = None
+    if executor is None and settings_dict["table_workers"] != 1:
+        own_executor = executor = ProcessPoolExecutor(max_workers=settings_dict["table_workers"])
+    ids = list(novels)
+    try:
+        if executor is None:
+            yield from map(count_novel, ids, [novels[id] for id in ids], repeat(settings_dict))
+        else:
+            chunksize = max(1, len(ids) // (4 * (os.cpu_count() or 1)))
+            yield from executor.map(count_novel, ids, [novels[id] for id in ids], repeat(settings_dict), chunksize=chunksize)
+    finally:
+        if own_executor is not None:
+            own_executor.shutdown()
+
+
+def get_years(settings_dict):
+    """
+    Returns the rows of the table: 0 (for cases where there is no mentioned publication year or it lies outside the range)
+    and the years from year_min to year_max (config.yaml, by default 1840 to 2019).
+    """
+    return np.concatenate(([0], np.arange(settings_dict["year_min"], settings_dict["year_max"] + 1)))
+
+
+def get_year_index(years):
+    """
+    Lookup table from a publication year to its row in the table.
+    All years not in the table point to row 0.
+    """
+    year_index = np.zeros(years.max() + 1, dtype=np.intp)
+    year_index[years] = np.arange(len(years))
+    return year_index
+
+
+def create_matrix(years, ids):
+    """
+    Returns a table (years x novels) filled with zeros.
+    """
+    return np.zeros((len(years), len(ids)), dtype=np.int64)
+
+
+def fill_matrix(matrix, year_index, columns, publists):
+    """
+    Writes the publication years of several novels into the table in one batched update.
+    
+    input: table, lookup table from get_year_index, columns of the novels, their lists with publication years
+    output: table in which each cell holds the number of publications of a novel (column) in a year (row)
+    """
+    rows = [np.asarray(publist, dtype=np.intp) for publist in publists]
+    cols = [np.full(len(publist), column, dtype=np.intp) for column, publist in zip(columns, publists)]
+    if not rows:
+        return matrix
+    rows = year_index[np.concatenate(rows)]
+    cols = np.concatenate(cols)
+    counts = np.bincount(rows * matrix.shape[1] + cols, minlength=matrix.size)
+    matrix += counts.reshape(matrix.shape)
+    return matrix
+
+
+def create_dataframe(matrix, years, ids):
+    """
+    Changes the table into a dataframe using pandas, see: https://pandas.pydata.org/.
+    
+    input: table, years (rows), ids of the novels (columns)
+    output: dataframe
+    """
+    dataframe = pd.DataFrame(matrix, index=years, columns=ids)
+    return dataframe
+
+
+def set_logfile(lang):
+    """
+    Directs the warnings to the log file of the language ("<lang>_publicationtable.log").
+    Unlike logging.basicConfig, this also works for the second, third, ... language in one run.
+    """
+    logger = logging.getLogger()
+    for handler in logger.handlers[:]:
+        if isinstance(handler, logging.FileHandler):
+            logger.removeHandler(handler)
+            handler.close()
+    handler = logging.FileHandler('{}_publicationtable.log'.format(lang))
+    handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.WARNING)
+
+
+def add_sum(dataframe):
+    """
+    Adds the total number of publications of each novel.
+    """
+    dataframe.loc['Total']= dataframe.sum()
+
+
+def save_csv(dataframe, lang):
+    """
+    Saves the dataframe as csv file.
+    """
+    dataframe.to_csv('{}_reprint_counts.csv'.format(lang))
+
+
+def to_long(dataframe):
+    """
+    Long format of the table: one row per novel and year with the columns xmlid (string),
+    year (int16) and count (int32). Cells with 0 are left out, except those of year 0,
+    so that every novel appears. The row "Total" is left out as well.
+    
+    input: dataframe from create_dataframe (with or without the row "Total")
+    output: dataframe
+    """
+    counts = dataframe.drop(index="Total", errors="ignore")
+    years = np.asarray(counts.index, dtype=np.int16)
+    matrix = counts.to_numpy(dtype=np.int32)
+    rows, columns = np.nonzero((matrix != 0) | (years == 0)[:, np.newaxis])
+    order = np.lexsort((rows, columns))                 # by novel, then by year
+    rows, columns = rows[order], columns[order]
+    return pd.DataFrame({"xmlid": pd.array(np.asarray(counts.columns, dtype=object)[columns], dtype="string"),
+                         "year": years[rows], "count": matrix[rows, columns]})
+
+
+def get_countsfile(lang, counts_format):
+    """
+    Name of the reprint counts file in one of COUNTS_FORMATS.
+    """
+    return "{}_reprint_counts{}".format(lang, COUNTS_FILES[counts_format])
+
+
+def require_pyarrow(counts_format):
+    """
+    Parquet and Feather files need the optional package pyarrow.
+    """
+    if importlib.util.find_spec("pyarrow") is None:
+        raise ImportError("counts_formats '{}' needs pyarrow: pip install pyarrow".format(counts_format))
+
+
+def save_counts(dataframe, settings_dict):
+    """
+    Saves the table in each format of counts_formats (config.yaml):
+    "csv": wide csv as before (<lang>_reprint_counts.csv), "long": long csv (<lang>_reprint_counts_long.csv),
+    "parquet" and "feather": long format with typed columns (<lang>_reprint_counts.parquet / .feather, need pyarrow),
+    "mmap": binary matrix that can be memory-mapped (<lang>_reprint_counts.matrix.npy, .years.npy, .ids.txt, see counts_store.py).
+    """
+    lang = settings_dict["lang"]
+    formats = get_counts_formats(settings_dict)
+    long = None
+    for counts_format in formats:
+        if counts_format == "csv":
+            save_csv(dataframe, lang)
+            continue
+        if counts_format == "mmap":
+            counts_store.save_store(dataframe, "{}_reprint_counts".format(lang))
+            continue
+        if long is None:
+            long = to_long(dataframe)
+        if counts_format == "long":
+            long.to_csv(get_countsfile(lang, counts_format), index=False)
+        elif counts_format == "parquet":
+            require_pyarrow(counts_format)
+            long.to_parquet(get_countsfile(lang, counts_format), index=False)
+        else:
+            require_pyarrow(counts_format)
+            long.to_feather(get_countsfile(lang, counts_format))
+
+
+def get_counts_formats(settings_dict):
+    """
+    The parameter counts_formats in config.yaml can be one format or a list of formats.
+    """
+    formats = settings_dict["counts_formats"]
+    if isinstance(formats, str):
+        formats = [formats]
+    for counts_format in formats:
+        if counts_format not in COUNTS_FILES:
+            raise ValueError("Unknown counts_formats '{}', choose from: {}".format(counts_format, ", ".join(COUNTS_FILES)))
+    return formats
+
+
+def count_novels(novels, settings_dict, executor=None):
+    """
+    Parses the result pages of the novels (count_all), writes the warnings into the log file
+    and updates the page cache.
+    
+    input: dictionary with the ids as keys and the page numbers as values, settings_dict, optionally a shared process pool
+    output: list with the publication years of each novel, in the order of the ids
+    """
+    publists = []
+    cache = page_cache.open_cache(settings_dict)
+    new_pages = {}
+    used_keys = []
+    for id, publist, pages, cache_entries in count_all(novels, settings_dict, executor):
+        print(id)
+        instrumentation.count("novels")
+        instrumentation.count("pages", len(pages))
+        for id_ext, page in pages:
+            test_year(page, id_ext)
+            test_search_result(page, id)
+        publists.append(publist)
+        for key, page in cache_entries.items():
+            if page is None:
+                used_keys.append(key)
+            else:
+                new_pages[key] = page
+    if cache is not None:
+        cache.update(new_pages, used_keys)
+        cache.close()
+        print("Pages parsed: {}, taken from the cache: {}".format(len(new_pages), len(used_keys)))
+        instrumentation.count("pages_from_cache", len(used_keys))
+    return publists
+
+
+def create_counts(novels, settings_dict, executor=None):
+    """
+    Parses the pages of the novels (map) and writes their publication years into the table once (reduce).
+    
+    output: dataframe (years x novels, without the row "Total")
+    """
+    ids = list(novels)
+    years = get_years(settings_dict)
+    matrix = create_matrix(years, ids)
+    publists = count_novels(novels, settings_dict, executor)
+    fill_matrix(matrix, get_year_index(years), range(len(ids)), publists)
+    return create_dataframe(matrix, years, ids)
+
+
+def get_statefile(lang):
+    return "{}_reprint_counts.state.json".format(lang)
+
+
+def get_fingerprints(store, novels):
+    """
+    Fingerprint of the pages of each novel for the incremental mode: page numbers and the time they were stored.
+    A novel whose pages were downloaded again (or added, or removed) gets a new fingerprint.
+    """
+    return {id: [[number, store.stored_time(id, number)] for number in numbers] for id, numbers in novels.items()}
+
+
+def read_state(settings_dict):
+    """
+    Reads the state of the last run (settings and fingerprints of the counted novels); None if there is none.
+    """
+    statefile = get_statefile(settings_dict["lang"])
+    if not os.path.isfile(statefile):
+        return None
+    with open(statefile, "r", encoding="utf8") as infile:
+        return json.load(infile)
+
+
+def save_state(settings_dict, fingerprints):
+    statefile = get_statefile(settings_dict["lang"])
+    state = {"settings": {key: settings_dict[key] for key in STATE_SETTINGS}, "novels": fingerprints}
+    with open(statefile + ".tmp", "w", encoding="utf8") as outfile:
+        json.dump(state, outfile, indent=1, sort_keys=True)
+    os.replace(statefile + ".tmp", statefile)
+
+
+def read_counts_table(settings_dict):
+    """
+    Reads the existing reprint counts (first format of counts_formats, see create_summary.read_counts).
+    
+    output: dataframe (years x novels, without the row "Total"), None if there is no counts file
+    """
+    import create_summary                       # create_summary imports this module
+    try:
+        counts = create_summary.read_counts(settings_dict)
+    except FileNotFoundError:
+        return None
+    counts = counts.set_index(counts.columns[0])
+    counts = counts[counts.index.astype(str) != "Total"]
+    counts.index = pd.Index(pd.to_numeric(counts.index), dtype=np.int64)
+    counts.index.name = None
+    return counts.astype(np.int64)
+
+
+def check_counts(counts, state, novels, settings_dict):
+    """
+    Checks whether the existing table and the state of the last run fit together and to the settings.
+    
+    output: None if the table can be updated, else the reason for a full rebuild
+    """
+    if state is None:
+        return "no state of an earlier run ({})".format(get_statefile(settings_dict["lang"]))
+    if counts is None:
+        return "no reprint counts file"
+    if state["settings"] != {key: settings_dict[key] for key in STATE_SETTINGS}:
+        return "settings changed"
+    if not np.array_equal(counts.index.to_numpy(), get_years(settings_dict)):
+        return "years of the table do not match year_min and year_max"
+    if sorted(counts.columns) != sorted(state["novels"]):
+        return "novels of the table do not match the state"
+    return None
+
+
+def update_counts(novels, fingerprints, settings_dict, executor=None):
+    """
+    Incremental mode (counts_update: "incremental" in config.yaml): only the novels with new or changed pages
+    (see get_fingerprints) are parsed; their columns replace those in the existing table, columns of novels
+    without pages are removed. As a consistency check, counts_check unchanged novels are parsed as well and
+    compared with the table. Without a usable state of the last run, or if the check fails, the table is rebuilt.
+    
+    output: dataframe (years x novels, without the row "Total"), the same as create_counts
+    """
+    state = read_state(settings_dict)
+    counts = read_counts_table(settings_dict) if state is not None else None
+    reason = check_counts(counts, state, novels, settings_dict)
+    if reason is None:
+        changed = [id for id in novels if state["novels"].get(id) != fingerprints[id]]
+        unchanged = [id for id in novels if id not in changed]
+        checked = unchanged[::max(1, len(unchanged) // settings_dict["counts_check"])][:settings_dict["counts_check"]] if settings_dict["counts_check"] else []
+        print("Novels new or changed: {}, unchanged: {}, removed: {}".format(len(changed), len(unchanged), len(set(state["novels"]) - set(novels))))
+        instrumentation.count("novels_unchanged", len(unchanged))
+        recounted = create_counts({id: novels[id] for id in changed + checked}, settings_dict, executor)
+        different = [id for id in checked if not np.array_equal(recounted[id].to_numpy(), counts[id].to_numpy())]
+        if different:
+            reason = "consistency check failed for " + ", ".join(different)
+    if reason is not None:
+        print("Full rebuild of the reprint counts:", reason)
+        dataframe = create_counts(novels, settings_dict, executor)
+    else:
+        dataframe = counts.reindex(columns=list(novels), fill_value=0)
+        dataframe[changed] = recounted[changed]
+    return dataframe
+     
+                
+# === Coordinating function ===
+
+def main(settings_dict, executor=None):
+    """
+    Coordinates the creation of the publication table.
+    The pages are read from the store (html_storage, see html_store.py), grouped by novel and parsed in parallel (map); the publication years
+    of each novel are then written into the table once (reduce). With counts_update "incremental", only new or changed novels are parsed
+    (see update_counts). The state for the incremental mode is saved after every run, so a later incremental run
+    never starts from the state of an older table.
+    """
+    print("--createpublicationtable")
+    lang = settings_dict["lang"]
+    set_logfile(lang)
+    
+    store = html_store.open_store(settings_dict)
+    novels = store.list_pages()
+    fingerprints = get_fingerprints(store, novels)
+    store.close()
+    if settings_dict["counts_update"] == "incremental":
+        dataframe = update_counts(novels, fingerprints, settings_dict, executor)
+    else:
+        dataframe = create_counts(novels, settings_dict, executor)
+    add_sum(dataframe)
+    save_counts(dataframe, settings_dict)
+    save_state(settings_dict, fingerprints)
+        
+        
+#main(dir, htmlpages)
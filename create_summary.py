@@ -10,8 +10,14 @@ this function creates a summary for canonicity status.
 
 # Imports
 
+import hashlib
+import json
+import os
 import pandas as pd
 import numpy as np
+import instrumentation
+import counts_store
+import create_publicationtable
 
 
 # Functions 
@@ -27,6 +33,54 @@ def read_countsfile(countsfile):
         return counts
 
 
+def read_long_countsfile(countsfile, counts_format): 
+    """
+    Reads the reprint counts in long format ("XXX_reprint_counts_long.csv", ".parquet" or ".feather"). 
+    Output: DataFrame with the columns xmlid, year, count.
+    """
+    if counts_format == "parquet": 
+        create_publicationtable.require_pyarrow(counts_format)
+        return pd.read_parquet(countsfile)
+    if counts_format == "feather": 
+        create_publicationtable.require_pyarrow(counts_format)
+        return pd.read_feather(countsfile)
+    return pd.read_csv(countsfile, dtype={"xmlid": str})
+
+
+def widen_counts(long, settingsdict): 
+    """
+    Turns the long format back into the table read by read_countsfile 
+    (years from year_min to year_max as rows, plus "Total"; one column per novel), 
+    so the summary is the same whatever format the counts were saved in. 
+    Output: DataFrame.
+    """
+    years = create_publicationtable.get_years(settingsdict)
+    ids = pd.unique(long["xmlid"])
+    matrix = create_publicationtable.create_matrix(years, ids)
+    columns = pd.Index(ids).get_indexer(long["xmlid"])
+    rows = create_publicationtable.get_year_index(years)[long["year"].to_numpy(dtype=np.intp)]
+    np.add.at(matrix, (rows, columns), long["count"].to_numpy(dtype=np.int64))
+    counts = create_publicationtable.create_dataframe(matrix, years, list(ids))
+    create_publicationtable.add_sum(counts)
+    return counts.reset_index()
+
+
+def read_counts(settingsdict): 
+    """
+    Reads the reprint counts in the first format of counts_formats (config.yaml). 
+    Output: DataFrame as from read_countsfile.
+    """
+    counts_format = create_publicationtable.get_counts_formats(settingsdict)[0]
+    countsfile = create_publicationtable.get_countsfile(settingsdict["lang"], counts_format)
+    if counts_format == "csv": 
+        return read_countsfile(countsfile)
+    if counts_format == "mmap": 
+        counts = counts_store.open_store(settingsdict).select()
+        create_publicationtable.add_sum(counts)
+        return counts.reset_index()
+    return widen_counts(read_long_countsfile(countsfile, counts_format), settingsdict)
+
+
 def read_metadatafile(metadatafile): 
     """
     Reads the "XXX_metadata.csv". 
@@ -38,39 +92,166 @@ def read_metadatafile(metadatafile):
         return metadata
 
 
-def get_status(item): 
+def get_status(item, threshold=1): 
     """
     Calculates the canonicity status for a novel 
     based on the reprint count in the target period.
-    The target period has been set to 1970-2009. 
-    TODO: the minimum value could be made a parameter.
-    Output: either string "high" or string "low"
+    The target period and the threshold are set in config.yaml (target_period, default 1970-2009; 
+    canon_threshold, default 1). Works for one count or an array of counts at once. 
+    Output: either string "high" or string "low" (or an array of them)
     """
-    print(item)
-    if item > 1: 
-        return "high"
-    else: 
-        return "low"
+    status = np.where(np.asarray(item) > threshold, "high", "low")
+    if status.ndim == 0: 
+        return str(status)
+    return status
 
 
-def create_summary(counts, metadata): 
+def get_period(counts, target_period): 
+    """
+    Selects the rows of the target period by their year (first column),
+    not by their position in the table. 
+    Output: boolean Series.
+    """
+    years = pd.to_numeric(counts.iloc[:,0], errors="coerce")
+    return (years >= target_period[0]) & (years <= target_period[1])
+
+
+def create_summary(counts, metadata, target_period=(1970, 2009), threshold=1): 
     """
     Creates a summary from the full reprint count data. 
     Adds some metadata for better readability. 
-    Columns: all reprints, reprints 1970-2009, author, title.
+    Columns: all reprints, reprints in the target period (default: 1970-2009), 
+    canonicity status (more reprints than threshold in the target period), author, title.
     Output: DataFrame. 
     """
     total_counts = np.sum(counts.iloc[:,1:], axis=0)
-    canon_counts = np.sum(counts.iloc[131:171,1:], axis=0)    
+    canon_counts = np.sum(counts.loc[get_period(counts, target_period)].iloc[:,1:], axis=0)    
     columns = ["total_counts", "canon_counts"]
     summary = pd.DataFrame([total_counts, canon_counts], index=columns).T
-    summary["canon_status"] = summary.apply(lambda row: get_status(row.canon_counts), axis=1)
+    summary["canon_status"] = get_status(summary["canon_counts"], threshold)
     summary["author"] = metadata.loc[:,"au-name"]
     summary["title"] = metadata.loc[:,"title"]
     print(summary.head())
     return summary
+
+
+def summarize(counts, metadata, settingsdict): 
+    """
+    Summary with the target period and the threshold from config.yaml; 
+    used by all modes (stages, stream, service), so they give the same status. 
+    """
+    return create_summary(counts, metadata, settingsdict["target_period"], settingsdict["canon_threshold"])
     
 
+def get_column_hashes(counts): 
+    """
+    sha1 of the counts of each novel (column of the counts table, with the row "Total"). 
+    Output: dictionary with the ids as keys. 
+    """
+    return {str(id): hashlib.sha1(np.ascontiguousarray(counts[id].to_numpy(dtype=np.int64)).tobytes()).hexdigest() 
+            for id in counts.columns[1:]}
+
+
+def update_summary(counts, metadata, settingsdict): 
+    """
+    Incremental mode (counts_update: "incremental" in config.yaml): only the rows of novels whose counts 
+    have changed since the last summary (see get_column_hashes, "XXX_summary.state.json") are computed again, 
+    rows of novels no longer in the counts are removed. Without a usable state, the summary is created anew. 
+    Output: DataFrame, the same as create_summary. 
+    """
+    lang = str(settingsdict["lang"])
+    statefile = lang + "_summary.state.json"
+    hashes = get_column_hashes(counts)
+    state = None
+    if os.path.isfile(statefile) and os.path.isfile(lang + "_summary.csv"): 
+        with open(statefile, "r", encoding="utf8") as infile: 
+            state = json.load(infile)
+    if state is None or state["parameters"] != get_summary_parameters(settingsdict): 
+        summary = summarize(counts, metadata, settingsdict)
+    else: 
+        changed = [id for id in counts.columns[1:] if state["novels"].get(str(id)) != hashes[str(id)]]
+        print("Summary rows computed again:", len(changed))
+        with open(lang + "_summary.csv", "r", encoding="utf8") as infile: 
+            summary = pd.read_table(infile, sep="\t", index_col=0)
+        if changed: 
+            rows = summarize(counts[[counts.columns[0]] + changed], metadata, settingsdict)
+            summary = pd.concat([summary.drop(index=changed, errors="ignore"), rows])
+        summary = summary.reindex(counts.columns[1:])
+        summary["author"] = metadata.loc[:,"au-name"]
+        summary["title"] = metadata.loc[:,"title"]
+    return summary
+
+
+def get_summary_parameters(settingsdict): 
+    return {"target_period": list(settingsdict["target_period"]), "canon_threshold": settingsdict["canon_threshold"]}
+
+
+def save_summary_state(counts, settingsdict): 
+    """
+    Saves the parameters and the hashes of the counts the summary was created from (for the incremental mode; 
+    saved after every run, also a full one, so the state always belongs to the existing summary). 
+    """
+    statefile = str(settingsdict["lang"]) + "_summary.state.json"
+    with open(statefile + ".tmp", "w", encoding="utf8") as outfile: 
+        json.dump({"parameters": get_summary_parameters(settingsdict), "novels": get_column_hashes(counts)}, outfile, indent=1, sort_keys=True)
+    os.replace(statefile + ".tmp", statefile)
+
+
+def create_cumulative_index(counts): 
+    """
+    Cumulative sums of the reprint counts over the years (rows with a year only, sorted by year), 
+    with a row of zeros in front: the reprints of a novel from year a to year b are then 
+    cumulative[j] - cumulative[i], with i, j the positions of a and b in years (see get_period_totals). 
+    Output: years (array), cumulative sums (array: len(years) + 1 rows, one column per novel), ids of the novels. 
+    """
+    years = pd.to_numeric(counts.iloc[:,0], errors="coerce").to_numpy()
+    rows = ~np.isnan(years)
+    order = np.argsort(years[rows], kind="stable")
+    matrix = counts.iloc[:,1:].to_numpy()[rows][order]
+    cumulative = np.zeros((len(order) + 1, matrix.shape[1]), dtype=np.int64)
+    np.cumsum(matrix, axis=0, out=cumulative[1:])
+    return years[rows][order], cumulative, list(counts.columns[1:])
+
+
+def get_period_totals(index, periods): 
+    """
+    Reprints of each novel in each period (first and last year, both included), 
+    from the cumulative index (see create_cumulative_index). 
+    Output: array with one row per period and one column per novel. 
+    """
+    years, cumulative, ids = index
+    periods = np.asarray(periods, dtype=float).reshape(-1, 2)
+    first = np.searchsorted(years, periods[:,0], side="left")
+    last = np.searchsorted(years, periods[:,1], side="right")
+    return cumulative[last] - cumulative[first]
+
+
+def create_sweep(counts, metadata, periods, thresholds): 
+    """
+    Canonicity status of all novels for each combination of a period and a threshold 
+    (sweep_periods and sweep_thresholds in config.yaml). The cumulative index is built once; 
+    the totals of all periods and the status for all thresholds are computed in one step each. 
+    Columns: period, threshold, canon_counts, canon_status, author, title (one row per novel and combination). 
+    Output: DataFrame with the xmlid as index. 
+    """
+    index = create_cumulative_index(counts)
+    ids = index[2]
+    thresholds = np.asarray(thresholds)
+    totals = get_period_totals(index, periods)                                  # periods x novels
+    status = get_status(totals[:,np.newaxis,:], thresholds[np.newaxis,:,np.newaxis])       # periods x thresholds x novels
+    shape = status.shape
+    labels = ["{}-{}".format(first, last) for first, last in periods]
+    sweep = pd.DataFrame({
+        "period": np.repeat(labels, shape[1] * shape[2]), 
+        "threshold": np.tile(np.repeat(thresholds, shape[2]), shape[0]), 
+        "canon_counts": np.repeat(totals, shape[1], axis=0).ravel(), 
+        "canon_status": status.ravel(), 
+        }, index=pd.Index(np.tile(ids, shape[0] * shape[1]), name="xmlid"))
+    sweep["author"] = metadata["au-name"].reindex(sweep.index).to_numpy()
+    sweep["title"] = metadata["title"].reindex(sweep.index).to_numpy()
+    return sweep
+
+
 def save_summary(summary, lang): 
     """
     Saves the summary DataFrame to CSV.
@@ -80,14 +261,49 @@ def save_summary(summary, lang):
         summary.to_csv(outfile, sep="\t")
 
 
+def combine_summaries(langs): 
+    """
+    Combines the summaries of several languages into one table
+    with an additional column "lang" (batch mode of run_worldcat.py).
+    Output: DataFrame, saved as "all_summary.csv".
+    """
+    summaries = []
+    for lang in langs: 
+        with open(str(lang) + "_summary.csv", "r", encoding="utf8") as infile: 
+            summary = pd.read_table(infile, sep="\t", index_col=0)
+        summary.insert(0, "lang", lang)
+        summaries.append(summary)
+    combined = pd.concat(summaries)
+    save_summary(combined, "all")
+    return combined
+
+
 # Coordinating function.
 
 def main(settingsdict): 
-    countsfile = str(settingsdict["lang"]) + "_reprint_counts.csv"
     metadatafile = str(settingsdict["lang"]) + "_metadata.csv"
-    counts = read_countsfile(countsfile)
+    counts = read_counts(settingsdict)
     metadata = read_metadatafile(metadatafile)
-    summary = create_summary(counts, metadata)
+    if settingsdict["counts_update"] == "incremental": 
+        summary = update_summary(counts, metadata, settingsdict)
+    else: 
+        summary = summarize(counts, metadata, settingsdict)
+    instrumentation.count("novels", len(summary))
     save_summary(summary, settingsdict["lang"])
+    save_summary_state(counts, settingsdict)
+
+
+def main_sweep(settingsdict): 
+    """
+    Writes the canonicity status for all periods and thresholds of the sweep to "XXX_sweep.csv".
+    """
+    metadatafile = str(settingsdict["lang"]) + "_metadata.csv"
+    counts = read_counts(settingsdict)
+    metadata = read_metadatafile(metadatafile)
+    sweep = create_sweep(counts, metadata, settingsdict["sweep_periods"], settingsdict["sweep_thresholds"])
+    instrumentation.count("rows", len(sweep))
+    sweepfile = str(settingsdict["lang"]) + "_sweep.csv"
+    with open(sweepfile, "w", encoding="utf8") as outfile: 
+        sweep.to_csv(outfile, sep="\t")
     
 #main(settingsdict)
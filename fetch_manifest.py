@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+
+"""
+Fetch manifest for the download of the worldcat result pages.
+
+For each xmlid the manifest records the search url, the number of results,
+the pages that have been fetched (with timestamp and content hash) and the time
+of the last update. It is stored as json file in the html folder of the language
+(html/<lang>/manifest.json, also when the pages themselves are stored in
+html/<lang>.sqlite, see html_store.py), so that a new run only downloads missing or stale
+pages and an interrupted run continues where it stopped.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from os.path import join, isfile
+
+
+MANIFEST_NAME = "manifest.json"
+
+
+# === Functions ===
+
+def get_timestamp(seconds=None):
+    """
+    Returns a timestamp (UTC, ISO format) for the given time in seconds or for now.
+    """
+    if seconds is None:
+        seconds = time.time()
+    return datetime.fromtimestamp(seconds, timezone.utc).isoformat(timespec="seconds")
+
+
+def get_seconds(timestamp):
+    """
+    Turns a timestamp written by get_timestamp back into seconds.
+    """
+    return datetime.fromisoformat(timestamp).timestamp()
+
+
+def get_hash(html):
+    """
+    Returns the sha1 hash of the page content.
+    """
+    return hashlib.sha1(html.encode("utf8")).hexdigest()
+
+
+def get_cutoff(refresh_older_than):
+    """
+    Pages fetched before the cutoff (in seconds) are considered stale.
+
+    input: age in days (None: pages never become stale)
+    output: cutoff in seconds
+    """
+    if refresh_older_than is None:
+        return 0.0
+    return time.time() - float(refresh_older_than) * 86400
+
+
+class FetchManifest:
+    """
+    Manifest of the fetched pages of one language; safe to use from several threads.
+    """
+
+    def __init__(self, write_file, store, refresh_older_than=None, save_interval=5.0):
+        self.write_file = write_file
+        self.store = store
+        self.path = join(write_file, MANIFEST_NAME)
+        self.cutoff = get_cutoff(refresh_older_than)
+        self.save_interval = save_interval
+        self.lock = threading.Lock()
+        self.last_saved = time.monotonic()
+        self.entries = {}
+        if isfile(self.path):
+            with open(self.path, "r", encoding="utf8") as infile:
+                self.entries = json.load(infile)
+
+    def get_entry(self, xmlid):
+        with self.lock:
+            return self.entries.get(xmlid)
+
+    def bootstrap(self, xmlid, url, get_number_of_results):
+        """
+        Creates an entry for pages already in the store but not yet in the manifest
+        (from older runs or from a run interrupted before the manifest was saved).
+        """
+        with self.lock:
+            entry = self.entries.get(xmlid)
+        if (entry is not None and "1" in entry["pages"]) or not self.store.has_page(xmlid, 1):
+            return
+        hits = get_number_of_results(self.store.read_page(xmlid, 1))
+        pages = {}
+        number = 1
+        while self.store.has_page(xmlid, number):
+            sha1 = get_hash(self.store.read_page(xmlid, number))
+            pages[str(number)] = {"fetched": get_timestamp(self.store.stored_time(xmlid, number)), "sha1": sha1}
+            number += 1
+        with self.lock:
+            entry = self.entries.setdefault(xmlid, {"url": url, "hits": hits, "pages": {}})
+            entry["hits"] = hits
+            for number, page in pages.items():
+                entry["pages"].setdefault(number, page)
+            entry["updated"] = get_timestamp()
+
+    def is_fresh(self, xmlid, filename_number):
+        """
+        A page is fresh if it is recorded in the manifest, exists in the store
+        and has not been fetched before the cutoff.
+        """
+        with self.lock:
+            entry = self.entries.get(xmlid)
+            if entry is None or str(filename_number) not in entry["pages"]:
+                return False
+            fetched = entry["pages"][str(filename_number)]["fetched"]
+        if not self.store.has_page(xmlid, filename_number):
+            return False
+        return get_seconds(fetched) >= self.cutoff
+
+    def record_page(self, xmlid, url, filename_number, html, hits=None):
+        """
+        Records a downloaded page. The hit count is taken from the first page.
+        """
+        with self.lock:
+            entry = self.entries.setdefault(xmlid, {"url": url, "hits": None, "pages": {}})
+            if filename_number == 1:
+                entry["url"] = url
+                entry["hits"] = hits
+                entry.pop("last_page", None)
+            entry["pages"][str(filename_number)] = {"fetched": get_timestamp(), "sha1": get_hash(html)}
+            entry["updated"] = get_timestamp()
+        if time.monotonic() - self.last_saved > self.save_interval:
+            self.save()
+
+    def set_last_page(self, xmlid, filename_number):
+        """
+        Records the last page with new hits; the following ones (no hits or the same hits as an earlier page) are not downloaded again (see get_htmlworldcat.harvest_many).
+        """
+        with self.lock:
+            entry = self.entries.setdefault(xmlid, {"url": None, "hits": None, "pages": {}})
+            entry["last_page"] = filename_number
+            entry["updated"] = get_timestamp()
+
+    def remove_pages(self, xmlid, last_page):
+        """
+        Removes the pages after last_page from the entry (they have been deleted from the store).
+        """
+        with self.lock:
+            entry = self.entries.get(xmlid)
+            if entry is None:
+                return
+            for number in [number for number in entry["pages"] if int(number) > last_page]:
+                del entry["pages"][number]
+
+    def save(self):
+        """
+        Writes the manifest to a temporary file and replaces the old one,
+        so an interruption never leaves a broken manifest.
+        """
+        with self.lock:
+            os.makedirs(self.write_file, exist_ok=True)
+            temp = self.path + ".tmp"
+            with open(temp, "w", encoding="utf8") as outfile:
+                json.dump(self.entries, outfile, indent=1, sort_keys=True)
+            os.replace(temp, self.path)
+            self.last_saved = time.monotonic()
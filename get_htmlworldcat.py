@@ -1,136 +1,512 @@
-"""
-Script for downloading html-files from worldcat
-Input: metadata-table, which was created by getmetadata.py (csv-file)
-Output: html-files for each id in the metadata-table
-
-Script zum Download der html-Seiten von worldcat
-Die Metadaten-Tabelle wird dabei als Input gegeben
-Output sind die entsprechenden html-Seiten zu jedem Werk in der Metadaten-Tabelle
-
-Beispiel-Suchstring, nach erweiterter Suche, Titel, Autor, nur gedruckte Bücher angewählt;
-Suche nach Microfiche und E-Book abgewählt;
-Sprache Französisch ausgewählt
-
-https://www.worldcat.org/search?q=ti%3ABelle+rivi%C3%A8re+au%3AAimard&dblist=638&fq=+%28x0%3Abook-+OR+%28x0%3Abook+x4%3Aprintbook%29+-%28%28x0%3Abook+x4%3Adigital%29%29+-%28%28x0%3Abook+x4%3Amic%29%29%29+%3E+x0%3Abook+%3E+ln%3Afre&qt=facet_ln%3A
-
-Dieser Suchstring wird als plain_suchstring übergeben; Autor und Titel wurden mit {} für die .format-Methode ersetzt
-
-"""
-
-import requests
-import os
-from os.path import join
-import pandas as pd
-import re
-
-
-def read_csv(csv_file):
-    """
-    read metadata-table
-    Metadaten-Tabelle wird eingelesen
-    """
-    with open(csv_file, encoding = "utf8") as infile:
-        data = pd.read_csv(infile, sep = "\t")
-        #print(data.head())
-    return data
-   
-   
-def get_author(data):
-    """
-    get author
-    Autoren-Name wird aus Metadaten-Tabelle entnommen
-    """
-    author = data["au-name"]
-    author = author.split(",")[0]
-    print(author)
-    return author
-
-
-def get_title(data):
-    """
-    get title
-    Titel wird der Metadaten-Tabelle entnommen
-    """
-    title = data["title"]
-    title = title.split(": ELT")[0]
-    print(title)
-    return title
-    
-def generate_suchstring(settings_dict, title, author):
-    """
-    Die Url wird über .format mit Titel und Autor  modifiziert
-    """
-    plain_suchstring = "https://www.worldcat.org/search?q=ti%3A{}+au%3A{}&fq=+%28x0%3Abook-+OR+%28x0%3Abook+x4%3Aprintbook%29+-%28%28x0%3Abook+x4%3Adigital%29%29+-%28%28x0%3Abook+x4%3Amic%29%29+-%28%28x0%3Abook+x4%3Abraille%29%29+-%28%28x0%3Abook+x4%3Alargeprint%29%29%29+%3E+ln%3A{}+%3E+ln%3A{}&dblist=638&start={}&qt=page_number_link"
-    suchstring = plain_suchstring.format(title, author, settings_dict["lang_worldcat"], settings_dict["lang_worldcat"], 1)
-    #print(suchstring)
-    return suchstring
-
-
-def get_html(suchstring, data, write_file, filename_number, lang):
-    """
-    get html with the requests-library
-    Mit requests wird die html heruntergeladen
-    """
-    #print(suchstring)
-    try:
-        html = requests.get(suchstring)
-        html = html.text
-        save_html(data, write_file, html, filename_number, lang)
-        #print(html)
-        
-        start = re.sub("start=1", "start={}", suchstring)
-    
-        numbers_of_result = re.search("of about <strong>(.*?)</strong>",html).group(1)
-        print("Number of results: ", numbers_of_result)
-
-        x = 11
-        while x <= int(numbers_of_result):
-            try:
-                modified_url = start.format(x)
-                #print(modified_url)
-                modified_url = requests.get(modified_url)
-                modified_url = modified_url.text
-                filename_number += 1
-                save_html(data, write_file, modified_url, filename_number, lang)
-                x += 10
-            except AttributeError:
-                print("Url not found")
-        
-    except AttributeError:
-        print("Url not found")
-    return html
-    
-    
-def save_html(data, write_file, html, filename_number, lang):
-    """
-    Die html-Seiten werden abgespeichert; im Folgenden werden die Dateien mit Autor_Titel_html.html gespeichert
-    """
-    #with open(join(write_file, "{}_{}_html.html".format(author, title)), "w", encoding="utf8") as outfile:
-    #    outfile.write(html)
-    
-    """
-    Besser zur Weiterverarbeitung: filename oder xml-id aus Metadatentabelle:
-    """
-    if not os.path.exists(write_file): 
-        os.makedirs(write_file)
-    filename = data["basename"]
-    xmlid = data["xmlid"]
-    with open(join(write_file, "{}_html{}.html".format(xmlid, filename_number)), "w", encoding="utf8") as outfile:
-        outfile.write(html)
-
-
-def main(settings_dict):
-    print("--gethtmlworldcat")
-    filename_number = 1
-    csv_file = settings_dict["csv_file"]
-    write_file = settings_dict["write_file"]
-    lang = settings_dict["lang"]
-    data = read_csv(csv_file)
-    for index, data in data.iterrows():
-        print(data["xmlid"])
-        author = get_author(data)
-        title = get_title(data)
-        suchstring = generate_suchstring(settings_dict, title, author)
-        html = get_html(suchstring, data, write_file, filename_number, lang)
-        #save_html(data, write_file, html, author, title)
-    
+"""
+Script for downloading html-files from worldcat
+Input: metadata-table, which was created by getmetadata.py (csv-file)
+Output: html-files for each id in the metadata-table
+
+Script zum Download der html-Seiten von worldcat
+Die Metadaten-Tabelle wird dabei als Input gegeben
+Output sind die entsprechenden html-Seiten zu jedem Werk in der Metadaten-Tabelle
+
+Beispiel-Suchstring, nach erweiterter Suche, Titel, Autor, nur gedruckte Bücher angewählt;
+Suche nach Microfiche und E-Book abgewählt;
+Sprache Französisch ausgewählt
+
+https://www.worldcat.org/search?q=ti%3ABelle+rivi%C3%A8re+au%3AAimard&dblist=638&fq=+%28x0%3Abook-+OR+%28x0%3Abook+x4%3Aprintbook%29+-%28%28x0%3Abook+x4%3Adigital%29%29+-%28%28x0%3Abook+x4%3Amic%29%29%29+%3E+x0%3Abook+%3E+ln%3Afre&qt=facet_ln%3A
+
+Dieser Suchstring wird als plain_suchstring übergeben; Autor und Titel wurden mit {} für die .format-Methode ersetzt
+
+"""
+
+import requests
+import pandas as pd
+import re
+import heapq
+import itertools
+import time
+from urllib.parse import quote_plus
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import http_fetch
+import fetch_manifest
+import parse_worldcat
+import html_store
+import query_memo
+import instrumentation
+
+
+ORDERS = ["longest_first", "table"]
+
+
+def read_csv(csv_file):
+    """
+    read metadata-table
+    Metadaten-Tabelle wird eingelesen
+    """
+    with open(csv_file, encoding = "utf8") as infile:
+        data = pd.read_csv(infile, sep = "\t")
+        #print(data.head())
+    return data
+   
+   
+def get_author(data):
+    """
+    get author
+    Autoren-Name wird aus Metadaten-Tabelle entnommen
+    """
+    author = data["au-name"]
+    author = author.split(",")[0]
+    print(author)
+    return author
+
+
+def get_title(data):
+    """
+    get title
+    Titel wird der Metadaten-Tabelle entnommen
+    """
+    title = data["title"]
+    title = title.split(": ELT")[0]
+    print(title)
+    return title
+    
+def generate_suchstring(settings_dict, title, author):
+    """
+    Die Url wird über .format mit Titel und Autor  modifiziert
+    (URL-kodiert, damit z.B. & oder # im Titel die Suche nicht abschneiden)
+    """
+    plain_suchstring = settings_dict["worldcat_url"] + "/search?q=ti%3A{}+au%3A{}&fq=+%28x0%3Abook-+OR+%28x0%3Abook+x4%3Aprintbook%29+-%28%28x0%3Abook+x4%3Adigital%29%29+-%28%28x0%3Abook+x4%3Amic%29%29+-%28%28x0%3Abook+x4%3Abraille%29%29+-%28%28x0%3Abook+x4%3Alargeprint%29%29%29+%3E+ln%3A{}+%3E+ln%3A{}&dblist=638&start={}&qt=page_number_link"
+    suchstring = plain_suchstring.format(quote_plus(str(title)), quote_plus(str(author)), settings_dict["lang_worldcat"], settings_dict["lang_worldcat"], 1)
+    #print(suchstring)
+    return suchstring
+
+
+def get_number_of_results(html):
+    """
+    Die Anzahl der Treffer ("of about N") wird aus der ersten Seite ausgelesen
+    output: number of results or None, if there is no search result
+    """
+    return parse_worldcat.get_number_of_results(html)
+
+
+def generate_pageurls(suchstring, numbers_of_result, page_size=10, last_page=None):
+    """
+    Die Urls der Seiten 2..N werden aus der Url der ersten Seite erzeugt (page_size Treffer pro Seite, bei WorldCat 10):
+    N = Trefferzahl / page_size (aufgerundet), hoechstens last_page (das Ende der Treffer, wie es bei einem frueheren Lauf
+    festgestellt wurde, siehe harvest_many)
+    output: list of tuples (filename_number, url)
+    """
+    start = re.sub("start=1", "start={}", suchstring)
+    pages = -(-numbers_of_result // page_size) if numbers_of_result else 1
+    if last_page is not None:
+        pages = min(pages, last_page)
+    return [(filename_number, start.format((filename_number - 1) * page_size + 1)) for filename_number in range(2, pages + 1)]
+
+
+def delete_pages_after(store, manifest, xmlid, last_page):
+    """
+    Die gespeicherten Seiten nach last_page (z.B. aus einem frueheren Lauf mit einer hoeheren Trefferzahl)
+    werden aus dem Speicher und dem Manifest entfernt, damit sie nicht mehr gezaehlt werden.
+    output: number of pages deleted
+    """
+    numbers = [number for number in store.list_numbers(xmlid) if number > last_page]
+    for number in numbers:
+        store.delete_page(xmlid, number)
+    manifest.remove_pages(xmlid, last_page)
+    return len(numbers)
+
+
+def get_hits_hash(html):
+    """
+    Hash der Trefferzeilen einer Seite (ohne Kopf- und Fusszeilen, die sich bei jeder Anfrage aendern koennen);
+    None fuer eine Seite ohne Treffer. Die Nummern der Treffer zaehlen auf jeder Seite von 1 an und
+    unterscheiden die Seiten deshalb nicht.
+    """
+    rows = [row.start() for row in parse_worldcat.ROW.finditer(html)]
+    if not rows:
+        return None
+    end = html.find("</table>", rows[-1])
+    return fetch_manifest.get_hash(html[rows[0]:end if end != -1 else len(html)])
+
+
+def get_priority(order, page_number, remaining):
+    """
+    Prioritaet einer Anfrage (kleinere zuerst): die ersten Seiten aller Romane kommen vor allen anderen,
+    da erst sie die Zahl der Seiten verraten. Danach mit harvest_order "longest_first" die Seiten der Romane
+    mit den meisten noch anzufragenden Seiten, damit kein grosser Roman am Ende allein geladen wird;
+    mit "table" in der Reihenfolge der Anfragen.
+    input: harvest_order, page number, pages of the novel still to be requested (including this one)
+    """
+    if page_number == 1:
+        return (0, 0)
+    if order == "longest_first":
+        return (1, -remaining)
+    if order == "table":
+        return (1, 0)
+    raise ValueError("Unknown harvest_order '{}', choose one of: {}".format(order, ", ".join(ORDERS)))
+
+
+def harvest(settings_dict, data, session=None, limiter=None):
+    """
+    Concurrent download of all result pages of all novels in the metadata table.
+    
+    input: settings_dict, metadata table, optionally a shared session and limiter
+    output: dictionary with the number of results for each xmlid
+    """
+    return harvest_many([(settings_dict, data)], session, limiter)[settings_dict["lang"]]
+
+
+def get_rows(data):
+    """
+    Die Zeilen einer Metadaten-Tabelle (DataFrame) oder einer beliebigen Folge von Zeilen
+    (Dictionaries, Streaming-Modus in pipeline.py).
+    """
+    if hasattr(data, "iterrows"):
+        return (row for i, row in data.iterrows())
+    return iter(data)
+
+
+def iterate_rows(collections):
+    """
+    Die Romane mehrerer Sammlungen werden abwechselnd durchlaufen (eine Sprache nach der anderen, Roman fuer Roman),
+    damit alle Sprachen gleichzeitig vorankommen.
+    output: iterator over (index of the collection, row)
+    """
+    iterators = [get_rows(data) for settings_dict, data in collections]
+    while iterators:
+        for position, iterator in list(enumerate(iterators)):
+            row = next(iterator, None)
+            if row is None:
+                iterators[position] = None
+            else:
+                yield position, row
+        iterators = [iterator for iterator in iterators if iterator is not None]
+        
+
+class Harvest:
+    """
+    Zustand eines Downloads (siehe harvest_many): die Sammlungen mit Speicher und Manifest, die Anfragen
+    im Thread-Pool und in der Warteschlange, die Plaene der Seiten 2..N und die wartenden Romane.
+    """
+
+    def __init__(self, collections, session=None, limiter=None, on_novel=None, max_novels=None):
+        self.collections = collections
+        self.first = collections[0][0]
+        self.session = session if session is not None else http_fetch.get_session(self.first)
+        self.limiter = limiter if limiter is not None else http_fetch.get_limiter(self.first)
+        self.on_novel = on_novel
+        self.max_novels = max_novels
+        self.contexts = []
+        for settings_dict, data in collections:
+            store = html_store.open_store(settings_dict)
+            manifest = fetch_manifest.FetchManifest(settings_dict["write_file"], store, settings_dict["refresh_older_than"])
+            self.contexts.append({"settings": settings_dict, "store": store, "manifest": manifest, "results": {}, "skipped": 0})
+        self.memo = query_memo.open_memo(self.first)
+        self.stores = {(context["settings"]["html_storage"], context["settings"]["write_file"]): context["store"] for context in self.contexts}
+        self.executor = None
+        self.pending = {}               # future -> request in the thread pool
+        self.open_pages = {}            # (lang, xmlid) -> number of pages of the novel not yet finished
+        self.keys = {}                  # (lang, xmlid) -> search key (query_memo.get_key)
+        self.waiting = {}               # search key being downloaded -> novels with the same search, waiting for its pages
+        self.plans = {}                 # (lang, xmlid) -> pages 2..N of the novel still to be requested and checked
+        self.ready = []                 # requests not yet given to the thread pool: heap of (priority, sequence, request)
+        self.sequence = itertools.count()
+        self.progress = {"started": time.monotonic(), "shown": time.monotonic(), "downloaded": 0, "probes": 0}
+
+    def run(self):
+        """
+        output: dictionary with the languages as keys and dictionaries with the number of results for each xmlid as values
+        """
+        with ThreadPoolExecutor(max_workers=self.first["harvest_workers"]) as self.executor:
+            for position, row in iterate_rows(self.collections):
+                self.add_novel(self.contexts[position], row)
+                while self.max_novels and len(self.open_pages) >= self.max_novels:
+                    self.handle(wait(self.pending, return_when=FIRST_COMPLETED)[0])
+            while self.pending:
+                self.handle(wait(self.pending, return_when=FIRST_COMPLETED)[0])
+            self.show_progress(final=True)
+        return self.close()
+
+    def close(self):
+        self.memo.save()
+        for store in self.stores.values():
+            if all(store is not context["store"] for context in self.contexts):
+                store.close()
+        results = {}
+        for context in self.contexts:
+            context["manifest"].save()
+            context["store"].close()
+            print(context["settings"]["lang"], "pages skipped (already downloaded): ", context["skipped"])
+            instrumentation.count("pages_skipped", context["skipped"])
+            results[context["settings"]["lang"]] = context["results"]
+        return results
+
+    def add_novel(self, context, row):
+        """
+        Ein Roman aus der Metadaten-Tabelle: ist die erste Seite laut Manifest vorhanden und nicht veraltet,
+        werden gleich die Seiten 2..N geplant, sonst wird die erste Seite geladen (siehe start_novel).
+        """
+        instrumentation.count("novels")
+        manifest = context["manifest"]
+        self.open_pages[(context["settings"]["lang"], row["xmlid"])] = 1       # held until all pages are submitted
+        author = get_author(row)
+        title = get_title(row)
+        suchstring = generate_suchstring(context["settings"], title, author)
+        key = query_memo.get_key(context["settings"], title, author)
+        manifest.bootstrap(row["xmlid"], suchstring, get_number_of_results)
+        if manifest.is_fresh(row["xmlid"], 1):
+            self.keys[(context["settings"]["lang"], row["xmlid"])] = key
+            numbers_of_result = manifest.get_entry(row["xmlid"])["hits"]
+            context["results"][row["xmlid"]] = numbers_of_result
+            context["skipped"] += 1
+            if numbers_of_result is not None:
+                self.submit_pages(context, row, suchstring, numbers_of_result)
+            self.close_page(context, row)
+        else:
+            self.start_novel(context, row, suchstring, key)
+
+    def submit(self, context, row, suchstring, page_number, url, remaining=1):
+        """
+        Die Anfrage wird nach ihrer Prioritaet eingereiht (siehe get_priority) und an den Thread-Pool
+        gegeben, sobald dort ein Platz frei ist.
+        """
+        priority = get_priority(self.first["harvest_order"], page_number, remaining)
+        heapq.heappush(self.ready, (priority, next(self.sequence), (context, row, suchstring, page_number, url)))
+        self.open_pages[(context["settings"]["lang"], row["xmlid"])] += 1
+        if page_number == 1:
+            self.progress["probes"] += 1
+        self.dispatch()
+
+    def dispatch(self):
+        while self.ready and len(self.pending) < self.first["harvest_workers"]:
+            request = heapq.heappop(self.ready)[2]
+            future = self.executor.submit(http_fetch.fetch, self.session, request[4], self.limiter)
+            self.pending[future] = request
+
+    def show_progress(self, final=False):
+        """
+        Fortschritt und geschaetzte Restzeit: die bekannten restlichen Seiten (laut Trefferzahl, bzw. eine
+        Seite fuer jeden Roman, dessen erste Seite noch aussteht) geteilt durch die bisherige Geschwindigkeit.
+        """
+        progress = self.progress
+        now = time.monotonic()
+        if not self.first["progress_interval"] or (not final and now - progress["shown"] < self.first["progress_interval"]):
+            return
+        progress["shown"] = now
+        remaining = sum(len(plan["urls"]) + len(plan["requested"]) - len(plan["arrived"]) for plan in self.plans.values()) + progress["probes"]
+        rate = progress["downloaded"] / max(now - progress["started"], 1e-9)
+        eta = "{:.0f} s".format(remaining / rate) if rate and not final else "-"
+        print("Progress: {} pages downloaded, {} to come ({} novels without number of results), {:.1f} pages/s, ETA {}".format(
+            progress["downloaded"], remaining, progress["probes"], rate, eta))
+
+    def submit_pages(self, context, row, suchstring, numbers_of_result):
+        """
+        Plant die Seiten 2..N: bereits vorhandene Seiten werden uebersprungen (ihr Inhalt dient dem Vergleich),
+        die uebrigen werden der Reihe nach angefragt, hoechstens page_window gleichzeitig.
+        """
+        settings_dict = context["settings"]
+        manifest = context["manifest"]
+        xmlid = row["xmlid"]
+        entry = manifest.get_entry(xmlid) or {}
+        planned = generate_pageurls(suchstring, numbers_of_result, settings_dict["page_size"])
+        plan = {"urls": deque(), "requested": deque(), "arrived": {}, "hashes": set(),
+                "planned": len(planned), "sent": 0, "skipped": 0, "stopped": False}
+        stored = [1]
+        for page_number, url in generate_pageurls(suchstring, numbers_of_result, settings_dict["page_size"], entry.get("last_page")):
+            if manifest.is_fresh(xmlid, page_number):
+                context["skipped"] += 1
+                plan["skipped"] += 1
+                stored.append(page_number)
+            else:
+                plan["urls"].append((page_number, url))
+        if plan["urls"]:
+            for number in stored:
+                if context["store"].has_page(xmlid, number):
+                    html = context["store"].read_page(xmlid, number)
+                    plan["hashes"].add(get_hits_hash(html))
+        self.plans[(settings_dict["lang"], xmlid)] = plan
+        self.submit_next(context, row, suchstring)
+
+    def submit_next(self, context, row, suchstring):
+        plan = self.plans[(context["settings"]["lang"], row["xmlid"])]
+        window = context["settings"]["page_window"]
+        while plan["urls"] and not plan["stopped"] and (not window or len(plan["requested"]) < window):
+            page_number, url = plan["urls"].popleft()
+            plan["requested"].append(page_number)
+            plan["sent"] += 1
+            self.submit(context, row, suchstring, page_number, url, len(plan["urls"]) + 1)
+
+    def check_pages(self, context, row, suchstring):
+        """
+        Die angekommenen Seiten werden in der Reihenfolge der Seitenzahlen geprueft und gespeichert; eine Seite
+        ohne Treffer oder mit denselben Treffern wie eine fruehere Seite beendet den Roman.
+        """
+        manifest = context["manifest"]
+        xmlid = row["xmlid"]
+        plan = self.plans[(context["settings"]["lang"], xmlid)]
+        while plan["requested"] and plan["requested"][0] in plan["arrived"]:
+            page_number = plan["requested"].popleft()
+            html, url = plan["arrived"].pop(page_number)
+            if html is None or plan["stopped"]:
+                continue
+            digest = get_hits_hash(html)
+            if digest is None or digest in plan["hashes"]:
+                reason = "no hits" if digest is None else "same hits as an earlier page"
+                print(xmlid, "page", page_number, reason, "- no further pages requested")
+                plan["stopped"] = True
+                plan["urls"].clear()
+                delete_pages_after(context["store"], manifest, xmlid, page_number - 1)
+                manifest.set_last_page(xmlid, page_number - 1)
+                instrumentation.count("pages_stopped")
+                continue
+            plan["hashes"].add(digest)
+            context["store"].write_page(xmlid, page_number, html)
+            manifest.record_page(xmlid, url, page_number, html)
+        self.submit_next(context, row, suchstring)
+
+    def close_page(self, context, row):
+        """
+        Eine Seite des Romans ist fertig; nach der letzten wird on_novel aufgerufen und die Romane
+        mit derselben Suche werden gestartet.
+        """
+        novel = (context["settings"]["lang"], row["xmlid"])
+        self.open_pages[novel] -= 1
+        if self.open_pages[novel] != 0:
+            return
+        del self.open_pages[novel]
+        plan = self.plans.pop(novel, None)
+        if plan is not None and plan["planned"] > plan["sent"] + plan["skipped"]:
+            saved = plan["planned"] - plan["sent"] - plan["skipped"]
+            print(row["xmlid"], "requests saved:", saved, "of", plan["planned"] + 1, "pages estimated")
+            instrumentation.count("requests_saved", saved)
+        key = self.keys.pop(novel)
+        if context["store"].has_page(row["xmlid"], 1):
+            self.memo.add(key, context["settings"], row["xmlid"])
+        if self.on_novel is not None:
+            self.on_novel(context["settings"], row)
+        for waiter in self.waiting.pop(key, []):
+            self.start_novel(*waiter, key)
+
+    def link_novel(self, context, row, suchstring, entry):
+        """
+        Die Seiten eines Romans mit derselben Suche werden verlinkt bzw. kopiert statt geladen.
+        output: True, if the pages could be taken from there
+        """
+        settings_dict = context["settings"]
+        if entry is None or (entry["xmlid"] == row["xmlid"] and entry["write_file"] == settings_dict["write_file"]
+                             and entry["html_storage"] == settings_dict["html_storage"]):
+            return False
+        source = query_memo.open_source(entry, self.stores)
+        if source is None:
+            return False
+        numbers = source.list_numbers(entry["xmlid"])
+        if 1 not in numbers or source.stored_time(entry["xmlid"], 1) < fetch_manifest.get_cutoff(settings_dict["refresh_older_than"]):
+            return False
+        html_store.copy_pages(source, entry["xmlid"], context["store"], row["xmlid"], numbers)
+        numbers_of_result = get_number_of_results(context["store"].read_page(row["xmlid"], 1))
+        urls = dict(generate_pageurls(suchstring, numbers_of_result or 0, settings_dict["page_size"]))
+        urls[1] = suchstring
+        for number in numbers:
+            html = context["store"].read_page(row["xmlid"], number)
+            context["manifest"].record_page(row["xmlid"], urls.get(number, suchstring), number, html, numbers_of_result)
+        if max(numbers) < len(urls):
+            context["manifest"].set_last_page(row["xmlid"], max(numbers))
+        context["results"][row["xmlid"]] = numbers_of_result
+        print(row["xmlid"], "same search as", entry["xmlid"], "- pages linked:", len(numbers))
+        instrumentation.count("pages_linked", len(numbers))
+        return True
+
+    def start_novel(self, context, row, suchstring, key):
+        """
+        Die erste Seite wird geladen, ausser die Suche wird gerade schon fuer einen anderen Roman geladen
+        (dann wartet der Roman auf dessen Seiten) oder ist aus einem frueheren Lauf bekannt.
+        """
+        novel = (context["settings"]["lang"], row["xmlid"])
+        if key in self.waiting:
+            self.waiting[key].append((context, row, suchstring))
+            return
+        self.keys[novel] = key
+        if not self.link_novel(context, row, suchstring, self.memo.find(key)):
+            self.waiting[key] = []
+            self.submit(context, row, suchstring, 1, suchstring)
+        self.close_page(context, row)
+
+    def handle_page(self, future, context, row, suchstring, filename_number, url):
+        manifest = context["manifest"]
+        try:
+            html = future.result()
+        except requests.RequestException as error:
+            print(row["xmlid"], "page", filename_number, "failed:", error)
+            instrumentation.count("pages_failed")
+            html = None
+        else:
+            instrumentation.count("pages_downloaded")
+            self.progress["downloaded"] += 1
+        if filename_number != 1:
+            self.plans[(context["settings"]["lang"], row["xmlid"])]["arrived"][filename_number] = (html, url)
+            self.check_pages(context, row, suchstring)
+            return
+        self.progress["probes"] -= 1
+        if html is None:
+            return
+        context["store"].write_page(row["xmlid"], filename_number, html)
+        numbers_of_result = get_number_of_results(html)
+        manifest.record_page(row["xmlid"], url, filename_number, html, numbers_of_result)
+        context["results"][row["xmlid"]] = numbers_of_result
+        pages = len(generate_pageurls(suchstring, numbers_of_result or 0, context["settings"]["page_size"])) + 1
+        delete_pages_after(context["store"], manifest, row["xmlid"], pages)
+        if numbers_of_result is None:
+            print(row["xmlid"], "Url not found")
+            return
+        print(row["xmlid"], "Number of results: ", numbers_of_result)
+        self.submit_pages(context, row, suchstring, numbers_of_result)
+
+    def handle(self, done):
+        for future in done:
+            context, row, suchstring, filename_number, url = self.pending.pop(future)
+            self.handle_page(future, context, row, suchstring, filename_number, url)
+            self.close_page(context, row)
+        self.dispatch()
+        self.show_progress()
+
+
+def harvest_many(collections, session=None, limiter=None, on_novel=None, max_novels=None):
+    """
+    Concurrent download of all result pages of the novels of one or several collections (languages),
+    in one shared thread pool with one session and one limiter.
+    Zuerst wird fuer jeden Roman die erste Seite geladen; sobald diese die Trefferzahl
+    verraet, werden die Seiten 2..N parallel im selben Thread-Pool geladen, hoechstens page_window
+    gleichzeitig je Roman. Die Seiten werden der Reihe nach geprueft: eine Seite ohne Treffer
+    oder mit denselben Treffern wie eine fruehere Seite (die Trefferzahl "of about" ist nur geschaetzt)
+    wird nicht gespeichert, und die folgenden Seiten werden nicht mehr angefragt (im Manifest als
+    last_page vermerkt). Die eingesparten Anfragen werden je Roman ausgegeben.
+    Die Anfragen warten in einer Warteschlange, bis im Thread-Pool ein Platz frei ist: zuerst die ersten Seiten
+    aller Romane, dann mit harvest_order "longest_first" die Seiten der Romane mit den meisten restlichen Seiten
+    (siehe get_priority). Alle progress_interval Sekunden werden Fortschritt und geschaetzte Restzeit ausgegeben.
+    Seiten, die laut Manifest schon vorhanden und nicht veraltet sind, werden uebersprungen.
+    Die Seiten werden im gewaehlten Speicher abgelegt (html_storage, siehe html_store.py).
+    Romane mit derselben Suche (siehe query_memo.py) werden nur einmal geladen; die Seiten der anderen werden
+    aus dem Speicher verlinkt bzw. kopiert, auch ueber Laeufe und Sprachen hinweg (query_memo in config.yaml).
+    Ist ein Roman fertig (alle Seiten geladen, uebersprungen oder fehlgeschlagen), wird on_novel(settings_dict, row)
+    aufgerufen; mit max_novels werden hoechstens so viele Romane gleichzeitig geladen (Streaming-Modus, siehe pipeline.py).
+    
+    input: list of (settings_dict, metadata table or iterable of rows), optionally a shared session and limiter,
+    a function called for each finished novel, the maximum number of novels downloaded at the same time
+    output: dictionary with the languages as keys and dictionaries with the number of results for each xmlid as values
+    """
+    return Harvest(collections, session, limiter, on_novel, max_novels).run()
+
+
+def main(settings_dict):
+    print("--gethtmlworldcat")
+    csv_file = settings_dict["csv_file"]
+    data = read_csv(csv_file)
+    harvest(settings_dict, data)
+
+
+def main_many(settings_dicts, session=None, limiter=None):
+    """
+    Downloads the pages for several languages at once (batch mode of run_worldcat.py).
+    """
+    print("--gethtmlworldcat")
+    collections = [(settings_dict, read_csv(settings_dict["csv_file"])) for settings_dict in settings_dicts]
+    return harvest_many(collections, session, limiter)
@@ -9,15 +9,22 @@ Output: metadata as csv-file
 """
 
 
-from bs4 import BeautifulSoup as bs
 import os
 from os.path import join
 import glob
 import re
+import xml.etree.ElementTree as ET
+import json
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import pandas as pd
+import instrumentation
 
 
 
+XML_ID = "{http://www.w3.org/XML/1998/namespace}id"
+
+
 # === Functions ===
 
 def read_xml(file):
@@ -28,6 +35,7 @@ def read_xml(file):
     output: parsed xml
     
     """
+    from bs4 import BeautifulSoup as bs         # only needed for metadata_engine "bs4" (slow import)
     with open(file, "r", encoding="utf8") as infile: 
         xml = infile.read()
         xml = bs(xml, "xml")
@@ -49,6 +57,63 @@ def get_id(file):
     return id, basename
 
 
+def local_name(tag):
+    """
+    Removes the namespace from an element name, e.g. "{http://www.tei-c.org/ns/1.0}title" -> "title".
+    """
+    return tag.rsplit("}", 1)[-1]
+
+
+def read_header(file):
+    """
+    Streaming alternative to read_xml/get_id: reads the file element by element and stops
+    as soon as the teiHeader is closed, so the text of the novel is never parsed or kept in memory.
+    Title and author are the first <title> and <author> in the file, as with read_xml.
+    
+    input: xml file
+    output: id, basename, title, author
+    """
+    id = None
+    title = None
+    author = None
+    with open(file, "rb") as infile:
+        for event, element in ET.iterparse(infile, events=("start", "end")):
+            if event == "start":
+                if id is None and XML_ID in element.attrib:
+                    id = element.attrib[XML_ID]
+                continue
+            name = local_name(element.tag)
+            if name == "title" and title is None:
+                title = "".join(element.itertext())
+            elif name == "author" and author is None:
+                author = "".join(element.itertext())
+                author = re.sub('\((.*?)\)', "", author)
+            elif name == "teiHeader":
+                break
+    if id is None:                                  # no xml:id before the end of the teiHeader
+        id, basename = get_id(file)
+        return id, basename, title, author
+    basename = os.path.basename(file).split(".")[0]
+    print(id)
+    return id, basename, title, author
+
+
+def extract_metadata(file, engine):
+    """
+    Extracts id, basename, title and author of one novel.
+    
+    input: xml file, engine ("stream": read_header, "bs4": read_xml with Beautiful Soup)
+    output: id, basename, title, author
+    """
+    if engine == "stream":
+        return read_header(file)
+    xml = read_xml(file)
+    id, basename = get_id(file)
+    title = get_title(xml)
+    author = get_author(xml)
+    return id, basename, title, author
+
+
 def get_title(xml):
     """
     Extracts the title from the teiHeader.
@@ -77,26 +142,129 @@ def append_dict(dict, id, basename, title, author):
 def save_csv(dict, settings_dict):
     """
     Turns the dictionary into a dataframe.
-    Saves the dataframe to a csv file.
+    Saves the dataframe to a csv file (first to a temporary file, so an existing table is only replaced by a complete one).
     """
+    filename = '{}_metadata.csv'.format(settings_dict["lang"])
     dataframe = pd.DataFrame.from_dict(dict, orient="index")
-    dataframe.to_csv('{}_metadata.csv'.format(settings_dict["lang"]), index_label="xmlid", header = ["basename", "title", "au-name"], sep="\t")
+    dataframe.to_csv(filename + ".tmp", index_label="xmlid", header = ["basename", "title", "au-name"], sep="\t")
+    os.replace(filename + ".tmp", filename)
+    
     
+def get_checkpointfile(settings_dict):
+    """
+    Name of the checkpoint file, to which the metadata of each novel is appended as soon as it is extracted.
+    """
+    return '{}_metadata.checkpoint'.format(settings_dict["lang"])
+
+
+def trim_checkpoint(checkpointfile):
+    """
+    Removes an incomplete last line (interruption while writing, possibly within a multibyte character),
+    so the file can be read and continued.
+    """
+    if not os.path.isfile(checkpointfile):
+        return
+    with open(checkpointfile, "rb+") as checkpoint:
+        size = checkpoint.seek(0, os.SEEK_END)
+        end = size
+        while end > 0:
+            start = max(0, end - 4096)
+            checkpoint.seek(start)
+            newline = checkpoint.read(end - start).rfind(b"\n")
+            if newline != -1:
+                end = start + newline + 1
+                break
+            end = start
+        if end < size:
+            checkpoint.truncate(end)
+
+
+def read_checkpoint(checkpointfile):
+    """
+    Reads the metadata extracted by an interrupted run.
+    An incomplete last line (interruption while writing) is ignored.
+    
+    output: dictionary with filenames as keys and (id, basename, title, author) as values
+    """
+    done = {}
+    if not os.path.isfile(checkpointfile):
+        return done
+    with open(checkpointfile, "r", encoding="utf8") as infile:
+        for line in infile:
+            try:
+                file, metadata = json.loads(line)
+            except ValueError:
+                continue
+            done[file] = tuple(metadata)
+    return done
+
+
+def extract_all(files, settings_dict, executor=None):
+    """
+    Extracts the metadata of all files, in a process pool if metadata_workers is not 1.
+    With metadata_checkpoint, each result is appended to the checkpoint file and files
+    already in the checkpoint file are not read again.
+    
+    input: list of xml files, settings_dict, optionally a shared process pool
+    output: dictionary with filenames as keys and (id, basename, title, author) as values
+    """
+    engine = settings_dict["metadata_engine"]
+    checkpointfile = get_checkpointfile(settings_dict)
+    done = {}
+    if settings_dict["metadata_checkpoint"]:
+        trim_checkpoint(checkpointfile)
+        done = read_checkpoint(checkpointfile)
+    todo = [file for file in files if file not in done]
+    instrumentation.count("files_read", len(todo))
+    
+    own_executor = None
+    if executor is None and settings_dict["metadata_workers"] != 1:
+        own_executor = executor = ProcessPoolExecutor(max_workers=settings_dict["metadata_workers"])
+    if executor is None:
+        results = map(extract_metadata, todo, repeat(engine))
+    else:
+        chunksize = max(1, len(todo) // (4 * (os.cpu_count() or 1)))
+        results = executor.map(extract_metadata, todo, repeat(engine), chunksize=chunksize)
     
+    checkpoint = None
+    if settings_dict["metadata_checkpoint"]:
+        checkpoint = open(checkpointfile, "a", encoding="utf8")        # ends with a complete line, see trim_checkpoint
+    try:
+        for file, metadata in zip(todo, results):
+            done[file] = metadata
+            if checkpoint is not None:
+                checkpoint.write(json.dumps([file, metadata], ensure_ascii=False) + "\n")
+                checkpoint.flush()
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+        if own_executor is not None:
+            own_executor.shutdown()
+    return done
+
+
 # === Coordinating function ===
 
-def main(settings_dict):
+def main(settings_dict, executor=None):
     """
     Coordinates the creation of the metadata table.
+    The files are processed in sorted order, so the rows of the table are always in the same order.
+    The table is written once, after all files have been read.
+    If no file matches xml_path, nothing is written (the existing table and checkpoint are kept).
     """
     print("--getmetadata")
     dict = {}
     
     xmlfolder = settings_dict["xml_path"]
-    for file in glob.glob(xmlfolder):
-        xml = read_xml(file)
-        id, basename = get_id(file)
-        title = get_title(xml)
-        author = get_author(xml)
+    files = sorted(glob.glob(xmlfolder))
+    if not files:
+        print("Warning: no xml files found for xml_path '{}', the metadata table is not written.".format(xmlfolder))
+        return
+    instrumentation.count("files", len(files))
+    done = extract_all(files, settings_dict, executor)
+    for file in files:
+        id, basename, title, author = done[file]
         append_dict(dict, id, basename, title, author)
-        save_csv(dict, settings_dict)
+    save_csv(dict, settings_dict)
+    if os.path.isfile(get_checkpointfile(settings_dict)):
+        os.remove(get_checkpointfile(settings_dict))
@@ -5,6 +5,56 @@
 import os
 from os.path import join
 
+# default values for optional parameters in config.yaml
+DEFAULTS = {
+    "worldcat_url": "https://www.worldcat.org", # base url of worldcat (can point to a local stand-in server)
+    "harvest_workers": 4,                       # number of threads downloading result pages
+    "max_per_host": 4,                          # maximum number of parallel requests to one host
+    "requests_per_second": 2,                   # politeness rate per host (0: no limit)
+    "connect_timeout": 10,                      # seconds to wait for the connection to worldcat
+    "read_timeout": 60,                         # seconds to wait for the answer of worldcat
+    "max_retries": 5,                           # failed requests (timeouts, 429, 5xx) are repeated this often
+    "backoff_base": 1.0,                        # waiting time before the n-th retry: random, up to backoff_base * 2^n seconds
+    "backoff_max": 60.0,                        # ... but at most backoff_max seconds
+    "rate_increase": 0.1,                       # after a throttling, the rate rises by this much per successful request
+    "circuit_threshold": 5,                     # failed requests in a row after which the requests to a host are paused
+    "circuit_cooldown": 30.0,                   # length of the first pause in seconds (doubled for each further pause)
+    "circuit_max_trips": 5,                     # pauses without success after which the download of the remaining pages fails (None: never)
+    "metadata_engine": "stream",                # "stream": reads only the teiHeader; "bs4": parses the whole file with Beautiful Soup
+    "metadata_workers": None,                   # number of processes reading the XML-TEI files (None: one per CPU core, 1: no process pool)
+    "metadata_checkpoint": True,                # appends each result to <lang>_metadata.checkpoint, so an interrupted run can continue
+    "html_engine": "targeted",                  # parser for the result pages: "bs4", "lxml" or "targeted" (see parse_worldcat.py)
+    "table_workers": None,                      # number of processes parsing the result pages (None: one per CPU core, 1: no process pool)
+    "year_min": 1840,                           # first and last year of the reprint counts table; publication years
+    "year_max": 2019,                           # outside this range are counted as year 0
+    "target_period": [1970, 2009],              # period (first and last year) whose reprints determine the canonicity status
+    "canon_threshold": 1,                       # status "high" with more reprints than this in the target period
+    "sweep_periods": [[1950, 1989], [1960, 1999], [1970, 2009], [1980, 2019]],   # periods of "run_worldcat.py sweep"
+    "sweep_thresholds": [0, 1, 2, 5, 10],       # thresholds of "run_worldcat.py sweep"
+    "page_cache": "cache/parsed_pages.sqlite",  # cache of parsed result pages (None: no cache)
+    "page_cache_size": 200000,                  # maximum number of pages in the cache (least recently used ones are removed)
+    "html_storage": "files",                    # "files": one html file per page in html/<lang>; "sqlite": compressed pages in html/<lang>.sqlite
+    "page_size": 10,                            # hits per result page of worldcat (the start of the following pages is counted with it)
+    "page_window": 4,                           # pages of one novel requested at the same time (None: all at once)
+    "harvest_order": "longest_first",           # pages 2..N: "longest_first" (novels with the most pages left first) or "table" (order of the requests)
+    "progress_interval": 10,                    # seconds between two progress lines of the download, with the estimated time left (None: none)
+    "refresh_older_than": None,                 # pages older than this number of days are downloaded again (None: never)
+    "query_memo": "cache/queries.json",         # memo of the searches already done (see query_memo.py; None: only within one run)
+    "queue_workers": 0,                         # 0: download in this process; N: through the work queue with N worker processes (see work_queue.py)
+    "queue_path": "cache/harvest_queue.sqlite", # SQLite file of the work queue
+    "queue_lease": 300,                         # seconds without renewal (a running worker renews it) before a job is handed to another worker
+    "queue_attempts": 3,                        # a job that failed (or whose lease expired) this often is given up
+    "counts_update": "full",                    # "full": the reprint counts are rebuilt from all pages; "incremental": only new or changed novels are parsed
+    "counts_check": 3,                          # incremental: number of unchanged novels parsed again to check the existing counts
+    "counts_formats": ["csv"],                  # formats of the reprint counts: "csv" (wide), "long" (long csv), "parquet", "feather" (long, need pyarrow), "mmap" (see counts_store.py)
+    "pipeline": "stages",                       # "stages": one stage after the other, through the csv files; "stream": all steps at once for each novel (see pipeline.py)
+    "pipeline_buffer": 16,                      # stream: maximum number of novels waiting between two steps
+    "service_port": 8080,                       # port of the HTTP service (see service.py)
+    "service_cache_size": 10000,                # number of answers of the service kept in memory
+    "report_folder": "reports",                 # folder for the timing report of each run (see instrumentation.py; None: no report)
+    "profile_stages": False,                    # writes a cProfile dump for each stage into report_folder
+    }
+
 def get_lang(lang, d): # input: empty dictionary, the chosen language; new key "lang", value is the chosen language  
     
     d["lang"] = lang
@@ -76,7 +126,16 @@ def get_html_file(d, htmlpages): # will be used to get the right html pages, bas
 
     return html_folder, d
     
-def main(lang, basedir, level, write_file, htmlpages):
+def get_options(d, options): # copies the optional parameters from config.yaml into the dictionary, missing ones get their default value
+    
+    if options is None:
+        options = {}
+    for key, value in DEFAULTS.items():
+        d[key] = options.get(key, value)
+    
+    return d
+    
+def main(lang, basedir, level, write_file, htmlpages, options=None):
     print("--getsettings")
     d = {}
     lang, d = get_lang(lang, d)
@@ -86,5 +145,6 @@ def main(lang, basedir, level, write_file, htmlpages):
     d = get_lang_hit(lang, d)
     new_write_file, d = get_write_file(d, write_file)
     html_folder, d = get_html_file(d, htmlpages) 
+    d = get_options(d, options)
     #print(d)
     return d
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+"""
+Storage of the downloaded worldcat result pages.
+
+Two backends, chosen with html_storage in config.yaml:
+- "files": one html file per page, html/<lang>/<xmlid>_html<N>.html (as before)
+- "sqlite": one SQLite file per language, html/<lang>.sqlite, with the pages
+  compressed (zlib) and indexed by xmlid and page number
+
+Both offer the same functions, so the download and the table stage do not need to know
+where the pages are. Existing html folders can be moved into an SQLite store with:
+
+python3 html_store.py migrate <lang>
+"""
+
+import glob
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from os.path import join, isfile, getmtime
+
+
+STORAGES = ["files", "sqlite"]
+
+
+# === Functions ===
+
+def group_filenames(filenames):
+    """
+    Groups the result pages by novel: "FRA00501_html2.html" belongs to FRA00501 and is its second page.
+
+    input: list of filenames
+    output: dictionary with the ids (sorted) as keys and the page numbers (sorted) as values
+    """
+    pages = {}
+    for file in filenames:
+        match = re.match("(.*)_html([0-9]+)$", os.path.splitext(os.path.basename(file))[0])
+        if match is None:
+            continue
+        pages.setdefault(match.group(1), []).append(int(match.group(2)))
+    return {id: sorted(pages[id]) for id in sorted(pages)}
+
+
+class FileStore:
+    """
+    One html file per page in the folder (html/<lang>).
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+
+    def get_filename(self, xmlid, number):
+        return join(self.folder, "{}_html{}.html".format(xmlid, number))
+
+    def write_page(self, xmlid, number, html):
+        """
+        The page is written under a temporary name first, so an interrupted run never leaves a truncated page.
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        filename = self.get_filename(xmlid, number)
+        with open(filename + ".part", "w", encoding="utf8", newline="") as outfile:     # newline="": the page is stored exactly as received
+            outfile.write(html)
+        os.replace(filename + ".part", filename)
+
+    def link_page(self, xmlid, number, source):
+        """
+        Makes the page a hard link to the file source (raises OSError where hard links are not possible).
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        filename = self.get_filename(xmlid, number)
+        if os.path.exists(filename + ".part"):
+            os.remove(filename + ".part")
+        os.link(source, filename + ".part")
+        os.replace(filename + ".part", filename)
+
+    def read_page(self, xmlid, number):
+        filename = self.get_filename(xmlid, number)
+        if not isfile(filename):
+            return None
+        with open(filename, "r", encoding="utf8", newline="") as infile:
+            return infile.read()
+
+    def has_page(self, xmlid, number):
+        return isfile(self.get_filename(xmlid, number))
+
+    def delete_page(self, xmlid, number):
+        if self.has_page(xmlid, number):
+            os.remove(self.get_filename(xmlid, number))
+
+    def stored_time(self, xmlid, number):
+        return getmtime(self.get_filename(xmlid, number))
+
+    def list_pages(self):
+        return group_filenames(glob.glob(join(self.folder, "*.html")))
+
+    def list_numbers(self, xmlid):
+        return group_filenames(glob.glob(join(self.folder, glob.escape(xmlid) + "_html*.html"))).get(xmlid, [])
+
+    def close(self):
+        pass
+
+
+class SqliteStore:
+    """
+    All pages of a language in one SQLite file, compressed with zlib.
+    Can be used from several threads.
+    """
+
+    def __init__(self, path, readonly=False):
+        self.path = path
+        self.lock = threading.Lock()
+        if readonly:
+            self.connection = sqlite3.connect("file:{}?mode=ro".format(path), uri=True, timeout=60, check_same_thread=False)
+            return
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS pages (xmlid TEXT, page INTEGER, html BLOB, stored REAL, PRIMARY KEY (xmlid, page))")
+        self.connection.commit()
+
+    def write_page(self, xmlid, number, html):
+        data = zlib.compress(html.encode("utf8"))
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)", (xmlid, number, data, time.time()))
+
+    def read_page(self, xmlid, number):
+        with self.lock:
+            row = self.connection.execute("SELECT html FROM pages WHERE xmlid = ? AND page = ?", (xmlid, number)).fetchone()
+        if row is None:
+            return None
+        return zlib.decompress(row[0]).decode("utf8")
+
+    def has_page(self, xmlid, number):
+        return self.stored_time(xmlid, number) is not None
+
+    def delete_page(self, xmlid, number):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM pages WHERE xmlid = ? AND page = ?", (xmlid, number))
+
+    def stored_time(self, xmlid, number):
+        with self.lock:
+            row = self.connection.execute("SELECT stored FROM pages WHERE xmlid = ? AND page = ?", (xmlid, number)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def list_pages(self):
+        pages = {}
+        with self.lock:
+            rows = self.connection.execute("SELECT xmlid, page FROM pages ORDER BY xmlid, page").fetchall()
+        for xmlid, number in rows:
+            pages.setdefault(xmlid, []).append(number)
+        return pages
+
+    def list_numbers(self, xmlid):
+        with self.lock:
+            rows = self.connection.execute("SELECT page FROM pages WHERE xmlid = ? ORDER BY page", (xmlid,)).fetchall()
+        return [row[0] for row in rows]
+
+    def close(self):
+        self.connection.close()
+
+
+def get_sqlite_path(settings_dict):
+    """
+    html/<lang> -> html/<lang>.sqlite
+    """
+    return settings_dict["write_file"].rstrip("/\\") + ".sqlite"
+
+
+def open_store(settings_dict, readonly=False):
+    """
+    Opens the store chosen in config.yaml (html_storage).
+    """
+    storage = settings_dict["html_storage"]
+    if storage == "files":
+        return FileStore(settings_dict["write_file"])
+    if storage == "sqlite":
+        return SqliteStore(get_sqlite_path(settings_dict), readonly)
+    raise ValueError("Unknown html_storage '{}', choose one of: {}".format(storage, ", ".join(STORAGES)))
+
+
+READERS = {}
+
+
+def get_reader(settings_dict):
+    """
+    Store for reading in the worker processes, opened once per process.
+    """
+    key = (settings_dict["html_storage"], settings_dict["write_file"])
+    if key not in READERS:
+        READERS[key] = open_store(settings_dict, readonly=True)
+    return READERS[key]
+
+
+def copy_pages(source, source_xmlid, target, target_xmlid, numbers):
+    """
+    Copies the pages of a novel to another novel (see query_memo.py): between two html folders as
+    hard links (the page exists only once on disk), otherwise as copies.
+    """
+    for number in numbers:
+        if isinstance(source, FileStore) and isinstance(target, FileStore):
+            try:
+                target.link_page(target_xmlid, number, source.get_filename(source_xmlid, number))
+                continue
+            except OSError:
+                pass
+        target.write_page(target_xmlid, number, source.read_page(source_xmlid, number))
+
+
+def migrate(folder, path):
+    """
+    Copies all pages from an html folder into an SQLite store. The folder is left as it is.
+
+    input: folder (e.g. html/fra), path of the SQLite file (e.g. html/fra.sqlite)
+    output: number of pages copied
+    """
+    source = FileStore(folder)
+    target = SqliteStore(path)
+    count = 0
+    for xmlid, numbers in source.list_pages().items():
+        for number in numbers:
+            target.write_page(xmlid, number, source.read_page(xmlid, number))
+            count += 1
+    target.close()
+    return count
+
+
+# === Coordinating function ===
+
+def main(command="migrate", lang="fra", write_file="html"):
+    if command != "migrate":
+        print("Usage: python3 html_store.py migrate <lang> [html folder]")
+        return
+    folder = join(write_file, lang)
+    path = folder + ".sqlite"
+    count = migrate(folder, path)
+    print("{} pages copied from {} to {}. Set html_storage: \"sqlite\" in config.yaml to use them.".format(count, folder, path))
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+
+"""
+Shared HTTP layer for the download of the worldcat result pages.
+
+All requests of one run go through one keep-alive session (connection pooling)
+and a limiter that restricts the number of parallel requests per host and the
+number of requests per second (politeness rate). Both are set in config.yaml.
+
+Failed requests (connection errors, timeouts, broken answers, HTTP 429 and 5xx) are repeated with
+exponential backoff and jitter. The rate per host is a token bucket that adapts
+to the server: it is halved when the server throttles (429, 503, honouring
+Retry-After) and raised again step by step after successful requests, up to
+requests_per_second. After circuit_threshold failed requests in a row, a circuit
+breaker pauses all requests to the host for circuit_cooldown seconds and then
+lets one request through as a probe; after circuit_max_trips openings without a
+success in between, the remaining requests fail at once.
+Only pages received with status 200 are returned; everything else raises an
+exception (a subclass of requests.RequestException), so no error page is saved.
+"""
+
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import instrumentation
+
+
+RETRY_STATUS = [429, 500, 502, 503, 504]        # status codes worth another try
+THROTTLE_STATUS = [429, 503]                    # status codes by which the server asks to slow down
+MIN_RATE = 0.05                                 # lowest rate (requests per second) the limiter slows down to
+
+
+class CircuitOpenError(requests.RequestException):
+    """
+    Raised when the circuit breaker of a host has given up.
+    """
+
+
+# === Functions ===
+
+def get_session(settings_dict):
+    """
+    Creates a requests session that keeps connections to worldcat open.
+    The connection pool is as large as the number of parallel requests per host.
+
+    input: settings_dict
+    output: requests session
+    """
+    pool_size = max(settings_dict["harvest_workers"], settings_dict["max_per_host"])
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_retry_after(response):
+    """
+    Reads the Retry-After header (seconds or http date); None if there is none.
+    """
+    value = response.headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def get_backoff(attempt, base, maximum, retry_after=None):
+    """
+    Waiting time before the next try: a random time between 0 and base * 2^attempt
+    (at most maximum), but not shorter than the Retry-After of the server.
+    """
+    delay = random.uniform(0, min(maximum, base * 2 ** attempt))
+    if retry_after is not None:
+        delay = max(delay, min(maximum, retry_after))
+    return delay
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for one host: "closed" (requests pass), "open" (requests wait
+    until the cooldown is over) and "half-open" (one probe request passes, the
+    others wait for its result, at most probe_timeout seconds: then the probe is
+    considered lost and the next request becomes the probe).
+    """
+
+    def __init__(self, threshold, cooldown, max_trips, probe_timeout=60.0):
+        self.threshold = max(1, int(threshold))
+        self.cooldown = float(cooldown)
+        self.max_trips = max_trips
+        self.probe_timeout = float(probe_timeout)
+        self.condition = threading.Condition()
+        self.state = "closed"
+        self.failures = 0
+        self.trips = 0
+        self.open_until = 0.0
+        self.probe_until = 0.0
+
+    def allow(self, host):
+        """
+        Blocks until a request may be sent; raises CircuitOpenError once max_trips is reached.
+
+        output: True, if the request is the probe of the half-open state (its result must be
+                reported with success() or failure())
+        """
+        with self.condition:
+            while True:
+                if self.state == "closed":
+                    return False
+                if self.max_trips and self.trips >= self.max_trips:
+                    raise CircuitOpenError("{}: circuit breaker open after {} tries".format(host, self.trips))
+                now = time.monotonic()
+                if (self.state == "open" and now >= self.open_until) or (self.state == "half-open" and now >= self.probe_until):
+                    self.state = "half-open"
+                    self.probe_until = now + self.probe_timeout
+                    return True
+                if self.state == "open":
+                    self.condition.wait(self.open_until - now)
+                else:
+                    self.condition.wait(self.probe_until - now)
+
+    def success(self):
+        with self.condition:
+            self.state = "closed"
+            self.failures = 0
+            self.trips = 0
+            self.condition.notify_all()
+
+    def failure(self):
+        with self.condition:
+            self.failures += 1
+            if self.state == "half-open" or self.failures >= self.threshold:
+                self.trips += 1
+                self.failures = 0
+                self.state = "open"
+                self.open_until = time.monotonic() + self.cooldown * 2 ** (self.trips - 1)
+                print("Circuit breaker open for {:.0f} s".format(self.open_until - time.monotonic()))
+                instrumentation.count("circuit_opened")
+            self.condition.notify_all()
+
+
+class HostLimiter:
+    """
+    Limits the number of parallel requests per host (semaphore) and the rate of
+    requests per host (token bucket, adapted to the throttling signals of the server);
+    holds the retry settings and the circuit breaker of each host.
+    """
+
+    def __init__(self, max_per_host, requests_per_second, timeout=None, max_retries=0, backoff_base=1.0, backoff_max=60.0,
+                 rate_increase=0.1, circuit_threshold=5, circuit_cooldown=30.0, circuit_max_trips=5):
+        self.max_per_host = max(1, int(max_per_host))
+        self.max_rate = float(requests_per_second) if requests_per_second else None     # None: no limit
+        self.timeout = timeout
+        self.max_retries = int(max_retries)
+        self.backoff_base = float(backoff_base)
+        self.backoff_max = float(backoff_max)
+        self.rate_increase = float(rate_increase)
+        probe_timeout = sum(timeout) if isinstance(timeout, tuple) else (timeout or 60.0)      # longest time a probe request can take
+        self.circuit = (circuit_threshold, circuit_cooldown, circuit_max_trips, probe_timeout)
+        self.lock = threading.Lock()
+        self.semaphores = {}
+        self.breakers = {}
+        self.rates = {}
+        self.tokens = {}
+        self.updated = {}
+        self.blocked_until = {}
+        self.throttled = {}
+
+    def get_semaphore(self, host):
+        with self.lock:
+            if host not in self.semaphores:
+                self.semaphores[host] = threading.BoundedSemaphore(self.max_per_host)
+                self.breakers[host] = CircuitBreaker(*self.circuit)
+                self.rates[host] = self.max_rate
+                self.tokens[host] = 1.0
+                self.updated[host] = time.monotonic()
+                self.blocked_until[host] = 0.0
+                self.throttled[host] = float("-inf")
+            return self.semaphores[host]
+
+    def get_breaker(self, host):
+        self.get_semaphore(host)
+        return self.breakers[host]
+
+    def wait(self, host):
+        """
+        Blocks until the next request to the host is allowed by the token bucket
+        (one token per request, refilled at the current rate, at most one in stock)
+        and by a Retry-After of the server.
+        """
+        with self.lock:
+            now = time.monotonic()
+            delay = max(0.0, self.blocked_until[host] - now)
+            rate = self.rates[host]
+            if rate is not None:
+                self.tokens[host] = min(1.0, self.tokens[host] + (now - self.updated[host]) * rate)
+                self.updated[host] = now
+                self.tokens[host] -= 1.0
+                if self.tokens[host] < 0:
+                    delay = max(delay, -self.tokens[host] / rate)
+        if delay > 0:
+            time.sleep(delay)
+
+    def throttle(self, host, retry_after=None):
+        """
+        The server asks to slow down: the rate is halved (without a limit so far, it starts
+        at max_per_host requests per second) and no request is sent before Retry-After.
+        The rate is halved at most once per second (or per request interval, if longer), as the
+        answers to the parallel requests sent before the first signal are mostly refusals as well.
+        """
+        with self.lock:
+            now = time.monotonic()
+            rate = self.rates[host]
+            if rate is None:
+                rate = float(self.max_per_host)
+            if now - self.throttled[host] >= max(1.0, 1.0 / rate):
+                self.rates[host] = max(MIN_RATE, rate / 2)
+                self.throttled[host] = now
+            if retry_after is not None:
+                self.blocked_until[host] = max(self.blocked_until[host], now + retry_after)
+        instrumentation.count("throttled")
+
+    def success(self, host):
+        """
+        After a successful request, the rate is raised by rate_increase, up to requests_per_second.
+        """
+        with self.lock:
+            rate = self.rates[host]
+            if rate is None:
+                return
+            rate += self.rate_increase
+            if self.max_rate is not None:
+                rate = min(rate, self.max_rate)
+            self.rates[host] = rate
+
+
+def get_limiter(settings_dict):
+    """
+    Creates the limiter with the parameters from config.yaml.
+    """
+    timeout = (settings_dict["connect_timeout"], settings_dict["read_timeout"])
+    return HostLimiter(settings_dict["max_per_host"], settings_dict["requests_per_second"], timeout,
+                       settings_dict["max_retries"], settings_dict["backoff_base"], settings_dict["backoff_max"],
+                       settings_dict["rate_increase"], settings_dict["circuit_threshold"], settings_dict["circuit_cooldown"],
+                       settings_dict["circuit_max_trips"])
+
+
+def fetch(session, url, limiter):
+    """
+    Downloads one page, respecting the limits for the host; failed requests are repeated
+    up to max_retries times.
+
+    input: session, url, limiter
+    output: html (text of the response)
+    raises: requests.RequestException (e.g. requests.HTTPError for a status other than 200)
+    """
+    host = urlsplit(url).netloc
+    breaker = limiter.get_breaker(host)
+    for attempt in range(limiter.max_retries + 1):
+        probe = breaker.allow(host)
+        reported = False                        # result given to the circuit breaker
+        try:
+            retry_after = None
+            with limiter.get_semaphore(host):
+                limiter.wait(host)
+                start = time.perf_counter()
+                try:
+                    response = session.get(url, timeout=limiter.timeout)
+                except requests.RequestException as exception:
+                    if isinstance(exception, ValueError):       # invalid url: the request itself is wrong, no retry
+                        reported = True
+                        breaker.success()
+                        raise
+                    error = exception           # connection, timeout, truncated or undecodable answer, too many redirects
+                else:
+                    instrumentation.add_latency(time.perf_counter() - start)
+                    if response.status_code == 200:
+                        limiter.success(host)
+                        reported = True
+                        breaker.success()
+                        return response.text
+                    error = requests.HTTPError("{} {} for url: {}".format(response.status_code, response.reason, url), response=response)
+                    if response.status_code not in RETRY_STATUS:
+                        reported = True
+                        breaker.success()       # the server answers, the request itself is wrong (e.g. 404)
+                        raise error
+                    retry_after = get_retry_after(response)
+                    if response.status_code in THROTTLE_STATUS:
+                        limiter.throttle(host, retry_after)
+            reported = True
+            breaker.failure()
+        finally:
+            if probe and not reported:          # any other exception: the probe must not block the others for good
+                breaker.failure()
+        if attempt < limiter.max_retries:
+            instrumentation.count("retries")
+            time.sleep(get_backoff(attempt, limiter.backoff_base, limiter.backoff_max, retry_after))
+    raise error
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+"""
+Timing and profiling of the stages of run_worldcat.py.
+
+For each stage (get_metadata, get_htmlworldcat, create_publicationtable, create_summary)
+the report holds the wall time, the CPU time, the peak memory, the number of items
+processed (files, novels, pages), the throughput (items per second) and, for the
+download, the latency of the HTTP requests (percentiles). The report of a run is
+saved as JSON in report_folder (config.yaml), e.g. reports/run_2024-05-01T12-00-00-123456_4321.json (time and process id).
+With profile_stages, a cProfile dump is written for each stage as well
+(reports/<run>_<stage>.prof, to be read with pstats or snakeviz).
+
+The stages report their items with count() and the download its latencies with
+add_latency(); both do nothing when no report is running (e.g. when a stage is
+called on its own).
+
+Notes:
+- cpu_seconds is the CPU time of the main process (all its threads); child_cpu_seconds
+  is that of the worker processes that have ended during the stage (a process pool
+  shared by several stages is only counted when it is shut down).
+- peak_memory_mb is the highest memory use of the main process up to the end of the
+  stage (maximum resident set size), not the peak within the stage. It is not
+  available on Windows (None).
+- cProfile only sees the main thread, so the work done in the download threads and
+  the worker processes does not appear in the dumps.
+"""
+
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from os.path import join
+
+try:
+    import resource
+except ImportError:             # not available on Windows
+    resource = None
+
+
+REPORT = None                   # report of the running run, set by run_report()
+PERCENTILES = [50, 90, 99]
+
+
+# === Functions ===
+
+def get_peak_memory(who="self"):
+    """
+    Maximum resident set size of this process ("self") or of its ended child processes ("children") in MB;
+    None if the resource module is not available.
+    """
+    if resource is None:
+        return None
+    if who == "self":
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+    else:
+        usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    if sys.platform == "darwin":                    # bytes on macOS, kilobytes elsewhere
+        return round(usage.ru_maxrss / 2**20, 1)
+    return round(usage.ru_maxrss / 2**10, 1)
+
+
+def get_child_cpu():
+    """
+    CPU time (user and system) of the ended child processes.
+    """
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+def get_percentile(values, percentile):
+    """
+    Percentile of a sorted list (nearest rank).
+    """
+    if not values:
+        return None
+    rank = max(1, -(-len(values) * percentile // 100))
+    return values[int(rank) - 1]
+
+
+def summarize_latencies(latencies):
+    """
+    input: list of request durations in seconds
+    output: dictionary with the number of requests, mean, percentiles and maximum (in milliseconds)
+    """
+    latencies = sorted(latencies)
+    summary = {"requests": len(latencies)}
+    if not latencies:
+        return summary
+    summary["mean_ms"] = round(1000 * sum(latencies) / len(latencies), 3)
+    for percentile in PERCENTILES:
+        summary["p{}_ms".format(percentile)] = round(1000 * get_percentile(latencies, percentile), 3)
+    summary["max_ms"] = round(1000 * latencies[-1], 3)
+    return summary
+
+
+class Report:
+    """
+    Measurements of one run: a list of stages, each with its times, memory, counts and latencies.
+    """
+
+    def __init__(self, report_folder=None, profile_stages=False):
+        self.report_folder = report_folder
+        self.profile_stages = profile_stages
+        self.name = "run_{}_{}".format(datetime.now().strftime("%Y-%m-%dT%H-%M-%S-%f"), os.getpid())      # unique also for runs started in the same second
+        self.started = time.time()
+        self.stages = []
+        self.current = None
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, langs=None):
+        """
+        Measures the code run within the with block as one stage.
+        """
+        current = {"stage": name, "langs": langs, "counts": {}, "latencies": []}
+        self.current = current
+        profiler = None
+        if self.profile_stages:
+            profiler = cProfile.Profile()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        child_cpu = get_child_cpu()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield current
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            wall = time.perf_counter() - wall
+            cpu = time.process_time() - cpu
+            child_cpu = get_child_cpu() - child_cpu
+            self.current = None
+            self.stages.append(self.finish_stage(current, wall, cpu, child_cpu, profiler))
+
+    def finish_stage(self, current, wall, cpu, child_cpu, profiler):
+        """
+        Computes the throughput and the latency percentiles and writes the profile of a finished stage.
+        """
+        stage = {"stage": current["stage"], "langs": current["langs"],
+                 "wall_seconds": round(wall, 3), "cpu_seconds": round(cpu, 3), "child_cpu_seconds": round(child_cpu, 3),
+                 "peak_memory_mb": get_peak_memory("self"), "child_peak_memory_mb": get_peak_memory("children"),
+                 "counts": current["counts"],
+                 "per_second": {name: round(count / wall, 3) if wall > 0 else None for name, count in current["counts"].items()}}
+        if current["latencies"]:
+            stage["http"] = summarize_latencies(current["latencies"])
+        if profiler is not None:
+            os.makedirs(self.report_folder or ".", exist_ok=True)
+            stage["profile"] = join(self.report_folder or ".", "{}_{}.prof".format(self.name, current["stage"]))
+            profiler.dump_stats(stage["profile"])
+        return stage
+
+    def count(self, name, number=1):
+        if self.current is None:
+            return
+        with self.lock:
+            self.current["counts"][name] = self.current["counts"].get(name, 0) + number
+
+    def add_latency(self, seconds):
+        if self.current is None:
+            return
+        with self.lock:
+            self.current["latencies"].append(seconds)
+
+    def to_dict(self):
+        return {"run": self.name, "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+                "wall_seconds": round(time.time() - self.started, 3), "stages": self.stages}
+
+    def save(self):
+        """
+        Writes the report as JSON into report_folder; returns the filename (None if there is no report_folder).
+        """
+        if not self.report_folder:
+            return None
+        os.makedirs(self.report_folder, exist_ok=True)
+        filename = join(self.report_folder, self.name + ".json")
+        with open(filename, "w", encoding="utf8") as outfile:
+            json.dump(self.to_dict(), outfile, indent=2)
+        return filename
+
+
+@contextmanager
+def run_report(settings_dict):
+    """
+    Starts the report of a run (report_folder and profile_stages from config.yaml) and saves it at the end,
+    also when the run is interrupted by an error.
+    """
+    global REPORT
+    REPORT = Report(settings_dict["report_folder"], settings_dict["profile_stages"])
+    try:
+        yield REPORT
+    finally:
+        report, REPORT = REPORT, None
+        filename = report.save()
+        if filename is not None:
+            print("Report:", filename)
+
+
+@contextmanager
+def stage(name, langs=None):
+    """
+    Measures one stage of the running report; does nothing if no report is running.
+    """
+    if REPORT is None:
+        yield None
+        return
+    with REPORT.stage(name, langs) as current:
+        yield current
+
+
+def count(name, number=1):
+    """
+    Adds number items (e.g. "files", "pages") to the counts of the current stage.
+    """
+    if REPORT is not None:
+        REPORT.count(name, number)
+
+
+def add_latency(seconds):
+    """
+    Records the duration of one HTTP request in the current stage (thread-safe).
+    """
+    if REPORT is not None:
+        REPORT.add_latency(seconds)
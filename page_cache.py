@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+"""
+On-disk cache of parsed worldcat result pages.
+
+The result of parse_worldcat.parse_page is stored in an SQLite file, keyed by the
+hash of the page content, the parser engine and the parser version. A page that has
+not changed since the last run is therefore not parsed again. When the cache holds
+more than page_cache_size entries, the least recently used ones are removed.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+import parse_worldcat
+
+
+# === Functions ===
+
+def get_key(text, engine):
+    """
+    Cache key of a page: content hash, parser engine and parser version.
+    """
+    sha1 = hashlib.sha1(text.encode("utf8")).hexdigest()
+    return "{}:{}:{}".format(sha1, engine, parse_worldcat.PARSER_VERSION)
+
+
+class PageCache:
+    """
+    Parsed pages in an SQLite file (table pages: key, parsed page as json, time of last use).
+    """
+
+    def __init__(self, path, max_entries=None, readonly=False):
+        self.path = path
+        self.max_entries = max_entries
+        if readonly:
+            self.connection = sqlite3.connect("file:{}?mode=ro".format(path), uri=True, timeout=60)
+            return
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS pages (key TEXT PRIMARY KEY, page TEXT, used REAL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS pages_used ON pages (used)")
+        self.connection.commit()
+
+    def get_many(self, keys):
+        """
+        output: dictionary with the keys found in the cache and their parsed pages
+        """
+        found = {}
+        keys = list(keys)
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            query = "SELECT key, page FROM pages WHERE key IN ({})".format(",".join("?" * len(chunk)))
+            for key, page in self.connection.execute(query, chunk):
+                found[key] = json.loads(page)
+        return found
+
+    def update(self, new_pages, used_keys):
+        """
+        Stores new parsed pages and marks the pages read from the cache as used;
+        then removes the least recently used pages beyond max_entries.
+
+        input: dictionary key -> parsed page, list of keys
+        """
+        now = time.time()
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO pages VALUES (?, ?, ?)",
+                                        [(key, json.dumps(page), now) for key, page in new_pages.items()])
+            self.connection.executemany("UPDATE pages SET used = ? WHERE key = ?", [(now, key) for key in used_keys])
+            if self.max_entries:
+                self.connection.execute("DELETE FROM pages WHERE key IN (SELECT key FROM pages ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                                        (int(self.max_entries),))
+
+    def close(self):
+        self.connection.close()
+
+
+READERS = {}
+
+
+def get_reader(path):
+    """
+    Read-only connection to the cache for the worker processes, opened once per process.
+    """
+    if path not in READERS:
+        READERS[path] = PageCache(path, readonly=True)
+    return READERS[path]
+
+
+def open_cache(settings_dict):
+    """
+    Opens the cache set in config.yaml (page_cache); None if no cache is used.
+    """
+    if not settings_dict["page_cache"]:
+        return None
+    return PageCache(settings_dict["page_cache"], settings_dict["page_cache_size"])
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+
+"""
+Parsers for the worldcat result pages.
+
+All engines return the same result for a page: hit number, hit language and
+publication year of each hit (menuElem rows), the numbers of the hits without
+publication year, the number of results ("of about N") and the text of the
+error-results div (whitespace normalized; None if there is none).
+
+Engines (parameter html_engine in config.yaml):
+- "bs4": Beautiful Soup with html.parser (slow, but the reference)
+- "lxml": lxml.html with XPath
+- "targeted": regular expressions touching only the menuElem rows, the error-results div and the "of about" counter
+"""
+
+import re
+from html import unescape
+
+
+ENGINES = ["bs4", "lxml", "targeted"]
+PARSER_VERSION = 1                      # to be increased whenever a change of the parsers changes their results (invalidates page_cache.py)
+
+YEAR = re.compile("[0-9]+")
+NUMBER_OF_RESULTS = re.compile("of about <strong>(.*?)</strong>")
+TAG = re.compile("<[^>]*>")
+ROW = re.compile(r'<tr\b[^>]*\bclass="[^"]*\bmenuElem\b[^"]*"[^>]*>')
+ITEM_NUMBER = re.compile(r'<div\b[^>]*\bclass="[^"]*\bitem_number\b[^"]*"[^>]*>(.*?)</div>', re.S)
+ITEM_LANGUAGE = re.compile(r'<span\b[^>]*\bclass="[^"]*\bitemLanguage\b[^"]*"[^>]*>')
+ITEM_PUBLISHER = re.compile(r'<span\b[^>]*\bclass="[^"]*\bitemPublisher\b[^"]*"[^>]*>')
+SPAN = re.compile(r'<span\b|</span>')
+ERROR_RESULTS = re.compile(r'<div\b[^>]*\bclass="[^"]*\berror-results\b[^"]*"[^>]*>(.*?)</div>', re.S)
+
+
+# === Functions ===
+
+def create_page():
+    """
+    Returns an empty result for one page.
+    """
+    return {"number": [], "itemLanguage": [], "year": [], "no_year": [], "hits": None, "error": None}
+
+
+def add_hit(page, number, language, publisher):
+    """
+    Adds one hit to the result. The year is the first number in the publisher field;
+    if there is none, the year is set to 0 and the hit number is noted in "no_year".
+    """
+    year = None
+    if publisher is not None:
+        year = YEAR.search(publisher)
+    if year is None:
+        year = 0
+        page["no_year"].append(number)
+    else:
+        year = int(year.group())
+    page["number"].append(number)
+    page["itemLanguage"].append(language)
+    page["year"].append(year)
+
+
+def get_number_of_results(text):
+    """
+    Reads the number of results ("of about N") from the page; None if there is no such counter.
+    """
+    numbers_of_result = NUMBER_OF_RESULTS.search(text)
+    if numbers_of_result is None:
+        return None
+    return int(numbers_of_result.group(1).replace(",", ""))
+
+
+def get_text(markup):
+    """
+    Text of an html snippet: tags are removed, then entities are replaced.
+    """
+    return unescape(TAG.sub("", markup))
+
+
+def get_span(text, start):
+    """
+    Content of the span element opened just before start; nested spans are included
+    (e.g. <span class="itemPublisher"><span lang="zh">...</span> Shenyang, 2002.</span>).
+    """
+    depth = 1
+    for tag in SPAN.finditer(text, start):
+        if tag.group() == "</span>":
+            depth -= 1
+            if depth == 0:
+                return text[start:tag.start()]
+        else:
+            depth += 1
+    return text[start:]
+
+
+def normalize_space(text):
+    """
+    Reduces all whitespace to single spaces (the engines differ in the whitespace they keep).
+    """
+    return " ".join(text.split())
+
+
+def parse_bs4(text):
+    """
+    Engine "bs4": Beautiful Soup with html.parser.
+    """
+    from bs4 import BeautifulSoup as bs
+    return extract_bs4(bs(text, "html.parser"), text)
+
+
+def extract_bs4(html, text=None):
+    """
+    Extracts the hits from a page already parsed with Beautiful Soup.
+    """
+    page = create_page()
+    for item in html.find_all('tr', {'class' : 'menuElem'}):
+        number = item.find('div', {'class' : 'item_number'}).get_text()
+        language = item.find('span', {'class' : 'itemLanguage'}).get_text()
+        publisher = item.find('span', {'class' : 'itemPublisher'})
+        if publisher is not None:
+            publisher = publisher.get_text()
+        add_hit(page, number, language, publisher)
+    errors = html.find('div', {'class' : 'error-results'})
+    if errors is not None:
+        page["error"] = normalize_space(errors.get_text())
+    if text is not None:
+        page["hits"] = get_number_of_results(text)
+    return page
+
+
+def has_class(name):
+    """
+    XPath condition for an element with the class name (among others), as Beautiful Soup matches classes.
+    """
+    return 'contains(concat(" ", normalize-space(@class), " "), " {} ")'.format(name)
+
+
+def parse_lxml(text):
+    """
+    Engine "lxml": lxml.html with XPath.
+    """
+    import lxml.html
+    page = create_page()
+    document = lxml.html.document_fromstring(text)
+    for item in document.xpath('//tr[{}]'.format(has_class("menuElem"))):
+        number = item.xpath('.//div[{}]'.format(has_class("item_number")))[0].text_content()
+        language = item.xpath('.//span[{}]'.format(has_class("itemLanguage")))[0].text_content()
+        publisher = item.xpath('.//span[{}]'.format(has_class("itemPublisher")))
+        if publisher:
+            publisher = publisher[0].text_content()
+        else:
+            publisher = None
+        add_hit(page, number, language, publisher)
+    errors = document.xpath('//div[{}]'.format(has_class("error-results")))
+    if errors:
+        page["error"] = normalize_space(errors[0].text_content())
+    page["hits"] = get_number_of_results(text)
+    return page
+
+
+def parse_targeted(text):
+    """
+    Engine "targeted": no complete parsing, the menuElem rows are cut out of the text and
+    only the item_number, itemLanguage and itemPublisher fields are read from them.
+    """
+    page = create_page()
+    starts = [row.end() for row in ROW.finditer(text)]
+    for i, start in enumerate(starts):
+        if i + 1 < len(starts):
+            end = starts[i + 1]
+        else:
+            end = text.find("</table>", start)
+            if end == -1:
+                end = len(text)
+        row = text[start:end]
+        number = get_text(ITEM_NUMBER.search(row).group(1))
+        language = get_text(get_span(row, ITEM_LANGUAGE.search(row).end()))
+        publisher = ITEM_PUBLISHER.search(row)
+        if publisher is not None:
+            publisher = get_text(get_span(row, publisher.end()))
+        add_hit(page, number, language, publisher)
+    errors = ERROR_RESULTS.search(text)
+    if errors is not None:
+        page["error"] = normalize_space(get_text(errors.group(1)))
+    page["hits"] = get_number_of_results(text)
+    return page
+
+
+PARSERS = {"bs4": parse_bs4, "lxml": parse_lxml, "targeted": parse_targeted}
+
+
+def parse_page(text, engine="bs4"):
+    """
+    Parses one result page with the chosen engine.
+
+    input: html (text), engine (see ENGINES)
+    output: dictionary with the lists "number", "itemLanguage", "year", "no_year" and the values "hits" and "error"
+    """
+    try:
+        parser = PARSERS[engine]
+    except KeyError:
+        raise ValueError("Unknown html_engine '{}', choose one of: {}".format(engine, ", ".join(ENGINES)))
+    return parser(text)
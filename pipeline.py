@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+
+"""
+Streaming mode of run_worldcat.py (pipeline : "stream" in config.yaml).
+
+Instead of running the stages one after the other and passing their results
+through the csv files, each novel flows through all steps in one process:
+
+    extract (metadata) -> fetch (result pages) -> parse -> count
+
+The metadata of the next novels is read in one process pool while the first
+ones are downloaded; as soon as all pages of a novel are downloaded, they are
+parsed in a second process pool while the download of the following novels goes
+on. Between the steps, at most pipeline_buffer novels are waiting, so the
+memory use does not grow with the size of the collection. The metadata table,
+the reprint counts and the summary are written once at the end; they are the
+same as those of the normal mode.
+"""
+
+import glob
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import pandas as pd
+
+import create_publicationtable
+import create_summary
+import get_htmlworldcat
+import get_metadata
+import html_store
+import instrumentation
+import page_cache
+
+
+# === Functions ===
+
+def bounded_map(executor, function, *iterables, buffer=16):
+    """
+    Like executor.map, but only buffer calls are submitted in advance, so the items are
+    read (and the results kept) only as far as the consumer has got.
+
+    output: iterator over the results, in the order of the items
+    """
+    if executor is None:
+        yield from map(function, *iterables)
+        return
+    futures = deque()
+    for arguments in zip(*iterables):
+        futures.append(executor.submit(function, *arguments))
+        if len(futures) >= buffer:
+            yield futures.popleft().result()
+    while futures:
+        yield futures.popleft().result()
+
+
+def extract_rows(files, settings_dict, executor, metadata):
+    """
+    Step "extract": reads the metadata of the files and hands them on as rows of the metadata table.
+    The metadata are also collected in metadata (for the metadata table, see get_metadata.append_dict).
+
+    output: iterator over dictionaries with the keys xmlid, basename, title, au-name
+    """
+    results = bounded_map(executor, get_metadata.extract_metadata, files, repeat(settings_dict["metadata_engine"]),
+                          buffer=settings_dict["pipeline_buffer"])
+    for id, basename, title, author in results:
+        get_metadata.append_dict(metadata, id, basename, title, author)
+        instrumentation.count("files")
+        yield {"xmlid": id, "basename": basename, "title": title, "au-name": author}
+
+
+class NovelCounter:
+    """
+    Steps "parse" and "count": the pages of each finished novel are parsed in the process pool
+    (create_publicationtable.count_novel); the results are collected in the order in which they
+    arrive, the warnings are written to the log file and new pages are kept for the page cache.
+    """
+
+    def __init__(self, settings_dict, executor):
+        self.settings_dict = settings_dict
+        self.executor = executor
+        self.buffer = settings_dict["pipeline_buffer"]
+        self.cache = page_cache.open_cache(settings_dict)         # created before the workers read it
+        self.store = None
+        self.parsing = deque()
+        self.publists = {}
+        self.new_pages = {}
+        self.used_keys = []
+
+    def add_novel(self, settings_dict, row):
+        """
+        Called by get_htmlworldcat.harvest_many when all pages of a novel have been downloaded.
+        """
+        id = row["xmlid"]
+        if self.store is None:
+            self.store = html_store.open_store(self.settings_dict, readonly=True)
+        numbers = self.store.list_numbers(id)
+        if not numbers:
+            return
+        if self.executor is None:
+            self.collect(create_publicationtable.count_novel(id, numbers, self.settings_dict))
+            return
+        self.parsing.append(self.executor.submit(create_publicationtable.count_novel, id, numbers, self.settings_dict))
+        while self.parsing and (self.parsing[0].done() or len(self.parsing) >= self.buffer):
+            self.collect(self.parsing.popleft().result())
+
+    def collect(self, result):
+        id, publist, pages, cache_entries = result
+        print(id)
+        instrumentation.count("novels_counted")
+        instrumentation.count("pages_parsed", len(pages))
+        for id_ext, page in pages:
+            create_publicationtable.test_year(page, id_ext)
+            create_publicationtable.test_search_result(page, id)
+        self.publists[id] = publist
+        for key, page in cache_entries.items():
+            if page is None:
+                self.used_keys.append(key)
+            else:
+                self.new_pages[key] = page
+
+    def finish(self):
+        """
+        Waits for the novels still being parsed and updates the page cache.
+        With table_workers 1, the pages are parsed in this process, one novel after the other.
+
+        output: dictionary with the ids (sorted, as in the normal mode) as keys and the publication years as values
+        """
+        while self.parsing:
+            self.collect(self.parsing.popleft().result())
+        if self.store is not None:
+            self.store.close()
+        if self.cache is not None:
+            self.cache.update(self.new_pages, self.used_keys)
+            self.cache.close()
+            print("Pages parsed: {}, taken from the cache: {}".format(len(self.new_pages), len(self.used_keys)))
+        return {id: self.publists[id] for id in sorted(self.publists)}
+
+
+def create_counts(publists, settings_dict):
+    """
+    Builds the reprint counts table (as create_publicationtable.main does) from the publication years of the novels.
+    """
+    ids = list(publists)
+    years = create_publicationtable.get_years(settings_dict)
+    matrix = create_publicationtable.create_matrix(years, ids)
+    create_publicationtable.fill_matrix(matrix, create_publicationtable.get_year_index(years), range(len(ids)), list(publists.values()))
+    dataframe = create_publicationtable.create_dataframe(matrix, years, ids)
+    create_publicationtable.add_sum(dataframe)
+    return dataframe
+
+
+# === Coordinating function ===
+
+def main(settings_dict, executor=None, session=None, limiter=None, metadata_executor=None):
+    """
+    Runs all steps for one language as a stream and writes <lang>_metadata.csv,
+    <lang>_reprint_counts.csv and <lang>_summary.csv at the end (nothing, if no file matches xml_path),
+    with the states for a later incremental run (see create_publicationtable.update_counts and create_summary.update_summary).
+    The metadata are read in a pool of metadata_workers processes, the pages are parsed in a
+    pool of table_workers processes (executor and metadata_executor, if given, are used instead).
+    """
+    print("--pipeline")
+    lang = settings_dict["lang"]
+    files = sorted(glob.glob(settings_dict["xml_path"]))
+    if not files:
+        print("Warning: no xml files found for xml_path '{}', no tables are written.".format(settings_dict["xml_path"]))
+        return
+    create_publicationtable.set_logfile(lang)
+    own_executor = None
+    if executor is None and settings_dict["table_workers"] != 1:
+        own_executor = executor = ProcessPoolExecutor(max_workers=settings_dict["table_workers"])
+    own_metadata_executor = None
+    if metadata_executor is None and settings_dict["metadata_workers"] != 1:
+        own_metadata_executor = metadata_executor = ProcessPoolExecutor(max_workers=settings_dict["metadata_workers"])
+    try:
+        metadata = {}
+        counter = NovelCounter(settings_dict, executor)
+        rows = extract_rows(files, settings_dict, metadata_executor, metadata)
+        get_htmlworldcat.harvest_many([(settings_dict, rows)], session, limiter, counter.add_novel, settings_dict["pipeline_buffer"])
+        publists = counter.finish()
+    finally:
+        if own_metadata_executor is not None:
+            own_metadata_executor.shutdown()
+        if own_executor is not None:
+            own_executor.shutdown()
+
+    get_metadata.save_csv(metadata, settings_dict)
+    counts = create_counts(publists, settings_dict)
+    create_publicationtable.save_counts(counts, settings_dict)
+    store = html_store.open_store(settings_dict)
+    novels = store.list_pages()
+    create_publicationtable.save_state(settings_dict, create_publicationtable.get_fingerprints(store, {id: novels.get(id, []) for id in publists}))
+    store.close()
+    metadata = pd.DataFrame.from_dict(metadata, orient="index", columns=["basename", "title", "au-name"])
+    summary = create_summary.summarize(counts.reset_index(), metadata, settings_dict)
+    create_summary.save_summary(summary, lang)
+    create_summary.save_summary_state(counts.reset_index(), settings_dict)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+"""
+Memo of the worldcat searches already done.
+
+Novels with the same search (same title, author and language after normalisation,
+see get_key) get the same result pages: duplicated novels, the same novel in several
+ELTeC levels, or reruns. The memo records for each search which novel's pages hold
+its results; when another novel has the same search, its pages are linked (hard
+links for html files) or copied from there instead of being downloaded again.
+
+The memo is kept in a json file (query_memo in config.yaml, e.g. cache/queries.json),
+so it also works across runs and across languages; without a file, duplicates are
+only recognised within one run.
+"""
+
+import json
+import os
+import re
+import threading
+import unicodedata
+from os.path import isfile
+
+import html_store
+
+
+ELTEC_EDITION = re.compile(r"\s*:\s*ELTeC\b.*$", re.I)
+
+
+# === Functions ===
+
+def normalize(text):
+    """
+    Canonical form of a title or an author for the comparison of searches:
+    unicode NFC, without ": ELTeC edition", lowercase, whitespace and trailing punctuation reduced.
+    """
+    text = unicodedata.normalize("NFC", str(text))
+    text = ELTEC_EDITION.sub("", text)
+    text = " ".join(text.lower().split())
+    return text.strip(" .,;:")
+
+
+def get_key(settings_dict, title, author):
+    """
+    Key of a search: worldcat language code, normalised title and author.
+    """
+    return "{}|{}|{}".format(settings_dict["lang_worldcat"], normalize(title), normalize(author))
+
+
+class QueryMemo:
+    """
+    Search key -> store (html_storage, write_file) and xmlid of the novel whose pages hold the results.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        if path and isfile(path):
+            with open(path, "r", encoding="utf8") as infile:
+                self.entries = json.load(infile)
+
+    def find(self, key):
+        with self.lock:
+            return self.entries.get(key)
+
+    def add(self, key, settings_dict, xmlid):
+        with self.lock:
+            self.entries[key] = {"html_storage": settings_dict["html_storage"], "write_file": settings_dict["write_file"], "xmlid": xmlid}
+
+    def save(self):
+        """
+        Writes the memo to a temporary file and replaces the old one.
+        """
+        if not self.path:
+            return
+        with self.lock:
+            folder = os.path.dirname(self.path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            with open(self.path + ".tmp", "w", encoding="utf8") as outfile:
+                json.dump(self.entries, outfile, indent=1, sort_keys=True, ensure_ascii=False)
+            os.replace(self.path + ".tmp", self.path)
+
+
+def open_memo(settings_dict):
+    """
+    Opens the memo set in config.yaml (query_memo); without a file, the memo only lives during the run.
+    """
+    return QueryMemo(settings_dict["query_memo"])
+
+
+def open_source(entry, stores):
+    """
+    Store with the pages of a memo entry; stores already open in this run (dictionary (html_storage, write_file) -> store)
+    are used, others are opened for reading and added to stores.
+    """
+    key = (entry["html_storage"], entry["write_file"])
+    if key not in stores:
+        if entry["html_storage"] == "sqlite" and not isfile(html_store.get_sqlite_path(entry)):
+            return None
+        stores[key] = html_store.open_store(entry, readonly=True)
+    return stores[key]
@@ -1,25 +1,194 @@
 
 
 # Imports and parameters
+#
+# The modules of the stages (and with them pandas, requests, Beautiful Soup) are
+# imported only in the functions running them, so a single stage starts quickly,
+# e.g. "python3 run_worldcat.py summary" only loads what create_summary.py needs.
 
-import yaml 
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+import yaml
 import get_settings
-import get_metadata 
-import get_htmlworldcat
-import create_publicationtable
-import create_summary
+import instrumentation
 
 configfile = "config.yaml"
 
+STAGES = ["metadata", "harvest", "table", "summary", "sweep", "all"]
 
-def main(configfile): 
-    with open(configfile, 'r') as configfile:
-        config = yaml.safe_load(configfile)
-        settings_dict = get_settings.main(config["lang"], config["basedir"], config["level"], config["write_file"], config["htmlpages"])
-        get_metadata.main(settings_dict)
-        get_htmlworldcat.main(settings_dict)
-        create_publicationtable.main(settings_dict)
-        create_summary.main(settings_dict)
-    
 
-main(configfile)
+def get_langs(config):
+    """
+    The parameter "lang" in config.yaml can be one language or a list of languages.
+    """
+    langs = config["lang"]
+    if isinstance(langs, str):
+        langs = [langs]
+    return langs
+
+
+def parse_overrides(pairs):
+    """
+    Parameters given on the command line as key=value (e.g. --set table_workers=1 --set lang=[fra,eng]);
+    the values are read as yaml, like in config.yaml.
+
+    output: dictionary with the parameters
+    """
+    overrides = {}
+    for pair in pairs or []:
+        if "=" not in pair:
+            raise ValueError("expected key=value, not '{}'".format(pair))
+        key, value = pair.split("=", 1)
+        overrides[key.strip()] = yaml.safe_load(value) if value.strip() else None
+    return overrides
+
+
+def read_config(configfile, overrides=None):
+    """
+    Reads config.yaml, applies the parameters from the command line and creates the settings of each language.
+
+    output: list of settings dictionaries, one per language
+    """
+    with open(configfile, 'r') as infile:
+        config = yaml.safe_load(infile)
+    config.update(overrides or {})
+    langs = get_langs(config)
+    return [get_settings.main(lang, config["basedir"], config["level"], config["write_file"], config["htmlpages"], config) for lang in langs]
+
+
+def run_metadata(settings_dicts, executor=None):
+    import get_metadata
+    for settings_dict in settings_dicts:
+        with instrumentation.stage("get_metadata", [settings_dict["lang"]]):
+            get_metadata.main(settings_dict, executor)
+
+
+def run_harvest(settings_dicts):
+    """
+    Several languages are downloaded together, with one shared download scheduler,
+    or through the work queue with several worker processes (queue_workers, see work_queue.py).
+    """
+    import get_htmlworldcat
+    langs = [settings_dict["lang"] for settings_dict in settings_dicts]
+    with instrumentation.stage("get_htmlworldcat", langs):
+        if settings_dicts[0]["queue_workers"]:
+            import work_queue
+            work_queue.run(settings_dicts)
+        elif len(settings_dicts) > 1:
+            get_htmlworldcat.main_many(settings_dicts)
+        else:
+            get_htmlworldcat.main(settings_dicts[0])
+
+
+def run_table(settings_dicts, executor=None):
+    import create_publicationtable
+    for settings_dict in settings_dicts:
+        with instrumentation.stage("create_publicationtable", [settings_dict["lang"]]):
+            create_publicationtable.main(settings_dict, executor)
+
+
+def run_summary(settings_dicts):
+    """
+    With several languages, a combined summary (all_summary.csv) is written as well.
+    """
+    import create_summary
+    langs = [settings_dict["lang"] for settings_dict in settings_dicts]
+    with instrumentation.stage("create_summary", langs):
+        for settings_dict in settings_dicts:
+            create_summary.main(settings_dict)
+        if len(langs) > 1:
+            create_summary.combine_summaries(langs)
+
+
+def run_sweep(settings_dicts):
+    """
+    Canonicity status for all periods and thresholds in sweep_periods and sweep_thresholds (not part of "all").
+    """
+    import create_summary
+    for settings_dict in settings_dicts:
+        with instrumentation.stage("create_sweep", [settings_dict["lang"]]):
+            create_summary.main_sweep(settings_dict)
+
+
+def get_pool(workers):
+    """
+    Process pool for one stage of the batch mode, shared by all languages;
+    with workers 1, the stage runs in this process (like with one language).
+    """
+    if workers == 1:
+        return nullcontext()
+    return ProcessPoolExecutor(max_workers=workers)
+
+
+def run_batch(settings_dicts):
+    """
+    Batch mode for several languages in one process:
+    each stage is run for all languages before the next stage begins,
+    with one process pool for reading (metadata_workers), one for parsing (table_workers)
+    and one shared download scheduler.
+    Output files are written per language, plus a combined summary (all_summary.csv).
+    """
+    with get_pool(settings_dicts[0]["metadata_workers"]) as executor:
+        run_metadata(settings_dicts, executor)
+    run_harvest(settings_dicts)
+    with get_pool(settings_dicts[0]["table_workers"]) as executor:
+        run_table(settings_dicts, executor)
+    run_summary(settings_dicts)
+
+
+def run_stream(settings_dicts):
+    """
+    Streaming mode (pipeline : "stream" in config.yaml): all steps at once for each novel,
+    one language after the other (see pipeline.py).
+    """
+    import create_summary
+    import pipeline
+    langs = [settings_dict["lang"] for settings_dict in settings_dicts]
+    for settings_dict in settings_dicts:
+        with instrumentation.stage("pipeline", [settings_dict["lang"]]):
+            pipeline.main(settings_dict)
+    if len(langs) > 1:
+        create_summary.combine_summaries(langs)
+
+
+def run_all(settings_dicts):
+    if settings_dicts[0]["pipeline"] == "stream":
+        run_stream(settings_dicts)
+    elif len(settings_dicts) > 1:
+        run_batch(settings_dicts)
+    else:
+        run_metadata(settings_dicts)
+        run_harvest(settings_dicts)
+        run_table(settings_dicts)
+        run_summary(settings_dicts)
+
+
+def main(configfile, refresh_older_than=None, stage="all", overrides=None):
+    """
+    Runs one stage ("metadata", "harvest", "table", "summary", "sweep") or all of them ("all")
+    for the languages in config.yaml; the stages read the files written by the stage before.
+    """
+    overrides = dict(overrides or {})
+    if refresh_older_than is not None:
+        overrides["refresh_older_than"] = refresh_older_than
+    settings_dicts = read_config(configfile, overrides)
+    runners = {"metadata": run_metadata, "harvest": run_harvest, "table": run_table, "summary": run_summary, "sweep": run_sweep, "all": run_all}
+    with instrumentation.run_report(settings_dicts[0]):
+        runners[stage](settings_dicts)
+
+
+if __name__ == "__main__":          # required for the process pools (e.g. on Windows)
+    parser = argparse.ArgumentParser(description="Reprint counts for an ELTeC collection from worldcat.")
+    parser.add_argument("stage", nargs="?", choices=STAGES, default="all",
+                        help="stage to run: metadata (get_metadata.py), harvest (get_htmlworldcat.py), table (create_publicationtable.py), summary (create_summary.py), all (default), "
+                             "or sweep (canonicity status for the periods and thresholds in sweep_periods and sweep_thresholds)")
+    parser.add_argument("--config", default=configfile, metavar="FILE", help="configuration file (default: config.yaml)")
+    parser.add_argument("--set", action="append", dest="overrides", metavar="KEY=VALUE", help="overrides a parameter of the configuration file (can be repeated)")
+    parser.add_argument("--refresh-older-than", type=float, metavar="DAYS", help="download again all pages fetched more than DAYS days ago")
+    args = parser.parse_args()
+    try:
+        overrides = parse_overrides(args.overrides)
+    except ValueError as error:
+        parser.error(str(error))
+    main(args.config, args.refresh_older_than, args.stage, overrides)
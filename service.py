@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+
+"""
+Service mode: a local HTTP server answering queries about the reprint counts.
+
+The metadata table, the reprint counts (with the cumulative index of
+create_summary.py) and the summary of each language in config.yaml are read
+once and kept in memory; answers are kept in a cache (service_cache_size), so
+repeated queries are answered without any computation. Endpoints (answers in json):
+
+GET  /counts?lang=fra&xmlid=FRA00101&from=1970&to=2009   reprints of a novel per year and in total (default: year_min to year_max)
+GET  /summary?lang=fra[&xmlid=FRA00101]                  summary of a language (or one row of it)
+POST /harvest?lang=fra&xmlid=FRA00101                    downloads the pages of a novel again and updates its counts and summary row
+GET  /stats                                              response times per endpoint and hit rate of the cache
+
+The reprint counts (<lang>_reprint_counts.csv etc.) and the metadata table must exist,
+i.e. run_worldcat.py has been run before. The download uses worldcat_url, so the service
+can be tested with stub_worldcat.py (see benchmarks/check_service.py).
+
+Usage: python3 service.py [--port PORT] [--config FILE] [--set KEY=VALUE ...]
+"""
+
+import argparse
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+import pandas as pd
+
+import create_publicationtable
+import create_summary
+import get_htmlworldcat
+import html_store
+import http_fetch
+import instrumentation
+import page_cache
+import run_worldcat
+
+
+class ServiceError(Exception):
+    """
+    Error answered to the client with the given http status.
+    """
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+# === Functions ===
+
+def to_json(data):
+    """
+    Encodes an answer; numpy numbers become python numbers, missing values null.
+    """
+    return json.dumps(data, ensure_ascii=False, default=lambda value: value.item()).encode("utf8")
+
+
+class ResponseCache:
+    """
+    Answers of the GET endpoints (least recently used ones are removed beyond max_entries);
+    counts its hits and misses.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, body):
+        with self.lock:
+            self.entries[key] = body
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self, lang):
+        """
+        Removes the answers about one language (after a harvest).
+        """
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == lang]:
+                del self.entries[key]
+
+    def get_stats(self):
+        with self.lock:
+            queries = self.hits + self.misses
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses,
+                    "hit_rate": round(self.hits / queries, 4) if queries else None}
+
+
+class Collection:
+    """
+    Metadata, reprint counts and summary of one language, kept in memory.
+    """
+
+    def __init__(self, settings_dict):
+        self.settings_dict = settings_dict
+        self.lock = threading.Lock()
+        self.metadata = create_summary.read_metadatafile(settings_dict["csv_file"])
+        counts = create_publicationtable.read_counts_table(settings_dict)
+        if counts is None:
+            raise FileNotFoundError("No reprint counts for {}: run run_worldcat.py first".format(settings_dict["lang"]))
+        self.counts = counts
+        self.summary = self.create_summary(list(counts.columns))
+        self.update_index()
+
+    def get_counts_frame(self, ids):
+        """
+        Counts of the novels with the row "Total", in the form read by create_summary.read_counts.
+        """
+        counts = self.counts[ids].copy()
+        create_publicationtable.add_sum(counts)
+        return counts.reset_index()
+
+    def create_summary(self, ids):
+        return create_summary.summarize(self.get_counts_frame(ids), self.metadata, self.settings_dict)
+
+    def update_index(self):
+        """
+        Cumulative index over the years (see create_summary.create_cumulative_index) and the position of each novel in it.
+        """
+        counts = self.counts.reset_index()
+        self.index = create_summary.create_cumulative_index(counts)
+        self.positions = {id: position for position, id in enumerate(self.index[2])}
+
+    def get_counts(self, xmlid, first, last):
+        if first > last:
+            raise ServiceError(400, "from ({}) must not be after to ({})".format(first, last))
+        with self.lock:
+            if xmlid not in self.positions:
+                raise ServiceError(404, "Unknown xmlid: {}".format(xmlid))
+            total = create_summary.get_period_totals(self.index, [(first, last)])[0][self.positions[xmlid]]
+            column = self.counts[xmlid]
+        years = column[(column.index >= first) & (column.index <= last) & (column != 0)]
+        return {"lang": self.settings_dict["lang"], "xmlid": xmlid, "from": first, "to": last, "total": total,
+                "years": {str(year): count for year, count in years.items()}}
+
+    def get_summary(self, xmlid=None):
+        with self.lock:
+            summary = self.summary
+        if xmlid is not None:
+            if xmlid not in summary.index:
+                raise ServiceError(404, "Unknown xmlid: {}".format(xmlid))
+            summary = summary.loc[[xmlid]]
+        summary = summary.astype(object).where(summary.notna(), None)
+        return {"lang": self.settings_dict["lang"], "novels": summary.to_dict(orient="index")}
+
+    def harvest(self, xmlid, session, limiter):
+        """
+        Downloads all pages of the novel again (as with refresh_older_than 0), parses them and
+        replaces the novel's counts and summary row.
+        """
+        if xmlid not in self.metadata.index:
+            raise ServiceError(404, "Unknown xmlid: {}".format(xmlid))
+        settings_dict = dict(self.settings_dict, refresh_older_than=0)
+        rows = self.metadata.loc[[xmlid]].reset_index()
+        hits = get_htmlworldcat.harvest(settings_dict, rows, session, limiter).get(xmlid)
+        store = html_store.open_store(settings_dict, readonly=True)
+        numbers = store.list_numbers(xmlid)
+        store.close()
+        id, publist, pages, cache_entries = create_publicationtable.count_novel(xmlid, numbers, settings_dict)
+        cache = page_cache.open_cache(settings_dict)
+        if cache is not None:
+            cache.update({key: page for key, page in cache_entries.items() if page is not None},
+                         [key for key, page in cache_entries.items() if page is None])
+            cache.close()
+        years = create_publicationtable.get_years(settings_dict)
+        column = create_publicationtable.create_matrix(years, [xmlid])
+        create_publicationtable.fill_matrix(column, create_publicationtable.get_year_index(years), [0], [publist])
+        with self.lock:
+            counts = self.counts.copy()
+            counts[xmlid] = column[:, 0]
+            self.counts = counts
+            row = self.create_summary([xmlid])
+            self.summary = pd.concat([self.summary.drop(index=xmlid, errors="ignore"), row]).reindex(counts.columns)
+            self.update_index()
+        return {"lang": self.settings_dict["lang"], "xmlid": xmlid, "hits": hits, "pages": len(numbers), "total": int(column.sum())}
+
+
+class Service:
+    """
+    The collections of all languages, one download session and limiter, the answer cache and the response times.
+    """
+
+    def __init__(self, settings_dicts):
+        first = settings_dicts[0]
+        self.collections = {settings_dict["lang"]: Collection(settings_dict) for settings_dict in settings_dicts}
+        self.cache = ResponseCache(first["service_cache_size"])
+        self.session = http_fetch.get_session(first)
+        self.limiter = http_fetch.get_limiter(first)
+        self.harvest_lock = threading.Lock()
+        self.latencies = {}
+        self.latencies_lock = threading.Lock()
+        self.started = time.time()
+
+    def get_collection(self, parameters):
+        lang = parameters.get("lang")
+        if lang is None and len(self.collections) == 1:
+            lang = next(iter(self.collections))
+        if lang not in self.collections:
+            raise ServiceError(404, "Unknown lang: {} (available: {})".format(lang, ", ".join(self.collections)))
+        return self.collections[lang]
+
+    def get_year(self, parameters, name, default):
+        try:
+            return int(parameters.get(name, default))
+        except ValueError:
+            raise ServiceError(400, "{} must be a year".format(name))
+
+    def handle(self, method, endpoint, parameters):
+        """
+        Answers a request; the answers of counts and summary are cached until the next harvest of the language.
+
+        output: body of the answer (json)
+        """
+        if method == "GET" and endpoint == "stats":
+            return to_json(self.get_stats())
+        if (method, endpoint) not in [("GET", "counts"), ("GET", "summary"), ("POST", "harvest")]:
+            raise ServiceError(404, "Unknown endpoint: {} /{}".format(method, endpoint))
+        collection = self.get_collection(parameters)
+        lang = collection.settings_dict["lang"]
+        xmlid = parameters.get("xmlid")
+        if endpoint == "harvest":
+            if xmlid is None:
+                raise ServiceError(400, "harvest needs an xmlid")
+            with self.harvest_lock:
+                body = to_json(collection.harvest(xmlid, self.session, self.limiter))
+            self.cache.clear(lang)
+            return body
+        key = (lang, endpoint, tuple(sorted(parameters.items())))
+        body = self.cache.get(key)
+        if body is not None:
+            return body
+        if endpoint == "counts":
+            if xmlid is None:
+                raise ServiceError(400, "counts needs an xmlid")
+            first = self.get_year(parameters, "from", collection.settings_dict["year_min"])
+            last = self.get_year(parameters, "to", collection.settings_dict["year_max"])
+            body = to_json(collection.get_counts(xmlid, first, last))
+        else:
+            body = to_json(collection.get_summary(xmlid))
+        self.cache.put(key, body)
+        return body
+
+    def add_latency(self, endpoint, seconds):
+        with self.latencies_lock:
+            self.latencies.setdefault(endpoint, deque(maxlen=100000)).append(seconds)
+
+    def get_stats(self):
+        with self.latencies_lock:
+            latencies = {endpoint: instrumentation.summarize_latencies(list(values)) for endpoint, values in self.latencies.items()}
+        return {"uptime_seconds": round(time.time() - self.started, 1), "langs": list(self.collections),
+                "latency": latencies, "cache": self.cache.get_stats()}
+
+
+def create_handler(service):
+    """
+    Creates the request handler class answering with the service.
+    """
+
+    class ServiceHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            self.answer("GET")
+
+        def do_POST(self):
+            self.answer("POST")
+
+        def answer(self, method):
+            start = time.perf_counter()
+            url = urlsplit(self.path)
+            endpoint = url.path.strip("/")
+            parameters = {key: values[0] for key, values in parse_qs(url.query).items()}
+            try:
+                status, body = 200, service.handle(method, endpoint, parameters)
+            except ServiceError as error:
+                status, body = error.status, to_json({"error": error.message})
+            except Exception as error:          # the service keeps running
+                status, body = 500, to_json({"error": "{}: {}".format(type(error).__name__, error)})
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            service.add_latency(endpoint, time.perf_counter() - start)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ServiceHandler
+
+
+def start_server(settings_dicts, port=0):
+    """
+    Loads the data and starts the service in a background thread.
+
+    input: list of settings dictionaries (one per language), port (0: any free port)
+    output: server; the service is server.service, its address "http://127.0.0.1:<server.server_port>"
+    """
+    service = Service(settings_dicts)
+    server = ThreadingHTTPServer(("127.0.0.1", port), create_handler(service))
+    server.service = service
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+# === Coordinating function ===
+
+def main(configfile="config.yaml", port=None, overrides=None):
+    settings_dicts = run_worldcat.read_config(configfile, overrides)
+    if port is None:
+        port = settings_dicts[0]["service_port"]
+    server = start_server(settings_dicts, port)
+    print("Serving {} on http://127.0.0.1:{}".format(", ".join(server.service.collections), server.server_port))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local HTTP service for the reprint counts.")
+    parser.add_argument("--port", type=int, help="port of the service (default: service_port in config.yaml)")
+    parser.add_argument("--config", default=run_worldcat.configfile, metavar="FILE", help="configuration file (default: config.yaml)")
+    parser.add_argument("--set", action="append", dest="overrides", metavar="KEY=VALUE", help="overrides a parameter of the configuration file (can be repeated)")
+    args = parser.parse_args()
+    try:
+        overrides = run_worldcat.parse_overrides(args.overrides)
+    except ValueError as error:
+        parser.error(str(error))
+    main(args.config, args.port, overrides)
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+"""
+Local stand-in server for worldcat.
+
+Serves saved result pages (html/<lang>/<xmlid>_html<N>.html or any store from html_store.py) for the search urls
+generated by get_htmlworldcat.py, so that the download can be tested without
+sending requests to worldcat. Set worldcat_url in config.yaml to the address of the stub.
+
+For testing the behaviour of the download under errors, the stub can inject faults
+(see FAULTS): server errors (500, 503), throttling (429 with Retry-After), dropped
+connections, slow answers and a maximum rate above which it answers 429. With
+overestimate, the number of results is too high and the last page is repeated
+(for testing the pagination planner of get_htmlworldcat.py).
+
+Usage: python3 stub_worldcat.py [lang] [port] [fault=value ...]
+e.g.   python3 stub_worldcat.py fra 8000 error_rate=0.1 max_rate=5
+"""
+
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from os.path import join
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+import requests
+
+import get_htmlworldcat
+import get_settings
+import html_store
+from parse_worldcat import NUMBER_OF_RESULTS
+
+
+FAULTS = {
+    "error_rate": 0.0,          # share of requests answered with 500
+    "unavailable_rate": 0.0,    # share of requests answered with 503 (with Retry-After)
+    "throttle_rate": 0.0,       # share of requests answered with 429 (with Retry-After)
+    "retry_after": 1,           # Retry-After (seconds) sent with 429 and 503
+    "drop_rate": 0.0,           # share of requests whose connection is closed without an answer
+    "delay_rate": 0.0,          # share of requests answered only after delay seconds (e.g. longer than read_timeout)
+    "delay": 0.0,
+    "max_rate": 0,              # requests per second above which all requests are answered with 429 (0: no limit)
+    "overestimate": 0.0,        # the number of results on the first page is raised by this share (e.g. 1.0: doubled);
+                                # pages beyond the last saved page are then answered with the last page, like worldcat
+    "seed": 0,
+    }
+
+NO_RESULT = """<html><body><div class="error-results">
+No results match your search for 'ti:{} au:{}'.
+</div></body></html>"""
+
+
+# === Functions ===
+
+def get_query(url):
+    """
+    Extracts the search query (q) from a url, in the form in which it arrives at the server.
+    """
+    url = requests.Request("GET", url).prepare().url
+    return parse_qs(urlsplit(url).query).get("q", [""])[0]
+
+
+def create_index(settings_dict, data):
+    """
+    Relates the search query of each novel in the metadata table to its xmlid.
+
+    input: settings_dict, metadata table
+    output: dictionary with queries as keys and xmlids as values
+    """
+    index = {}
+    for i, row in data.iterrows():
+        title = get_htmlworldcat.get_title(row)
+        author = get_htmlworldcat.get_author(row)
+        suchstring = get_htmlworldcat.generate_suchstring(settings_dict, title, author)
+        index[get_query(suchstring)] = row["xmlid"]
+    return index
+
+
+def get_faults(faults=None):
+    """
+    Fault settings: FAULTS, updated with the given values.
+    """
+    settings = dict(FAULTS)
+    settings.update(faults or {})
+    return settings
+
+
+def create_handler(index, store, faults=None):
+    """
+    Creates the request handler class serving the pages from the store.
+    The handler class counts the answers given (StubHandler.answers: Counter of "200", "429", "dropped", ...).
+    """
+    faults = get_faults(faults)
+    rng = random.Random(faults["seed"])
+    lock = threading.Lock()
+    recent = deque()
+
+    def get_fault():
+        """
+        Decides which fault (if any) the current request gets.
+        """
+        with lock:
+            now = time.monotonic()
+            recent.append(now)
+            while recent and recent[0] < now - 1.0:
+                recent.popleft()
+            if faults["max_rate"] and len(recent) > faults["max_rate"]:
+                return "throttle"
+            chance = rng.random()
+            for fault in ["error", "unavailable", "throttle", "drop", "delay"]:
+                if chance < faults[fault + "_rate"]:
+                    return fault
+                chance -= faults[fault + "_rate"]
+            return None
+
+    class StubHandler(BaseHTTPRequestHandler):
+
+        answers = Counter()
+
+        def do_GET(self):
+            fault = get_fault()
+            if fault == "error":
+                self.send_page(500, b"")
+                return
+            if fault == "unavailable":
+                self.send_page(503, b"", faults["retry_after"])
+                return
+            if fault == "throttle":
+                self.send_page(429, b"", faults["retry_after"])
+                return
+            if fault == "drop":
+                with lock:
+                    self.answers["dropped"] += 1
+                self.close_connection = True
+                return
+            if fault == "delay":
+                time.sleep(faults["delay"])
+            query = parse_qs(urlsplit(self.path).query)
+            q = query.get("q", [""])[0]
+            start = int(query.get("start", ["1"])[0])
+            page = (start - 1) // 10 + 1
+            xmlid = index.get(q)
+            html = None
+            if xmlid is not None:
+                html = store.read_page(xmlid, page)
+                if html is None and faults["overestimate"] and page > 1:
+                    numbers = store.list_numbers(xmlid)
+                    html = store.read_page(xmlid, numbers[-1]) if numbers else None
+                elif html is not None and faults["overestimate"] and page == 1:
+                    html = NUMBER_OF_RESULTS.sub(lambda match: "of about <strong>{:,}</strong>".format(
+                        int(int(match.group(1).replace(",", "")) * (1 + faults["overestimate"]))), html)
+            if html is not None:
+                self.send_page(200, html.encode("utf8"))
+            elif page == 1:
+                self.send_page(200, NO_RESULT.format(q, "").encode("utf8"))
+            else:
+                self.send_page(404, b"")
+
+        def send_page(self, status, body, retry_after=None):
+            with lock:
+                self.answers[str(status)] += 1
+            self.send_response(status)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            if retry_after is not None:
+                self.send_header("Retry-After", str(retry_after))
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StubHandler
+
+
+def start_server(settings_dict, data, store, port=0, faults=None):
+    """
+    Starts the stub in a background thread.
+
+    input: settings_dict, metadata table, store or folder with saved pages, port (0: any free port), faults (see FAULTS)
+    output: server; the url to be used as worldcat_url is "http://127.0.0.1:<server.server_port>",
+            the answers given are counted in server.RequestHandlerClass.answers
+    """
+    index = create_index(settings_dict, data)
+    if isinstance(store, str):
+        store = html_store.FileStore(store)
+    server = ThreadingHTTPServer(("127.0.0.1", port), create_handler(index, store, faults))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+# === Coordinating function ===
+
+def main(lang="fra", port=8000, *faults):
+    settings_dict = {"worldcat_url": "http://127.0.0.1:{}".format(port)}
+    lang, settings_dict = get_settings.get_lang_worldcat(lang, settings_dict)
+    data = get_htmlworldcat.read_csv("{}_metadata.csv".format(lang))
+    faults = {key: float(value) for key, value in (fault.split("=", 1) for fault in faults)}
+    server = start_server(settings_dict, data, join("html", lang), int(port), faults)
+    print("Serving html/{} on {}".format(lang, settings_dict["worldcat_url"]))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,468 @@
+#!/usr/bin/env python3
+
+"""
+Work queue for the download of the result pages by several worker processes,
+on one machine or on several machines sharing the folder.
+
+The queue is one SQLite file (queue_path in config.yaml, e.g. cache/harvest_queue.sqlite)
+with one job per page of a novel. "enqueue" adds a job for the first page of each novel
+(or for the missing pages of novels whose first page is already there, see html/<lang>/manifest.json);
+when a worker has downloaded a first page, it adds the jobs for the pages 2..N of the novel.
+A worker claims one job at a time with a lease of queue_lease seconds, which it renews while
+the download is running (see keep_lease): a job whose worker fails or disappears goes back
+to the queue, until it has been tried queue_attempts times.
+
+    queued -> leased -> done
+                     -> skipped   (page without hits or with the same hits as an earlier page,
+                                   the following pages of the novel are skipped as well)
+                     -> queued    (download failed or lease expired) -> ... -> failed
+
+The workers only write the pages into the store (html_storage); "collect" records them
+in the manifests afterwards, so only one process writes each manifest.
+
+python3 work_queue.py enqueue            # jobs for all novels of the languages in config.yaml
+python3 work_queue.py work [--name N]    # one worker, until no job is queued or leased
+python3 work_queue.py progress           # number of jobs per language and state
+python3 work_queue.py collect            # records the downloaded pages in the manifests
+python3 work_queue.py run [--workers N]  # all of it with N local worker processes
+
+The rate limit (requests_per_second) applies to each worker. On several machines, the queue
+and the pages (write_file) must be on a shared file system on which SQLite locking works.
+"""
+
+import argparse
+import itertools
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+
+import fetch_manifest
+import get_htmlworldcat
+import html_store
+import http_fetch
+import instrumentation
+
+
+STATES = ["queued", "leased", "done", "skipped", "failed"]
+COMMANDS = ["enqueue", "work", "progress", "collect", "run"]
+
+
+# === Functions ===
+
+class WorkQueue:
+    """
+    Jobs (one per page) in an SQLite file; can be used by several processes at once,
+    each process opens its own WorkQueue.
+    """
+
+    def __init__(self, path, lease=300.0, max_attempts=3):
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)     # transactions with BEGIN IMMEDIATE, see transaction()
+        self.connection.execute("CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY, lang TEXT, xmlid TEXT, page INTEGER, url TEXT, "
+                                "state TEXT, worker TEXT, lease_until REAL, attempts INTEGER, hits INTEGER, sha1 TEXT, error TEXT, "
+                                "collected INTEGER, updated REAL, UNIQUE (lang, xmlid, page))")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id)")
+
+    @contextmanager
+    def transaction(self):
+        """
+        The database is locked for writing at the beginning, so two workers never claim the same job.
+        """
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.connection
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    def enqueue(self, jobs, connection=None):
+        """
+        Adds jobs; a job that is already finished (done, skipped or failed) is queued again,
+        one that is queued or leased stays as it is.
+
+        input: iterable of (lang, xmlid, page, url)
+        output: number of jobs added or queued again
+        """
+        if connection is None:
+            with self.transaction() as connection:
+                return self.enqueue(jobs, connection)
+        now = time.time()
+        rows = [(lang, xmlid, page, url, now) for lang, xmlid, page, url in jobs]
+        before = connection.total_changes
+        connection.executemany("INSERT INTO jobs (lang, xmlid, page, url, state, attempts, collected, updated) VALUES (?, ?, ?, ?, 'queued', 0, 0, ?) "
+                               "ON CONFLICT (lang, xmlid, page) DO UPDATE SET url = excluded.url, state = 'queued', worker = NULL, lease_until = NULL, "
+                               "attempts = 0, hits = NULL, sha1 = NULL, error = NULL, collected = 0, updated = excluded.updated "
+                               "WHERE state NOT IN ('queued', 'leased')", rows)
+        return connection.total_changes - before
+
+    def expire(self, connection, now):
+        """
+        Jobs whose lease has expired go back to the queue (or fail after max_attempts).
+        """
+        connection.execute("UPDATE jobs SET state = 'failed', worker = NULL, error = 'lease expired', updated = ? "
+                           "WHERE state = 'leased' AND lease_until < ? AND attempts >= ?", (now, now, self.max_attempts))
+        expired = connection.execute("UPDATE jobs SET state = 'queued', worker = NULL, error = 'lease expired', updated = ? "
+                                     "WHERE state = 'leased' AND lease_until < ?", (now, now)).rowcount
+        if expired:
+            instrumentation.count("leases_expired", expired)
+
+    def claim(self, worker):
+        """
+        output: the oldest queued job (dictionary) leased to the worker, or None if no job is queued
+        """
+        now = time.time()
+        with self.transaction() as connection:
+            self.expire(connection, now)
+            row = connection.execute("SELECT id, lang, xmlid, page, url, attempts FROM jobs WHERE state = 'queued' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            connection.execute("UPDATE jobs SET state = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1, updated = ? WHERE id = ?",
+                               (worker, now + self.lease, now, row[0]))
+        job = dict(zip(["id", "lang", "xmlid", "page", "url", "attempts"], row))
+        job["attempts"] += 1
+        job["worker"] = worker
+        return job
+
+    def renew(self, job):
+        """
+        Extends the lease of the job by queue_lease seconds from now.
+
+        output: True, if the job is still leased to the worker
+        """
+        with self.transaction() as connection:
+            return connection.execute("UPDATE jobs SET lease_until = ?, updated = ? WHERE id = ? AND state = 'leased' AND worker = ?",
+                                      (time.time() + self.lease, time.time(), job["id"], job["worker"])).rowcount == 1
+
+    def finish(self, connection, job, state, hits=None, sha1=None, error=None):
+        """
+        output: True, if the job was still leased to the worker (otherwise its lease had expired and nothing is changed)
+        """
+        return connection.execute("UPDATE jobs SET state = ?, worker = NULL, lease_until = NULL, hits = ?, sha1 = ?, error = ?, updated = ? "
+                                  "WHERE id = ? AND state = 'leased' AND worker = ?",
+                                  (state, hits, sha1, error, time.time(), job["id"], job["worker"])).rowcount == 1
+
+    def complete(self, job, hits=None, sha1=None, following=()):
+        """
+        Marks the job as done and adds the following jobs (pages 2..N after the first page) in the same transaction.
+        """
+        with self.transaction() as connection:
+            if not self.finish(connection, job, "done", hits, sha1):
+                return False
+            self.enqueue(following, connection)
+            return True
+
+    def fail(self, job, error):
+        """
+        The job goes back to the queue, or fails after max_attempts.
+        """
+        state = "failed" if job["attempts"] >= self.max_attempts else "queued"
+        with self.transaction() as connection:
+            return self.finish(connection, job, state, error=str(error))
+
+    def skip(self, job, reason):
+        """
+        The page is not saved, and the queued pages after it of the same novel are skipped as well.
+        """
+        with self.transaction() as connection:
+            if not self.finish(connection, job, "skipped", error=reason):
+                return False
+            connection.execute("UPDATE jobs SET state = 'skipped', error = ?, updated = ? WHERE lang = ? AND xmlid = ? AND page > ? AND state = 'queued'",
+                               ("after page {}".format(job["page"]), time.time(), job["lang"], job["xmlid"], job["page"]))
+            return True
+
+    def has_hash(self, job, sha1):
+        """
+        output: True, if an earlier page of the same novel with the same hits is done
+        """
+        row = self.connection.execute("SELECT 1 FROM jobs WHERE lang = ? AND xmlid = ? AND page < ? AND state = 'done' AND sha1 = ? LIMIT 1",
+                                      (job["lang"], job["xmlid"], job["page"], sha1)).fetchone()
+        return row is not None
+
+    def is_finished(self):
+        """
+        output: True, if no job is queued or leased
+        """
+        row = self.connection.execute("SELECT 1 FROM jobs WHERE state IN ('queued', 'leased') LIMIT 1").fetchone()
+        return row is None
+
+    def get_progress(self):
+        """
+        output: dictionary lang -> {state: number of jobs}
+        """
+        progress = {}
+        for lang, state, number in self.connection.execute("SELECT lang, state, COUNT(*) FROM jobs GROUP BY lang, state ORDER BY lang"):
+            progress.setdefault(lang, {state: 0 for state in STATES})[state] = number
+        return progress
+
+    def get_finished(self, lang):
+        """
+        output: list of the jobs of the language that are done or skipped and not yet collected, ordered by novel and page
+        """
+        rows = self.connection.execute("SELECT id, xmlid, page, url, state, hits, sha1 FROM jobs WHERE lang = ? AND state IN ('done', 'skipped') "
+                                       "AND collected = 0 ORDER BY xmlid, page", (lang,)).fetchall()
+        return [dict(zip(["id", "xmlid", "page", "url", "state", "hits", "sha1"], row)) for row in rows]
+
+    def set_collected(self, jobs):
+        with self.transaction() as connection:
+            connection.executemany("UPDATE jobs SET collected = 1 WHERE id = ?", [(job["id"],) for job in jobs])
+
+    def close(self):
+        self.connection.close()
+
+
+def open_queue(settings_dict):
+    return WorkQueue(settings_dict["queue_path"], settings_dict["queue_lease"], settings_dict["queue_attempts"])
+
+
+@contextmanager
+def keep_lease(queue, job):
+    """
+    Heartbeat while a job is being downloaded: the lease is renewed every third of queue_lease
+    in a background thread (with its own connection), so a slow download (retries, backoff)
+    is not handed to another worker. If the worker process dies, the renewals stop and the lease expires.
+    """
+    stop = threading.Event()
+
+    def renew():
+        keeper = WorkQueue(queue.path, queue.lease, queue.max_attempts)
+        try:
+            while not stop.wait(queue.lease / 3) and keeper.renew(job):
+                pass
+        finally:
+            keeper.close()
+
+    thread = threading.Thread(target=renew, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def get_page_jobs(settings_dict, xmlid, suchstring, numbers_of_result, manifest=None):
+    """
+    Jobs for the pages 2..N of a novel; with a manifest, only for the pages that are missing or stale.
+    """
+    last_page = None
+    if manifest is not None:
+        last_page = (manifest.get_entry(xmlid) or {}).get("last_page")
+    pages = get_htmlworldcat.generate_pageurls(suchstring, numbers_of_result, settings_dict["page_size"], last_page)
+    return [(settings_dict["lang"], xmlid, number, url) for number, url in pages
+            if manifest is None or not manifest.is_fresh(xmlid, number)]
+
+
+def enqueue_novels(settings_dict, data, queue):
+    """
+    Adds the jobs for the novels of the metadata table: the first page, or, if it is already there,
+    the missing pages 2..N.
+
+    output: number of jobs added
+    """
+    store = html_store.open_store(settings_dict)
+    manifest = fetch_manifest.FetchManifest(settings_dict["write_file"], store, settings_dict["refresh_older_than"])
+    jobs = []
+    for i, row in data.iterrows():
+        suchstring = get_htmlworldcat.generate_suchstring(settings_dict, get_htmlworldcat.get_title(row), get_htmlworldcat.get_author(row))
+        manifest.bootstrap(row["xmlid"], suchstring, get_htmlworldcat.get_number_of_results)
+        if not manifest.is_fresh(row["xmlid"], 1):
+            jobs.append((settings_dict["lang"], row["xmlid"], 1, suchstring))
+        elif manifest.get_entry(row["xmlid"])["hits"] is not None:
+            jobs += get_page_jobs(settings_dict, row["xmlid"], suchstring, manifest.get_entry(row["xmlid"])["hits"], manifest)
+    manifest.save()
+    store.close()
+    added = queue.enqueue(jobs)
+    print(settings_dict["lang"], "jobs added:", added)
+    return added
+
+
+def work(settings_dicts, name=None, poll=1.0):
+    """
+    One worker: claims jobs until no job is queued or leased any more, downloads the pages
+    and writes them into the store of their language.
+
+    output: number of jobs done by the worker
+    """
+    first = settings_dicts[0]
+    name = name or "{}-{}".format(socket.gethostname(), os.getpid())
+    settings = {settings_dict["lang"]: settings_dict for settings_dict in settings_dicts}
+    queue = open_queue(first)
+    session = http_fetch.get_session(first)
+    limiter = http_fetch.get_limiter(first)
+    stores = {}
+    done = 0
+    try:
+        while True:
+            job = queue.claim(name)
+            if job is None:
+                if queue.is_finished():
+                    break
+                time.sleep(poll)                # the remaining jobs are leased to other workers, which may fail
+                continue
+            settings_dict = settings.get(job["lang"])
+            if settings_dict is None:
+                queue.fail(job, "language not configured for worker {}".format(name))
+                continue
+            try:
+                with keep_lease(queue, job):
+                    html = http_fetch.fetch(session, job["url"], limiter)
+            except requests.RequestException as error:
+                print(name, job["xmlid"], "page", job["page"], "failed:", error)
+                queue.fail(job, error)
+                continue
+            if job["lang"] not in stores:
+                stores[job["lang"]] = html_store.open_store(settings_dict)
+            store = stores[job["lang"]]
+            if job["page"] == 1:
+                numbers_of_result = get_htmlworldcat.get_number_of_results(html)
+                store.write_page(job["xmlid"], 1, html)
+                following = []
+                if numbers_of_result is not None:
+                    following = get_page_jobs(settings_dict, job["xmlid"], job["url"], numbers_of_result)
+                queue.complete(job, numbers_of_result, get_htmlworldcat.get_hits_hash(html), following)
+            else:
+                digest = get_htmlworldcat.get_hits_hash(html)
+                if digest is None or queue.has_hash(job, digest):
+                    queue.skip(job, "no hits" if digest is None else "same hits as an earlier page")
+                else:
+                    store.write_page(job["xmlid"], job["page"], html)
+                    queue.complete(job, sha1=digest)
+            done += 1
+    finally:
+        for store in stores.values():
+            store.close()
+        queue.close()
+    print(name, "jobs done:", done)
+    return done
+
+
+def collect(settings_dict, queue):
+    """
+    Records the pages downloaded by the workers in the manifest of the language.
+    The pages of each novel are checked in order, like in get_htmlworldcat.harvest_many: the workers
+    download them at the same time, so a page with the same hits as an earlier page may have been
+    saved before that page was there; it is removed again, together with all stored pages after it
+    (also those of earlier runs), and the last page before it is recorded as last_page.
+
+    output: dictionary with the number of results for each xmlid whose first page was downloaded
+    """
+    store = html_store.open_store(settings_dict)
+    manifest = fetch_manifest.FetchManifest(settings_dict["write_file"], store, settings_dict["refresh_older_than"])
+    jobs = queue.get_finished(settings_dict["lang"])
+    results = {}
+    downloaded = 0
+    stopped = 0
+    for xmlid, novel in itertools.groupby(jobs, key=lambda job: job["xmlid"]):
+        hashes = set()
+        last_page = None
+        for job in novel:
+            if last_page is None and job["state"] == "done" and (job["page"] == 1 or job["sha1"] not in hashes):
+                hashes.add(job["sha1"])
+                manifest.record_page(xmlid, job["url"], job["page"], store.read_page(xmlid, job["page"]), job["hits"])
+                if job["page"] == 1:
+                    results[xmlid] = job["hits"]
+                    pages = len(get_htmlworldcat.generate_pageurls(job["url"], job["hits"] or 0, settings_dict["page_size"])) + 1
+                    get_htmlworldcat.delete_pages_after(store, manifest, xmlid, pages)
+                downloaded += 1
+                continue
+            if last_page is None:
+                last_page = job["page"] - 1
+        if last_page is not None:
+            get_htmlworldcat.delete_pages_after(store, manifest, xmlid, last_page)
+            manifest.set_last_page(xmlid, last_page)
+            stopped += 1
+    manifest.save()
+    store.close()
+    queue.set_collected(jobs)
+    instrumentation.count("pages_downloaded", downloaded)
+    instrumentation.count("pages_stopped", stopped)
+    print(settings_dict["lang"], "pages collected:", downloaded)
+    return results
+
+
+def print_progress(progress, started=None):
+    for lang, states in progress.items():
+        total = sum(states.values())
+        finished = states["done"] + states["skipped"] + states["failed"]
+        line = "{}: {}/{} jobs finished ({})".format(lang, finished, total, ", ".join("{} {}".format(number, state) for state, number in states.items() if number))
+        if started is not None:
+            line += " after {:.0f} s".format(time.monotonic() - started)
+        print(line)
+
+
+def run(settings_dicts, workers=None, interval=10.0):
+    """
+    Harvest with the work queue on this machine: enqueues the novels, starts the worker processes,
+    shows the progress until they are finished and collects the pages.
+
+    output: like get_htmlworldcat.harvest_many, dictionary lang -> {xmlid: number of results}
+    """
+    first = settings_dicts[0]
+    workers = workers or first["queue_workers"] or 1
+    queue = open_queue(first)
+    for settings_dict in settings_dicts:
+        enqueue_novels(settings_dict, get_htmlworldcat.read_csv(settings_dict["csv_file"]), queue)
+    started = time.monotonic()
+    processes = [multiprocessing.Process(target=work, args=(settings_dicts, "{}-{}".format(socket.gethostname(), i)))
+                 for i in range(workers)]
+    for process in processes:
+        process.start()
+    running = list(processes)
+    while running:
+        running[0].join(interval)
+        running = [process for process in running if process.is_alive()]
+        if running:
+            print_progress(queue.get_progress(), started)
+    results = {settings_dict["lang"]: collect(settings_dict, queue) for settings_dict in settings_dicts}
+    progress = queue.get_progress()
+    print_progress(progress, started)
+    instrumentation.count("jobs_failed", sum(progress.get(settings_dict["lang"], {}).get("failed", 0) for settings_dict in settings_dicts))
+    queue.close()
+    return results
+
+
+# === Coordinating function ===
+
+def main(command, settings_dicts, name=None, workers=None):
+    if command == "enqueue":
+        queue = open_queue(settings_dicts[0])
+        for settings_dict in settings_dicts:
+            enqueue_novels(settings_dict, get_htmlworldcat.read_csv(settings_dict["csv_file"]), queue)
+    elif command == "work":
+        work(settings_dicts, name)
+    elif command == "progress":
+        print_progress(open_queue(settings_dicts[0]).get_progress())
+    elif command == "collect":
+        queue = open_queue(settings_dicts[0])
+        for settings_dict in settings_dicts:
+            collect(settings_dict, queue)
+    else:
+        run(settings_dicts, workers)
+
+
+if __name__ == "__main__":
+    import run_worldcat
+    parser = argparse.ArgumentParser(description="Download of the worldcat pages by several workers through a work queue.")
+    parser.add_argument("command", choices=COMMANDS)
+    parser.add_argument("--config", default=run_worldcat.configfile, metavar="FILE", help="configuration file (default: config.yaml)")
+    parser.add_argument("--set", action="append", dest="overrides", metavar="KEY=VALUE", help="overrides a parameter of the configuration file (can be repeated)")
+    parser.add_argument("--name", help="name of the worker (default: host-pid)")
+    parser.add_argument("--workers", type=int, help="run: number of worker processes (default: queue_workers)")
+    args = parser.parse_args()
+    try:
+        overrides = run_worldcat.parse_overrides(args.overrides)
+    except ValueError as error:
+        parser.error(str(error))
+    main(args.command, run_worldcat.read_config(args.config, overrides), args.name, args.workers)